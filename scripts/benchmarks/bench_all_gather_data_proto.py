@@ -0,0 +1,106 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the packed `all_gather_data_proto` (one collective for the payload sizes and one for the buffer) with the
+previous per-key gather followed by `all_gather_object` for the non_tensor_batch, on the prompts sent to the rollout.
+Uses nccl on gpus and gloo otherwise.
+
+python3 scripts/benchmarks/bench_all_gather_data_proto.py --world_size 8 --batch_size 64 --prompt_length 2048
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from verl.protocol import DataProto, all_gather_data_proto, allgather_dict_tensors
+
+
+def make_batch(rank: int, args: argparse.Namespace, device: torch.device) -> DataProto:
+    batch_size, prompt_length = args.batch_size, args.prompt_length
+    tensors = {
+        "input_ids": torch.randint(0, 1000, (batch_size, prompt_length), device=device),
+        "attention_mask": torch.ones(batch_size, prompt_length, dtype=torch.long, device=device),
+        "position_ids": torch.arange(prompt_length, device=device).expand(batch_size, 3, -1).contiguous(),
+    }
+    raw_prompt_ids = np.empty(batch_size, dtype=object)  # the pickled payloads differ in size across the ranks
+    raw_prompt_ids[:] = [list(range(prompt_length - rank)) for _ in range(batch_size)]
+    non_tensors = {
+        "raw_prompt_ids": raw_prompt_ids,
+        "multi_modal_data": np.array([{"images": [b"x" * args.image_bytes]}] * batch_size, dtype=object),
+    }
+    return DataProto.from_dict(tensors, non_tensors, meta_info={"eos_token_id": 0})
+
+
+def all_gather_per_key(data: DataProto, size: int, group) -> None:
+    data.batch = allgather_dict_tensors(data.batch.contiguous(), size=size, group=group, dim=0)
+    all_non_tensor_batch = [None for _ in range(size)]
+    dist.all_gather_object(all_non_tensor_batch, data.non_tensor_batch, group=group)
+    data.non_tensor_batch = {k: np.concatenate([d[k] for d in all_non_tensor_batch]) for k in data.non_tensor_batch}
+
+
+def worker(rank: int, args: argparse.Namespace, init_method: str) -> None:
+    backend = "nccl" if torch.cuda.is_available() else "gloo"
+    device = torch.device("cuda", rank) if backend == "nccl" else torch.device("cpu")
+    if backend == "nccl":
+        torch.cuda.set_device(rank)
+
+    dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=args.world_size)
+    results = {}
+    for name, function in [("per-key", all_gather_per_key), ("packed", all_gather_data_proto)]:
+        function(make_batch(rank, args, device), args.world_size, dist.group.WORLD)  # warmup
+        elapsed = []
+        for _ in range(args.repeats):
+            data = make_batch(rank, args, device)
+            dist.barrier()
+            start_time = time.perf_counter()
+            function(data, args.world_size, dist.group.WORLD)
+            if backend == "nccl":
+                torch.cuda.synchronize()
+
+            elapsed.append(time.perf_counter() - start_time)
+
+        results[name] = min(elapsed)
+
+    if rank == 0:
+        print(f"{backend}: {args.world_size} ranks, {args.batch_size} samples per rank.")
+        for name, elapsed in results.items():
+            print(f"{name}: {elapsed * 1000:.1f}ms.")
+
+        print(f"speedup: {results['per-key'] / results['packed']:.2f}x.")
+
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world_size", default=2, type=int)
+    parser.add_argument("--batch_size", default=64, type=int, help="The number of samples per rank")
+    parser.add_argument("--prompt_length", default=1024, type=int)
+    parser.add_argument("--image_bytes", default=64 * 1024, type=int)
+    parser.add_argument("--repeats", default=5, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as init_dir:
+        init_method = f"file://{os.path.join(init_dir, 'init')}"
+        mp.spawn(worker, args=(args, init_method), nprocs=args.world_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares building the chat prompts from the cached template pieces with rendering the chat template of each example,
+on text and image prompts with the format prompt applied.
+
+python3 scripts/benchmarks/bench_chat_template.py --model_path Qwen/Qwen2.5-VL-7B-Instruct --num_examples 1000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import datasets
+
+from verl.utils.dataset import RLHFDataset
+from verl.utils.tokenizer import get_processor, get_tokenizer
+
+
+FORMAT_PROMPT = (
+    "{{ content | trim }} You FIRST think about the reasoning process as an internal monologue and then provide the "
+    "final answer. The final answer MUST BE put in \\boxed{}."
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of a qwen2vl model or processor")
+    parser.add_argument("--num_examples", default=1000000, type=int)
+    parser.add_argument("--num_render_examples", default=100000, type=int, help="Rendering is extrapolated from them")
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.model_path)
+    processor = get_processor(args.model_path)
+    with tempfile.TemporaryDirectory() as data_dir:
+        format_prompt = os.path.join(data_dir, "format.jinja")
+        with open(format_prompt, "w") as f:
+            f.write(FORMAT_PROMPT)
+
+        datasets.Dataset.from_dict({"prompt": ["question"], "answer": ["0"]}).to_parquet(f"{data_dir}/train.parquet")
+        dataset = RLHFDataset(
+            data_dir,
+            tokenizer=tokenizer,
+            processor=processor,
+            format_prompt=format_prompt,
+            filter_overlong_prompts=False,
+        )
+
+    examples = []
+    for idx in range(1000):  # half of the prompts have images
+        if idx % 2 == 0:
+            examples.append({"prompt": f"What is {idx} + {idx}?"})
+        else:
+            examples.append({"prompt": f"<image>How many objects are there in picture {idx}?", "images": []})
+
+    all_messages = [dataset._build_messages(example) for example in examples]
+    print(f"cached template pieces: {sorted(dataset.chat_template_pieces.keys())}.")
+    results = {}
+    for name, function, num_examples in [
+        ("render", dataset._render_messages, args.num_render_examples),
+        ("cached", dataset._apply_chat_template, args.num_examples),
+    ]:
+        start_time = time.perf_counter()
+        for idx in range(num_examples):
+            function(all_messages[idx % len(all_messages)])
+
+        results[name] = (time.perf_counter() - start_time) / num_examples
+
+    prompts_agree = all(
+        dataset._apply_chat_template(messages) == dataset._render_messages(messages) for messages in all_messages
+    )
+    for name, elapsed in results.items():
+        print(
+            f"{name}: {elapsed * 1e6:.2f}us per example, {elapsed * args.num_examples:.1f}s per {args.num_examples}."
+        )
+
+    print(f"speedup: {results['render'] / results['cached']:.1f}x, prompts agree: {prompts_agree}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares padding each example to the max prompt length in int64 in `__getitem__` and stacking the batch, with keeping
+the unpadded int32 ids in the examples and padding them in `RLHFDataset.collate_fn`. Reports the tensor bytes of an
+example, which the dataloader workers hold and send to the main process, and the collate throughput.
+
+python3 scripts/benchmarks/bench_collate.py --model_path Qwen/Qwen2.5-VL-7B-Instruct --max_prompt_length 4096
+"""
+
+import argparse
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import datasets
+import torch
+
+from verl.utils import torch_functional as VF
+from verl.utils.dataset import RLHFDataset, collate_fn
+from verl.utils.tokenizer import get_tokenizer
+
+
+def make_features(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Makes the unpadded examples of qwen2vl, whose mrope position ids have 3 rows."""
+    generator = torch.Generator().manual_seed(0)
+    lengths = torch.randint(
+        args.max_prompt_length // 8, args.max_prompt_length, (args.num_examples,), generator=generator
+    )
+    features = []
+    for idx, length in enumerate(lengths.tolist()):
+        features.append(
+            {
+                "input_ids": torch.randint(0, 1000, (length,), generator=generator, dtype=torch.int32),
+                "position_ids": torch.arange(length, dtype=torch.int32).expand(3, -1).contiguous(),
+                "raw_prompt_ids": list(range(length)),
+                "ground_truth": str(idx),
+                "dataset_index": idx,
+            }
+        )
+
+    return features
+
+
+def pad_example(dataset: RLHFDataset, feature: Dict[str, Any]) -> Dict[str, Any]:
+    """The previous `__getitem__`, which pads each example in int64."""
+    input_ids = feature["input_ids"].long()
+    input_ids, attention_mask, position_ids = VF.postprocess_data(
+        input_ids=input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        position_ids=feature["position_ids"].long(),
+        max_length=dataset.max_prompt_length,
+        pad_token_id=dataset.tokenizer.pad_token_id,
+        left_pad=True,
+        truncation=dataset.truncation,
+    )
+    return {**feature, "input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids}
+
+
+def get_tensor_bytes(feature: Dict[str, Any]) -> int:
+    return sum(v.numel() * v.element_size() for v in feature.values() if isinstance(v, torch.Tensor))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of a tokenizer")
+    parser.add_argument("--max_prompt_length", default=4096, type=int)
+    parser.add_argument("--num_examples", default=4096, type=int)
+    parser.add_argument("--batch_size", default=512, type=int)
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.model_path)
+    with tempfile.TemporaryDirectory() as data_dir:
+        datasets.Dataset.from_dict({"prompt": ["question"], "answer": ["0"]}).to_parquet(f"{data_dir}/train.parquet")
+        dataset = RLHFDataset(
+            data_dir, tokenizer=tokenizer, processor=None, max_prompt_length=args.max_prompt_length, truncation="right"
+        )
+
+    features = make_features(args)
+    padded_features = [pad_example(dataset, feature) for feature in features]
+    padded_bytes = sum(map(get_tensor_bytes, padded_features)) / len(features)
+    compact_bytes = sum(map(get_tensor_bytes, features)) / len(features)
+    print(f"{len(features)} examples of at most {args.max_prompt_length} tokens, batch size {args.batch_size}.")
+    print(f"padded int64: {padded_bytes / 1024:.1f}KB per example, unpadded int32: {compact_bytes / 1024:.1f}KB.")
+
+    batches = [features[i : i + args.batch_size] for i in range(0, len(features), args.batch_size)]
+    padded_batches = [padded_features[i : i + args.batch_size] for i in range(0, len(features), args.batch_size)]
+    results = {}
+    for name, function, inputs in [
+        ("stack the padded examples", collate_fn, padded_batches),  # without the padding in `__getitem__`
+        ("pad per example", lambda batch: collate_fn([pad_example(dataset, feature) for feature in batch]), batches),
+        ("pad in collate", dataset.collate_fn, batches),
+    ]:
+        start_time = time.perf_counter()
+        for batch in inputs:
+            function(batch)
+
+        results[name] = len(features) / (time.perf_counter() - start_time)
+        print(f"{name}: {results[name]:.0f} examples/s.")
+
+    print(f"speedup: {results['pad in collate'] / results['pad per example']:.2f}x.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the column-sharing and the deep `DataProto.copy` with `copy.deepcopy` on a rollout batch with images.
+
+python3 scripts/benchmarks/bench_dataproto_copy.py --batch_size 4096 --prompt_length 2048 --response_length 4096
+"""
+
+import argparse
+import copy
+import time
+from typing import Callable
+
+import numpy as np
+import torch
+from PIL import Image
+
+from verl.protocol import DataProto
+
+
+def make_batch(batch_size: int, prompt_length: int, response_length: int, num_images: int) -> DataProto:
+    seq_length = prompt_length + response_length
+    image = Image.new("RGB", (512, 512))
+    image.load()
+    tensors = {
+        "prompts": torch.randint(0, 1000, (batch_size, prompt_length)),
+        "responses": torch.randint(0, 1000, (batch_size, response_length)),
+        "input_ids": torch.randint(0, 1000, (batch_size, seq_length)),
+        "attention_mask": torch.ones(batch_size, seq_length, dtype=torch.long),
+        "position_ids": torch.arange(seq_length).expand(batch_size, 3, -1).clone(),
+        "response_mask": torch.ones(batch_size, response_length, dtype=torch.long),
+        "old_log_probs": torch.randn(batch_size, response_length),
+    }
+    non_tensors = {
+        "uid": np.array([str(idx // 8) for idx in range(batch_size)], dtype=object),
+        "ground_truth": np.array([str(idx) for idx in range(batch_size)], dtype=object),
+        "multi_modal_data": np.array([{"images": [image] * num_images} for _ in range(batch_size)], dtype=object),
+    }
+    return DataProto.from_dict(tensors, non_tensors, meta_info={"temperature": 1.0, "global_steps": 1})
+
+
+def timeit(function: Callable[[], DataProto], repeats: int) -> float:
+    function()  # warmup
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", default=1024, type=int)
+    parser.add_argument("--prompt_length", default=1024, type=int)
+    parser.add_argument("--response_length", default=2048, type=int)
+    parser.add_argument("--num_images", default=2, type=int, help="The number of 512x512 images per sample")
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+
+    data = make_batch(args.batch_size, args.prompt_length, args.response_length, args.num_images)
+    tensor_bytes = sum(tensor.numel() * tensor.element_size() for tensor in data.batch.values())
+    print(f"batch: {args.batch_size} samples, {tensor_bytes / 2**30:.2f} GiB of tensors.")
+    deepcopy_time = timeit(lambda: copy.deepcopy(data), args.repeats)
+    deep_copy_time = timeit(lambda: data.copy(deep=True), args.repeats)
+    copy_time = timeit(data.copy, args.repeats)
+    print(f"deepcopy: {deepcopy_time * 1000:.1f}ms, copy(deep=True): {deep_copy_time * 1000:.1f}ms.")
+    print(f"copy: {copy_time * 1000:.3f}ms, speedup over deepcopy: {deepcopy_time / copy_time:.0f}x.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the rollout makespan of the loader order with the one balanced and sorted by the predicted response lengths,
+on a trace of response lengths per prompt and epoch. Each rank decodes `max_num_seqs` sequences at a time and a
+free slot takes the next sequence in the submission order, so the makespan is counted in decoding steps.
+
+The trace is a .npy array of shape (num_epochs, num_prompts, n), a synthetic one is used if not given.
+
+python3 scripts/benchmarks/bench_length_balancing.py --world_size 8 --rollout_batch_size 512 --n 8
+"""
+
+import argparse
+import heapq
+from typing import List, Optional
+
+import numpy as np
+
+from verl.utils.seqlen_balancing import ResponseLengthPredictor, get_seqlen_balanced_partitions
+
+
+def make_trace(num_epochs: int, num_prompts: int, n: int, response_length: int, seed: int) -> np.ndarray:
+    """The prompts have their own typical lengths, the samples vary around them."""
+    rng = np.random.default_rng(seed)
+    prompt_lengths = rng.lognormal(mean=np.log(response_length / 6), sigma=0.8, size=(1, num_prompts, 1))
+    lengths = prompt_lengths * rng.lognormal(mean=0.0, sigma=0.3, size=(num_epochs, num_prompts, n))
+    return np.clip(np.round(lengths), 1, response_length).astype(np.int64)
+
+
+def get_rank_makespan(lengths: List[int], max_num_seqs: int) -> int:
+    slots = [0] * max_num_seqs
+    for length in lengths:
+        heapq.heappush(slots, heapq.heappop(slots) + length)
+
+    return max(slots)
+
+
+def get_makespan(lengths: np.ndarray, world_size: int, max_num_seqs: int, predicted: Optional[np.ndarray]) -> int:
+    """The makespan of a rollout batch, lengths is of shape (batch_size, n)."""
+    if predicted is None:  # chunked in loader order
+        partitions = np.array_split(np.arange(len(lengths)), world_size)
+    else:  # as RayPPOTrainer._sort_by_predicted_length and the vllm rollout
+        partitions = get_seqlen_balanced_partitions(
+            np.ceil(predicted).astype(np.int64).tolist(), k_partitions=world_size, equal_size=True
+        )
+        partitions = [sorted(partition, key=lambda idx: -predicted[idx]) for partition in partitions]
+
+    return max(get_rank_makespan(lengths[partition].reshape(-1).tolist(), max_num_seqs) for partition in partitions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", default=None, type=str, help="The .npy trace of (num_epochs, num_prompts, n)")
+    parser.add_argument("--num_epochs", default=3, type=int)
+    parser.add_argument("--num_prompts", default=4096, type=int)
+    parser.add_argument("--n", default=8, type=int)
+    parser.add_argument("--response_length", default=8192, type=int)
+    parser.add_argument("--world_size", default=8, type=int)
+    parser.add_argument("--rollout_batch_size", default=512, type=int)
+    parser.add_argument("--max_num_seqs", default=256, type=int, help="The number of sequences decoded per rank")
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        trace = np.load(args.trace)
+    else:
+        trace = make_trace(args.num_epochs, args.num_prompts, args.n, args.response_length, args.seed)
+
+    num_epochs, num_prompts, _ = trace.shape
+    rng = np.random.default_rng(args.seed)
+    predictor = ResponseLengthPredictor()
+    makespans = {"loader order": [], "predicted": []}
+    for epoch in range(num_epochs):
+        order = rng.permutation(num_prompts)
+        for start in range(0, num_prompts - args.rollout_batch_size + 1, args.rollout_batch_size):
+            indices = order[start : start + args.rollout_batch_size]
+            lengths = trace[epoch, indices]
+            if epoch > 0:  # the predictor is fitted after the first epoch
+                makespans["loader order"].append(get_makespan(lengths, args.world_size, args.max_num_seqs, None))
+                predicted = predictor.predict(indices)
+                makespans["predicted"].append(get_makespan(lengths, args.world_size, args.max_num_seqs, predicted))
+
+            predictor.update(np.repeat(indices, trace.shape[-1]), lengths.reshape(-1).astype(np.float64))
+
+    print(f"{num_prompts} prompts x {trace.shape[-1]} samples, {len(makespans['predicted'])} steps measured.")
+    for name, values in makespans.items():
+        print(f"{name}: {np.sum(values)} decoding steps, {np.mean(values):.0f} per step.")
+
+    print(f"speedup: {np.sum(makespans['loader order']) / np.sum(makespans['predicted']):.2f}x.")
+
+
+if __name__ == "__main__":
+    main()
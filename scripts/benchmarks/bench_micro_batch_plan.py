@@ -0,0 +1,147 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the micro-batch planning of the ppo epochs: stacking the samples one by one at each epoch, planning every
+mini-batch once before the epochs, and planning each mini-batch lazily when it is trained (reusing the partitions
+across the epochs, or shuffling the mini-batches at each epoch). Reports the planning time and the peak bytes of the
+micro-batches alive at the same time, which are a second copy of the batch.
+
+python3 scripts/benchmarks/bench_micro_batch_plan.py --num_samples 4096 --ppo_epochs 4
+"""
+
+import argparse
+import time
+from typing import List
+
+import numpy as np
+import torch
+from tensordict import TensorDict
+
+from verl.protocol import DataProto
+from verl.utils.seqlen_balancing import get_seqlen_balanced_partitions, prepare_dynamic_batch
+
+
+def prepare_dynamic_batch_stacked(data: DataProto, max_token_len: int) -> List[DataProto]:
+    """The micro-batch planning that `prepare_dynamic_batch` replaces, gathering the samples one by one."""
+    batch: TensorDict = data.batch
+    effective_seqlen = torch.sum(batch["attention_mask"], dim=-1)
+    num_micro_batches = min(len(effective_seqlen), -(effective_seqlen.sum().item() // -max_token_len))
+    effective_seqlen = effective_seqlen.tolist()
+    micro_bsz_idx = get_seqlen_balanced_partitions(effective_seqlen, num_micro_batches, equal_size=False)
+    micro_bsz_idx.sort(key=lambda partition: sum(effective_seqlen[idx] ** 2 for idx in partition), reverse=True)
+    micro_batches = []
+    for partition in micro_bsz_idx:
+        tensors = dict(torch.stack([batch[idx] for idx in partition]))
+        non_tensors = {key: value[partition] for key, value in data.non_tensor_batch.items()}
+        micro_batches.append(DataProto.from_dict(tensors, non_tensors))
+
+    return micro_batches
+
+
+def make_batch(num_samples: int, prompt_length: int, response_length: int, seed: int) -> DataProto:
+    generator = torch.Generator().manual_seed(seed)
+    seq_length = prompt_length + response_length
+    prompt_lengths = torch.randint(prompt_length // 4, prompt_length + 1, (num_samples, 1), generator=generator)
+    response_lengths = torch.randint(1, response_length + 1, (num_samples, 1), generator=generator)
+    positions = torch.arange(seq_length)
+    attention_mask = (positions >= prompt_length - prompt_lengths) & (positions < prompt_length + response_lengths)
+    tensors = {
+        "input_ids": torch.randint(0, 1000, (num_samples, seq_length), generator=generator),
+        "attention_mask": attention_mask.long(),
+        "position_ids": positions.expand(num_samples, -1).clone(),
+        "responses": torch.randint(0, 1000, (num_samples, response_length), generator=generator),
+        "response_mask": attention_mask[:, prompt_length:].long(),
+        "old_log_probs": torch.randn(num_samples, response_length, generator=generator),
+        "advantages": torch.randn(num_samples, response_length, generator=generator),
+    }
+    multi_modal_inputs = np.array([{"pixel_values": torch.zeros(4, 8)} for _ in range(num_samples)], dtype=object)
+    return DataProto.from_dict(tensors, {"multi_modal_inputs": multi_modal_inputs})
+
+
+def get_nbytes(micro_batches: List[DataProto]) -> int:
+    return sum(tensor.nbytes for micro_batch in micro_batches for tensor in micro_batch.batch.values())
+
+
+def plan_stacked(data: DataProto, args: argparse.Namespace, max_token_len: int) -> int:
+    peak_bytes = 0
+    for _ in range(args.ppo_epochs):
+        for mini_batch in data.split(args.mini_batch_size):
+            micro_batches = prepare_dynamic_batch_stacked(mini_batch, max_token_len)
+            peak_bytes = max(peak_bytes, get_nbytes(micro_batches))
+
+    return peak_bytes
+
+
+def plan_upfront(data: DataProto, args: argparse.Namespace, max_token_len: int) -> int:
+    micro_batches_list = [
+        prepare_dynamic_batch(mini_batch, max_token_len)[0] for mini_batch in data.split(args.mini_batch_size)
+    ]
+    for _ in range(args.ppo_epochs):
+        for micro_batches in micro_batches_list:
+            for micro_batch in micro_batches:
+                pass
+
+    return sum(get_nbytes(micro_batches) for micro_batches in micro_batches_list)
+
+
+def plan_lazily(data: DataProto, args: argparse.Namespace, max_token_len: int, shuffle: bool) -> int:
+    peak_bytes, batch_idx_lists = 0, {}
+    for _ in range(args.ppo_epochs):
+        mini_batches = data.make_iterator(args.mini_batch_size, epochs=1, dataloader_kwargs={"shuffle": shuffle})
+        for mini_batch_idx, mini_batch in enumerate(mini_batches):
+            micro_batches, batch_idx_list = prepare_dynamic_batch(
+                mini_batch, max_token_len, batch_idx_list=batch_idx_lists.get(mini_batch_idx)
+            )
+            if not shuffle:
+                batch_idx_lists[mini_batch_idx] = batch_idx_list
+
+            peak_bytes = max(peak_bytes, get_nbytes(micro_batches))
+
+    return peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_samples", default=4096, type=int, help="The number of samples on a device")
+    parser.add_argument("--prompt_length", default=512, type=int)
+    parser.add_argument("--response_length", default=1536, type=int)
+    parser.add_argument("--mini_batch_size", default=512, type=int, help="The global batch size per device")
+    parser.add_argument("--micro_batch_size", default=4, type=int, help="The micro batch size per device")
+    parser.add_argument("--ppo_epochs", default=4, type=int)
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    data = make_batch(args.num_samples, args.prompt_length, args.response_length, args.seed)
+    max_token_len = args.micro_batch_size * (args.prompt_length + args.response_length)
+    stacked = prepare_dynamic_batch_stacked(data.slice_select(0, args.mini_batch_size), max_token_len)
+    planned = prepare_dynamic_batch(data.slice_select(0, args.mini_batch_size), max_token_len)[0]
+    for stacked_micro_batch, planned_micro_batch in zip(stacked, planned):
+        assert torch.equal(stacked_micro_batch.batch["input_ids"], planned_micro_batch.batch["input_ids"])
+
+    data_bytes = sum(tensor.nbytes for tensor in data.batch.values())
+    print(f"{args.num_samples} samples ({data_bytes / 1024**2:.0f}MB), {args.ppo_epochs} ppo epochs.")
+    for name, function in [
+        ("stacked at each epoch", plan_stacked),
+        ("planned upfront", plan_upfront),
+        ("planned lazily", lambda *inputs: plan_lazily(*inputs, shuffle=False)),
+        ("planned lazily, shuffled", lambda *inputs: plan_lazily(*inputs, shuffle=True)),
+    ]:
+        start_time = time.perf_counter()
+        peak_bytes = function(data, args, max_token_len)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name}: {elapsed * 1000:.1f}ms, peak micro-batches {peak_bytes / 1024**2:.0f}MB.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the response padding that builds padded tuples with the one that writes into a numpy buffer.
+
+python3 scripts/benchmarks/bench_pad_responses.py --num_responses 4096 --response_length 8192
+"""
+
+import argparse
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+
+from verl.utils.torch_functional import pad_2d_list_to_numpy
+
+
+def pad_with_tuples(response: List[List[int]], pad_token_id: int, max_length: Optional[int] = None) -> torch.Tensor:
+    """The padding that `pad_2d_list_to_numpy` replaces."""
+    target_length = max(max(len(sub_list) for sub_list in response), max_length or 0)
+    padded_response = [tuple(sub_list) + (pad_token_id,) * (target_length - len(sub_list)) for sub_list in response]
+    return torch.tensor(padded_response)
+
+
+def timeit(function: Callable[[], torch.Tensor], repeats: int) -> float:
+    function()  # warmup
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_responses", default=1024, type=int)
+    parser.add_argument("--response_length", default=4096, type=int)
+    parser.add_argument("--repeats", default=3, type=int)
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    lengths = rng.integers(1, args.response_length + 1, size=args.num_responses)
+    response = [rng.integers(0, 150000, size=length).tolist() for length in lengths]
+    print(f"{args.num_responses} responses, {lengths.mean():.0f} tokens on average.")
+
+    def pad_with_numpy() -> torch.Tensor:
+        return torch.from_numpy(pad_2d_list_to_numpy(response, 0, args.response_length, dtype=np.int32))
+
+    assert torch.equal(pad_with_tuples(response, 0, args.response_length), pad_with_numpy().long())
+    tuple_time = timeit(lambda: pad_with_tuples(response, 0, args.response_length), args.repeats)
+    numpy_time = timeit(pad_with_numpy, args.repeats)
+    print(f"tuples: {tuple_time * 1000:.1f}ms, numpy: {numpy_time * 1000:.1f}ms.")
+    print(f"speedup: {tuple_time / numpy_time:.1f}x.")
+
+
+if __name__ == "__main__":
+    main()
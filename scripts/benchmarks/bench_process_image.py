@@ -0,0 +1,134 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the previous `process_image` (full decode and a single resize) with the jpeg draft mode and the reduced
+resize, returning pil images or uint8 arrays, on a corpus of mixed resolution jpeg and png images. Each case runs in a
+fresh process and reports ms/image and the peak RSS, including the image processor if a model path is given.
+
+python3 scripts/benchmarks/bench_process_image.py --model_path Qwen/Qwen2.5-VL-7B-Instruct --num_images 256
+"""
+
+import argparse
+import math
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from verl.utils.dataset import process_image
+from verl.utils.tokenizer import get_processor
+
+
+IMAGE_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3000, 2000), (4032, 3024), (800, 6000)]
+
+
+def get_peak_rss_mb() -> float:
+    """Reads the peak RSS of the process, which unlike `ru_maxrss` can be reset."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+    raise RuntimeError("VmHWM is not found in /proc/self/status.")
+
+
+def reset_peak_rss() -> None:
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def process_image_reference(image_path: str, min_pixels: Optional[int], max_pixels: Optional[int]) -> Image.Image:
+    image = Image.open(image_path)
+    image.load()
+    if max_pixels is not None and (image.width * image.height) > max_pixels:
+        resize_factor = math.sqrt(max_pixels / (image.width * image.height))
+        image = image.resize((int(image.width * resize_factor), int(image.height * resize_factor)))
+
+    if min_pixels is not None and (image.width * image.height) < min_pixels:
+        resize_factor = math.sqrt(min_pixels / (image.width * image.height))
+        image = image.resize((int(image.width * resize_factor), int(image.height * resize_factor)))
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image
+
+
+def make_corpus(data_dir: str, num_images: int) -> List[str]:
+    """Writes the images to files, so that the cases only hold the image being processed."""
+    rng = np.random.default_rng(0)
+    corpus = []
+    for idx in range(num_images):
+        width, height = IMAGE_SIZES[idx % len(IMAGE_SIZES)]
+        x, y = np.meshgrid(np.linspace(0, 255, width, dtype=np.float32), np.linspace(0, 255, height, dtype=np.float32))
+        noise = rng.integers(0, 32, (height, width), dtype=np.uint8)
+        pixels = np.stack([x, y, (x + y) / 2], axis=-1).astype(np.uint8) + noise[..., None]
+        image_path = os.path.join(data_dir, f"{idx}.jpg" if idx % 2 == 0 else f"{idx}.png")
+        Image.fromarray(pixels).save(image_path)
+        corpus.append(image_path)
+
+    return corpus
+
+
+def run_case(name: str, args: argparse.Namespace, corpus: List[str], queue: mp.Queue) -> None:
+    processor = get_processor(args.model_path) if args.model_path is not None else None
+    reset_peak_rss()
+    start_rss = get_peak_rss_mb()
+    start_time = time.perf_counter()
+    for image_path in corpus:
+        if name == "reference":
+            image = process_image_reference(image_path, args.min_pixels, args.max_pixels)
+        else:
+            image = process_image(image_path, args.min_pixels, args.max_pixels, return_numpy=name == "numpy")
+
+        if processor is not None:
+            kwargs = {"input_data_format": "channels_last"} if name == "numpy" else {}
+            processor.image_processor(images=[image], return_tensors="pt", **kwargs)
+
+    elapsed = (time.perf_counter() - start_time) / len(corpus)
+    peak_rss = get_peak_rss_mb() - start_rss
+    queue.put((elapsed, peak_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None, type=str, help="Also runs the image processor of the model")
+    parser.add_argument("--num_images", default=96, type=int)
+    parser.add_argument("--min_pixels", default=262144, type=int)
+    parser.add_argument("--max_pixels", default=4194304, type=int)
+    args = parser.parse_args()
+
+    context = mp.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        corpus = make_corpus(data_dir, args.num_images)
+        print(f"{len(corpus)} jpeg and png images of sizes {IMAGE_SIZES}.")
+        for name in ["reference", "pil", "numpy"]:
+            queue = context.Queue()
+            process = context.Process(target=run_case, args=(name, args, corpus, queue))
+            process.start()
+            results[name] = queue.get()
+            process.join()
+            elapsed, peak_rss = results[name]
+            print(f"{name}: {elapsed * 1000:.1f}ms/image, peak RSS +{peak_rss:.0f}MB.")
+
+    print(f"speedup: {results['reference'][0] / results['numpy'][0]:.2f}x.")
+
+
+if __name__ == "__main__":
+    main()
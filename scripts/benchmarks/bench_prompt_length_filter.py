@@ -0,0 +1,99 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the overlong prompt filter that runs the processor with the one that reads the image headers.
+
+python3 scripts/benchmarks/bench_prompt_length_filter.py --model_path Qwen/Qwen2.5-VL-7B-Instruct
+"""
+
+import argparse
+import tempfile
+import time
+from io import BytesIO
+from typing import Any, Dict
+
+import datasets
+import numpy as np
+from PIL import Image
+
+from verl.utils.dataset import RLHFDataset
+from verl.utils.tokenizer import get_processor, get_tokenizer
+
+
+def make_dataset(data_dir: str, num_samples: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    rows = {"prompt": [], "answer": [], "images": []}
+    for idx in range(num_samples):
+        width, height = rng.integers(200, 2400, size=2).tolist()
+        buffer = BytesIO()
+        Image.new("RGB", (width, height), (idx % 256, 64, 128)).save(buffer, format="JPEG")
+        rows["prompt"].append(f"<image>What is shown in picture {idx}?")
+        rows["answer"].append(str(idx))
+        rows["images"].append([{"bytes": buffer.getvalue(), "path": None}])
+
+    features = datasets.Features(
+        {
+            "prompt": datasets.Value("string"),
+            "answer": datasets.Value("string"),
+            "images": datasets.Sequence(datasets.Image()),
+        }
+    )
+    datasets.Dataset.from_dict(rows, features=features).to_parquet(f"{data_dir}/train.parquet")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of a qwen2vl model or processor")
+    parser.add_argument("--num_samples", default=1000, type=int, help="The number of synthetic examples")
+    parser.add_argument("--target_samples", default=100000, type=int, help="The dataset size to extrapolate to")
+    parser.add_argument("--min_pixels", default=262144, type=int)
+    parser.add_argument("--max_pixels", default=4194304, type=int)
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.model_path)
+    processor = get_processor(args.model_path)
+    kwargs = dict(tokenizer=tokenizer, processor=processor, min_pixels=args.min_pixels, max_pixels=args.max_pixels)
+    with tempfile.TemporaryDirectory() as data_dir:
+        make_dataset(data_dir, args.num_samples, args.seed)
+        dataset = RLHFDataset(data_dir, filter_overlong_prompts=False, **kwargs)
+
+        def get_processor_length(example: Dict[str, Any]) -> Dict[str, int]:
+            prompt = dataset._apply_chat_template(dataset._build_messages(example))
+            return {"prompt_length": dataset._get_image_prompt_length(prompt, example["images"])}
+
+        # the filter before the estimator: decode the images and run the processor
+        start_time = time.perf_counter()
+        processor_lengths = dataset.dataset.map(get_processor_length, remove_columns=dataset.dataset.column_names)
+        processor_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        RLHFDataset(data_dir, filter_overlong_prompts=True, filter_overlong_prompts_workers=1, **kwargs)
+        estimator_time = time.perf_counter() - start_time
+        estimator_lengths = dataset.dataset.map(
+            lambda example: {"prompt_length": dataset._get_prompt_length(example)},
+            remove_columns=dataset.dataset.column_names,
+        )
+        lengths_agree = processor_lengths["prompt_length"][:] == estimator_lengths["prompt_length"][:]
+
+    scale = args.target_samples / args.num_samples
+    for name, filter_time in [("processor", processor_time), ("estimator", estimator_time)]:
+        throughput = args.num_samples / filter_time
+        print(f"{name}: {throughput:.1f} samples/s, {filter_time * scale:.1f}s per {args.target_samples} samples.")
+
+    print(f"speedup: {processor_time / estimator_time:.1f}x, lengths agree: {lengths_agree}.")
+
+
+if __name__ == "__main__":
+    main()
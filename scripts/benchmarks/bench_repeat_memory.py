@@ -0,0 +1,147 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the peak RSS of repeating the prompts for the n responses, in a fresh process for each case.
+On the driver, repeating the prompt tensors with the batch is compared with the trainer, which pops them into the
+generation batch first and repeats the remaining columns by reference. On the workers, processing the multi-modal
+inputs of each sample is compared with processing them once per prompt through the group index.
+
+python3 scripts/benchmarks/bench_repeat_memory.py --model_path Qwen/Qwen2.5-VL-7B-Instruct --n 8 16
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+from typing import Any, Dict
+
+import numpy as np
+import torch
+from PIL import Image
+
+from verl.protocol import DataProto, get_group_index
+from verl.utils.dataset import process_image
+from verl.utils.tokenizer import get_processor
+
+
+def get_peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_prompts(args: argparse.Namespace) -> DataProto:
+    generator = torch.Generator().manual_seed(0)
+    tensors = {
+        "input_ids": torch.randint(0, 1000, (args.num_prompts, args.prompt_length), generator=generator),
+        "attention_mask": torch.ones(args.num_prompts, args.prompt_length, dtype=torch.long),
+        "position_ids": torch.arange(args.prompt_length).expand(args.num_prompts, 3, -1).clone(),
+    }
+    multi_modal_data = np.empty(args.num_prompts, dtype=object)
+    for idx in range(args.num_prompts):
+        image = Image.fromarray(np.full((args.image_size, args.image_size, 3), idx % 256, dtype=np.uint8))
+        multi_modal_data[idx] = {"images": [image]}
+
+    non_tensors = {
+        "uid": np.array([str(idx) for idx in range(args.num_prompts)], dtype=object),
+        "ground_truth": np.array([str(idx) for idx in range(args.num_prompts)], dtype=object),
+        "multi_modal_data": multi_modal_data,
+    }
+    return DataProto.from_dict(tensors, non_tensors)
+
+
+def make_generation_output(args: argparse.Namespace, n: int) -> DataProto:
+    batch_size, seq_length = args.num_prompts * n, args.prompt_length + args.response_length
+    tensors = {
+        "prompts": torch.zeros(batch_size, args.prompt_length, dtype=torch.long),
+        "responses": torch.zeros(batch_size, args.response_length, dtype=torch.long),
+        "input_ids": torch.zeros(batch_size, seq_length, dtype=torch.long),
+        "attention_mask": torch.ones(batch_size, seq_length, dtype=torch.long),
+        "response_mask": torch.ones(batch_size, args.response_length, dtype=torch.long),
+        "position_ids": torch.zeros(batch_size, 3, seq_length, dtype=torch.long),
+    }
+    return DataProto.from_dict(tensors)
+
+
+def repeat_with_prompts(args: argparse.Namespace, n: int) -> None:
+    gen_batch_output = make_generation_output(args, n)
+    batch = make_prompts(args).repeat(repeat_times=n, interleave=True)
+    batch.pop(batch_keys=["input_ids", "attention_mask", "position_ids"])
+    batch.union(gen_batch_output)
+
+
+def repeat_without_prompts(args: argparse.Namespace, n: int) -> None:
+    gen_batch_output = make_generation_output(args, n)
+    batch = make_prompts(args)
+    batch.pop(batch_keys=["input_ids", "attention_mask", "position_ids"])  # the generation batch
+    batch.repeat(repeat_times=n, interleave=True).union(gen_batch_output)
+
+
+def process_images(multi_modal_data: Dict[str, Any], processor, args: argparse.Namespace) -> Dict[str, torch.Tensor]:
+    images = [process_image(image, args.min_pixels, args.max_pixels) for image in multi_modal_data["images"]]
+    return dict(processor.image_processor(images=images, return_tensors="pt"))
+
+
+def process_per_sample(args: argparse.Namespace, n: int) -> None:
+    processor = get_processor(args.model_path)
+    batch_multi_modal_data = make_prompts(args).repeat(repeat_times=n).non_tensor_batch["multi_modal_data"]
+    _ = [process_images(multi_modal_data, processor, args) for multi_modal_data in batch_multi_modal_data]
+
+
+def process_per_prompt(args: argparse.Namespace, n: int) -> None:
+    processor = get_processor(args.model_path)
+    batch_multi_modal_data = make_prompts(args).repeat(repeat_times=n).non_tensor_batch["multi_modal_data"]
+    first_indices, group_index = get_group_index(batch_multi_modal_data)
+    group_inputs = [
+        process_images(multi_modal_data, processor, args) for multi_modal_data in batch_multi_modal_data[first_indices]
+    ]
+    _ = [group_inputs[idx] for idx in group_index]
+
+
+def run(name: str, args: argparse.Namespace, n: int, queue: mp.Queue) -> None:
+    baseline = get_peak_rss_mb()
+    CASES[name](args, n)
+    queue.put(get_peak_rss_mb() - baseline)
+
+
+CASES = {
+    "driver, prompts repeated": repeat_with_prompts,
+    "driver, prompts popped before repeat": repeat_without_prompts,
+    "workers, vision inputs per sample": process_per_sample,
+    "workers, vision inputs per prompt": process_per_prompt,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of a qwen2vl model or processor")
+    parser.add_argument("--n", default=[8, 16], type=int, nargs="+")
+    parser.add_argument("--num_prompts", default=128, type=int)
+    parser.add_argument("--prompt_length", default=1024, type=int)
+    parser.add_argument("--response_length", default=2048, type=int)
+    parser.add_argument("--image_size", default=448, type=int)
+    parser.add_argument("--min_pixels", default=262144, type=int)
+    parser.add_argument("--max_pixels", default=4194304, type=int)
+    args = parser.parse_args()
+
+    context = mp.get_context("spawn")
+    for n in args.n:
+        for name in CASES:
+            queue = context.Queue()
+            process = context.Process(target=run, args=(name, args, n, queue))
+            process.start()
+            peak_rss = queue.get()
+            process.join()
+            print(f"n={n}, {name}: peak RSS +{peak_rss:.0f}MB.")
+
+
+if __name__ == "__main__":
+    main()
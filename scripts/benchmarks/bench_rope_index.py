@@ -0,0 +1,110 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the throughput of the qwen2vl mrope position ids on multi-image prompts. The per-example loop that was
+replaced is taken from tests/test_qwen2_vl.py.
+
+python3 scripts/benchmarks/bench_rope_index.py --model_path Qwen/Qwen2.5-VL-7B-Instruct
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+import torch
+
+from verl.models.transformers.qwen2_vl import get_rope_index, get_rope_index_batch
+from verl.utils.tokenizer import get_processor
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "tests"))
+from test_qwen2_vl import get_rope_index_loop  # noqa: E402
+
+
+def make_batch(processor, batch_size: int, num_images: int, text_length: int, seed: int):
+    generator = torch.Generator().manual_seed(seed)
+    merge_size = processor.image_processor.merge_size
+    image_token = processor.tokenizer.convert_tokens_to_ids("<|image_pad|>")
+    vision_start = processor.tokenizer.convert_tokens_to_ids("<|vision_start|>")
+    vision_end = processor.tokenizer.convert_tokens_to_ids("<|vision_end|>")
+    examples, grids = [], []
+    for _ in range(batch_size):
+        input_ids = [torch.randint(0, 100, (text_length,), generator=generator)]
+        for _ in range(num_images):
+            grid = torch.randint(4, 40, (2,), generator=generator) * merge_size
+            grids.append(torch.tensor([1, grid[0], grid[1]]))
+            num_tokens = grid[0] * grid[1] // (merge_size**2)
+            input_ids.append(torch.tensor([vision_start] + [image_token] * num_tokens + [vision_end]))
+            input_ids.append(torch.randint(0, 100, (text_length,), generator=generator))
+
+        examples.append(torch.cat(input_ids))
+
+    max_length = max(len(input_ids) for input_ids in examples)
+    batch_input_ids = torch.full((batch_size, max_length), processor.tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros_like(batch_input_ids)
+    for idx, input_ids in enumerate(examples):  # left padding
+        batch_input_ids[idx, max_length - len(input_ids) :] = input_ids
+        attention_mask[idx, max_length - len(input_ids) :] = 1
+
+    return batch_input_ids, attention_mask, torch.stack(grids)
+
+
+def timeit(function: Callable[[], torch.Tensor], repeats: int) -> float:
+    function()  # warmup
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of a qwen2vl model or processor")
+    parser.add_argument("--batch_size", default=256, type=int)
+    parser.add_argument("--num_images", default=4, type=int, help="The number of images per prompt")
+    parser.add_argument("--text_length", default=64, type=int, help="The number of text tokens around each image")
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+
+    processor = get_processor(args.model_path)
+    input_ids, attention_mask, image_grid_thw = make_batch(
+        processor, args.batch_size, args.num_images, args.text_length, seed=1
+    )
+    example_grids: List[torch.Tensor] = list(image_grid_thw.split(args.num_images))
+
+    def per_example(function):
+        return lambda: torch.stack(
+            [
+                function(processor, input_ids[i], image_grid_thw=example_grids[i], attention_mask=attention_mask[i])
+                for i in range(args.batch_size)
+            ]
+        )
+
+    def batched():
+        return get_rope_index_batch(processor, input_ids, image_grid_thw=image_grid_thw, attention_mask=attention_mask)
+
+    assert torch.equal(per_example(get_rope_index_loop)(), batched())
+    print(f"batch: {args.batch_size} prompts x {args.num_images} images, {input_ids.size(-1)} tokens per prompt.")
+    loop_time = timeit(per_example(get_rope_index_loop), args.repeats)
+    print(f"per-example loop: {args.batch_size / loop_time:.1f} prompts/s.")
+    for name, function in [("per-example vectorized", per_example(get_rope_index)), ("batched", batched)]:
+        elapsed = timeit(function, args.repeats)
+        print(f"{name}: {args.batch_size / elapsed:.1f} prompts/s, {loop_time / elapsed:.1f}x.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares scoring the rollout batch after the generation with scoring the finished prompts while the rest are still
+generating. The generation is simulated by the stub rollout, and the reward function sleeps for a fixed time per
+response. The reward actor is emulated by a single thread that scores the chunks one by one.
+
+python3 scripts/benchmarks/bench_stream_reward.py --model_path Qwen/Qwen2.5-7B-Instruct
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from verl.protocol import DataProto
+from verl.utils.tokenizer import get_tokenizer
+from verl.workers.reward import BatchFunctionRewardManager, RewardConfig, make_stream_reward_chunk
+from verl.workers.rollout.config import RolloutConfig
+from verl.workers.rollout.stub_rollout import StubRollout
+
+
+REWARD_FUNCTION = """
+import time
+
+
+def main(reward_inputs, seconds_per_response):
+    time.sleep(seconds_per_response * len(reward_inputs))
+    return [{"overall": 1.0} for _ in reward_inputs]
+"""
+
+
+def make_prompts(tokenizer, batch_size: int, prompt_length: int) -> DataProto:
+    input_ids = torch.randint(0, 100, (batch_size, prompt_length))
+    prompts = DataProto.from_dict(
+        tensors={
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "position_ids": torch.arange(prompt_length).expand(batch_size, -1),
+        },
+        non_tensors={
+            "raw_prompt_ids": np.array([[0]] * batch_size, dtype=object),
+            "uid": np.array([str(idx) for idx in range(batch_size)], dtype=object),
+            "ground_truth": np.array(["1"] * batch_size, dtype=object),
+        },
+        meta_info={"eos_token_id": tokenizer.eos_token_id},
+    )
+    return prompts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str, help="The path of the tokenizer")
+    parser.add_argument("--batch_size", default=128, type=int, help="The number of prompts")
+    parser.add_argument("--n", default=8, type=int, help="The number of responses per prompt")
+    parser.add_argument("--response_length", default=4096, type=int)
+    parser.add_argument("--tokens_per_second", default=200000.0, type=float, help="The simulated decoding speed")
+    parser.add_argument("--reward_ms", default=5.0, type=float, help="The reward time per response")
+    parser.add_argument("--chunk_size", default=32, type=int, help="The number of prompts scored at a time")
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.model_path)
+    rollout_config = RolloutConfig(name="stub", n=args.n, stub_tokens_per_second=args.tokens_per_second)
+    rollout_config.response_length = args.response_length
+    with tempfile.TemporaryDirectory() as reward_dir:
+        reward_path = os.path.join(reward_dir, "reward.py")
+        with open(reward_path, "w") as f:
+            f.write(REWARD_FUNCTION)
+
+        reward_config = RewardConfig(
+            reward_function=reward_path, reward_function_kwargs={"seconds_per_response": args.reward_ms / 1000}
+        )
+        reward_config.post_init()
+        reward_fn = BatchFunctionRewardManager(reward_config, tokenizer)
+
+        # score the whole batch after the generation
+        rollout = StubRollout(rollout_config, tokenizer)
+        prompts = make_prompts(tokenizer, args.batch_size, prompt_length=16)
+        start_time = time.perf_counter()
+        output = rollout.generate_sequences(prompts)
+        generation_time = time.perf_counter() - start_time
+        output.non_tensor_batch["ground_truth"] = np.repeat(prompts.non_tensor_batch["ground_truth"], args.n)
+        reward_fn.compute_reward(output)
+        batch_time = time.perf_counter() - start_time
+
+        # score the finished prompts during the generation, the same responses are generated with the same seed
+        rollout = StubRollout(rollout_config, tokenizer)
+        prompts = make_prompts(tokenizer, args.batch_size, prompt_length=16)
+        uids, ground_truths = prompts.non_tensor_batch["uid"], prompts.non_tensor_batch["ground_truth"]
+        with ThreadPoolExecutor(max_workers=1) as reward_actor:
+            futures = []
+
+            def completion_callback(indices, outputs):
+                chunk = make_stream_reward_chunk(
+                    prompts, indices, outputs, tokenizer.pad_token_id, args.response_length
+                )
+                futures.append(reward_actor.submit(reward_fn.compute_stream_reward, chunk))
+
+            start_time = time.perf_counter()
+            output = rollout.generate_sequences(prompts, completion_callback, chunk_size=args.chunk_size)
+            for future in futures:
+                future.result()
+
+            output.non_tensor_batch["uid"] = np.repeat(uids, args.n)
+            output.non_tensor_batch["ground_truth"] = np.repeat(ground_truths, args.n)
+            reward_fn.collect_stream_reward(output)
+            stream_time = time.perf_counter() - start_time
+
+    num_responses = args.batch_size * args.n
+    print(f"{num_responses} responses, generation: {generation_time:.2f}s, reward: {args.reward_ms}ms per response.")
+    print(f"batch reward: {batch_time:.2f}s, {batch_time - generation_time:.2f}s after the generation.")
+    print(f"stream reward: {stream_time:.2f}s, {stream_time - generation_time:.2f}s after the generation.")
+    print(f"speedup: {batch_time / stream_time:.2f}x.")
+
+
+if __name__ == "__main__":
+    main()
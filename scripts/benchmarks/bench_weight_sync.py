@@ -0,0 +1,154 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the weight sync that gathers each parameter with a blocking `full_tensor` with the one that gathers the
+next bucket asynchronously while the current one is loaded. The loading is simulated by copying the weights into
+preallocated tensors, as vllm does. Uses nccl on gpus and gloo otherwise.
+
+python3 scripts/benchmarks/bench_weight_sync.py --world_size 8 --num_layers 28 --hidden_size 3584
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.distributed._tensor import DTensor, Shard, distribute_tensor
+from torch.distributed.device_mesh import init_device_mesh
+
+from verl.utils.fsdp_utils import WeightBucketLayout, gather_weight_bucket, get_weight_bucket_layout
+
+
+def make_weights(args: argparse.Namespace, device_mesh) -> Dict[str, DTensor]:
+    shapes = []
+    for layer in range(args.num_layers):
+        shapes.append((f"layers.{layer}.qkv_proj", (3 * args.hidden_size, args.hidden_size)))
+        shapes.append((f"layers.{layer}.o_proj", (args.hidden_size, args.hidden_size)))
+        shapes.append((f"layers.{layer}.gate_up_proj", (2 * args.intermediate_size, args.hidden_size)))
+        shapes.append((f"layers.{layer}.down_proj", (args.hidden_size, args.intermediate_size)))
+        shapes.append((f"layers.{layer}.norm", (args.hidden_size,)))
+
+    device = device_mesh.device_type
+    return {
+        name: distribute_tensor(torch.randn(shape, dtype=torch.bfloat16, device=device), device_mesh, [Shard(0)])
+        for name, shape in shapes
+    }
+
+
+def make_buckets(weights: Dict[str, DTensor], bucket_size: int) -> List[List[Tuple[str, DTensor]]]:
+    buckets, bucket, size = [], [], 0
+    for name, tensor in weights.items():
+        bucket.append((name, tensor))
+        size += tensor.numel() * tensor.element_size()
+        if size >= bucket_size:
+            buckets.append(bucket)
+            bucket, size = [], 0
+
+    if len(bucket) != 0:
+        buckets.append(bucket)
+
+    return buckets
+
+
+def sync_blocking(weights: Dict[str, DTensor], targets: Dict[str, torch.Tensor]) -> None:
+    for name, tensor in weights.items():
+        targets[name].copy_(tensor.full_tensor())
+
+
+def sync_bucketed(
+    buckets: List[List[Tuple[str, DTensor]]], layouts: List[WeightBucketLayout], targets: Dict[str, torch.Tensor]
+) -> None:
+    next_bucket, next_works = gather_weight_bucket(buckets[0], layouts[0])
+    for idx in range(len(buckets)):
+        bucket, works = next_bucket, next_works
+        if idx + 1 < len(buckets):
+            next_bucket, next_works = gather_weight_bucket(buckets[idx + 1], layouts[idx + 1])
+        else:
+            next_bucket, next_works = [], []
+
+        for work in works:
+            work.wait()
+
+        for name, tensor in bucket:
+            targets[name].copy_(tensor)
+
+
+def worker(rank: int, args: argparse.Namespace, init_method: str) -> None:
+    backend = "nccl" if torch.cuda.is_available() else "gloo"
+    if backend == "nccl":
+        torch.cuda.set_device(rank)
+
+    dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=args.world_size)
+    device_mesh = init_device_mesh("cuda" if backend == "nccl" else "cpu", (args.world_size,))
+    weights = make_weights(args, device_mesh)
+    targets = {
+        name: torch.empty(tensor.shape, dtype=tensor.dtype, device=tensor.device) for name, tensor in weights.items()
+    }
+    buckets = make_buckets(weights, args.bucket_size_mb * 1024**2)
+    layouts = [get_weight_bucket_layout(bucket) for bucket in buckets]  # computed once as the sync plan
+    num_bytes = sum(tensor.numel() * tensor.element_size() for tensor in weights.values())
+
+    results = {}
+    for name, function in [
+        ("blocking", lambda: sync_blocking(weights, targets)),
+        ("bucketed", lambda: sync_bucketed(buckets, layouts, targets)),
+    ]:
+        function()  # warmup
+        elapsed = []
+        for _ in range(args.repeats):
+            dist.barrier()
+            if backend == "nccl":
+                torch.cuda.synchronize()
+
+            start_time = time.perf_counter()
+            function()
+            if backend == "nccl":
+                torch.cuda.synchronize()
+
+            elapsed.append(time.perf_counter() - start_time)
+
+        results[name] = min(elapsed)
+
+    if rank == 0:
+        print(f"{backend}: {args.world_size} ranks, {num_bytes / 1024**3:.2f} GiB, {len(buckets)} buckets.")
+        for name, elapsed in results.items():
+            print(f"{name}: {elapsed * 1000:.1f}ms, {num_bytes / elapsed / 1024**3:.2f} GiB/s.")
+
+        print(f"speedup: {results['blocking'] / results['bucketed']:.2f}x.")
+
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world_size", default=2, type=int)
+    parser.add_argument("--num_layers", default=4, type=int)
+    parser.add_argument("--hidden_size", default=1024, type=int)
+    parser.add_argument("--intermediate_size", default=None, type=int, help="Defaults to 3x the hidden size")
+    parser.add_argument("--bucket_size_mb", default=512, type=int)
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+    args.intermediate_size = args.intermediate_size or 3 * args.hidden_size
+
+    with tempfile.TemporaryDirectory() as init_dir:
+        init_method = f"file://{os.path.join(init_dir, 'init')}"
+        mp.spawn(worker, args=(args, init_method), nprocs=args.world_size)
+
+
+if __name__ == "__main__":
+    main()
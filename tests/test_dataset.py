@@ -0,0 +1,417 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import datasets
+import numpy as np
+import pytest
+import torch
+from conftest import CHAT_TEMPLATE, make_processor
+from PIL import Image
+from torchdata.stateful_dataloader import StatefulDataLoader
+
+import verl.utils.dataset as dataset_module
+from verl.protocol import DataProto
+from verl.trainer.data_loader import DataPrefetcher, WorkerStatsCollator
+from verl.utils import torch_functional as VF
+from verl.utils.dataset import (
+    LengthGroupedSampler,
+    RLHFDataset,
+    StreamingRLHFDataset,
+    _disable_image_decoding,
+    collate_fn,
+    process_image,
+)
+
+
+IMAGE_SIZES = [
+    (1, 1),
+    (27, 29),
+    (28, 28),
+    (56, 56),
+    (57, 55),
+    (111, 37),
+    (640, 480),
+    (1023, 769),
+    (2000, 30),
+    (30, 2000),
+    (1920, 1080),
+    (3000, 3000),
+]
+
+
+# the qwen2vl template with a default system prompt, and two variants that cannot be split into static pieces
+QWEN2_VL_TEMPLATE = (
+    "{% set image_count = namespace(value=0) %}{% for message in messages %}"
+    "{% if loop.first and message['role'] != 'system' %}<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n"
+    "{% endif %}<|im_start|>{{ message['role'] }}\n"
+    "{% if message['content'] is string %}{{ message['content'] }}<|im_end|>\n"
+    "{% else %}{% for content in message['content'] %}"
+    "{% if content['type'] == 'image' %}{% set image_count.value = image_count.value + 1 %}"
+    "{% if add_vision_id %}Picture {{ image_count.value }}: {% endif %}<|vision_start|><|image_pad|><|vision_end|>"
+    "{% elif content['type'] == 'video' %}<|vision_start|><|video_pad|><|vision_end|>"
+    "{% elif 'text' in content %}{{ content['text'] }}{% endif %}"
+    "{% endfor %}<|im_end|>\n{% endif %}{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+NUMBERED_IMAGES_TEMPLATE = QWEN2_VL_TEMPLATE.replace("{% if add_vision_id %}", "{% if true %}")
+TRIMMED_TEMPLATE = CHAT_TEMPLATE.replace("{{ message['content'] }}", "{{ message['content'] | trim }}")
+
+CHAT_MESSAGES = [
+    [{"role": "user", "content": "What is 1 + 1?"}],
+    [{"role": "user", "content": "  {{ not jinja }} {% raw %}\n<|im_end|>  "}],
+    [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": "What is this?"}]}],
+    [{"role": "user", "content": [{"type": "text", "text": "Compare "}, {"type": "image"}, {"type": "image"}]}],
+    [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": " and "}, {"type": "image"}]}],
+    [{"role": "user", "content": [{"type": "video"}, {"type": "text", "text": "Describe the video."}]}],
+    [{"role": "system", "content": "Think step by step."}, {"role": "user", "content": "What is 2 + 2?"}],
+    [
+        {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": "Count the objects."}]},
+        {"role": "assistant", "content": "There are 3 objects."},
+        {"role": "user", "content": [{"type": "text", "text": "Are you sure?"}]},
+    ],
+]
+
+
+def _encode(size: Tuple[int, int], image_format: str) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, (size[0] % 256, size[1] % 256, 128)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def _make_image_dataset(data_dir: str, image_sizes: List[Tuple[int, int]]) -> str:
+    rows = {"prompt": [], "answer": [], "images": []}
+    for idx, size in enumerate(image_sizes):
+        num_images = idx % 3 + 1
+        rows["prompt"].append("<image>" * num_images + f"How many objects are there in picture {idx}?")
+        rows["answer"].append(str(idx))
+        rows["images"].append(
+            [{"bytes": _encode(size, "JPEG" if i % 2 else "PNG"), "path": None} for i in range(num_images)]
+        )
+
+    features = datasets.Features(
+        {
+            "prompt": datasets.Value("string"),
+            "answer": datasets.Value("string"),
+            "images": datasets.Sequence(datasets.Image()),
+        }
+    )
+    datasets.Dataset.from_dict(rows, features=features).to_parquet(f"{data_dir}/train.parquet")
+    return data_dir
+
+
+def _process_image_reference(image_bytes: bytes, min_pixels: Optional[int], max_pixels: Optional[int]) -> Image.Image:
+    """The previous implementation, which decodes the full image and resizes it with the default filter."""
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    if max_pixels is not None and (image.width * image.height) > max_pixels:
+        resize_factor = (max_pixels / (image.width * image.height)) ** 0.5
+        image = image.resize((int(image.width * resize_factor), int(image.height * resize_factor)))
+
+    if min_pixels is not None and (image.width * image.height) < min_pixels:
+        resize_factor = (min_pixels / (image.width * image.height)) ** 0.5
+        image = image.resize((int(image.width * resize_factor), int(image.height * resize_factor)))
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+@pytest.mark.parametrize("min_pixels, max_pixels", [(3136, 12845056), (262144, 4194304), (50000, 50000)])
+def test_process_image_matches_reference(image_format: str, min_pixels: int, max_pixels: int):
+    processor = make_processor()
+    for width, height in IMAGE_SIZES[1:]:
+        # a smooth gradient, the resampling filters differ most on the edges of flat images
+        x, y = np.meshgrid(np.linspace(0, 255, width), np.linspace(0, 255, height))
+        pixels = np.stack([x, y, (x + y) / 2], axis=-1).astype(np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format=image_format)
+        expected = _process_image_reference(buffer.getvalue(), min_pixels, max_pixels)
+        image = process_image({"bytes": buffer.getvalue()}, min_pixels, max_pixels)
+        array = process_image({"bytes": buffer.getvalue()}, min_pixels, max_pixels, return_numpy=True)
+        assert image.size == expected.size
+        assert array.dtype == np.uint8 and array.shape == (expected.height, expected.width, 3)
+        assert np.array_equal(array, np.asarray(image))
+        diff = np.abs(array.astype(np.float32) - np.asarray(expected, dtype=np.float32))
+        assert diff.mean() < 1.0
+
+        if min(image.size) >= 28:  # the arrays are processed as the pil images
+            expected_inputs = processor.image_processor(images=[image], return_tensors="pt")
+            inputs = processor.image_processor(images=[array], return_tensors="pt", input_data_format="channels_last")
+            assert torch.equal(inputs["pixel_values"], expected_inputs["pixel_values"])
+            assert torch.equal(inputs["image_grid_thw"], expected_inputs["image_grid_thw"])
+
+
+@pytest.mark.parametrize("min_pixels, max_pixels", [(None, None), (3136, 12845056), (262144, 4194304), (50000, 50000)])
+@pytest.mark.parametrize(
+    "processor_pixels", [{}, {"min_pixels": 3136, "max_pixels": 200704}, {"min_pixels": 401408, "max_pixels": 401408}]
+)
+def test_estimated_prompt_length_matches_processor(
+    tmp_path, min_pixels: Optional[int], max_pixels: Optional[int], processor_pixels
+):
+    processor = make_processor(**processor_pixels)
+    data_dir = _make_image_dataset(str(tmp_path), IMAGE_SIZES)
+    dataset = RLHFDataset(
+        data_dir,
+        tokenizer=processor.tokenizer,
+        processor=processor,
+        max_prompt_length=1 << 20,
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
+        filter_overlong_prompts=False,
+    )
+    # the filter reads the image headers from the undecoded images
+    undecoded_dataset = dataset.dataset.cast_column(
+        "images", _disable_image_decoding(dataset.dataset.features["images"])
+    )
+    for example, undecoded_example in zip(dataset.dataset, undecoded_dataset):
+        prompt = dataset._apply_chat_template(dataset._build_messages(example))
+        images = example["images"]
+        try:
+            expected = dataset._get_image_prompt_length(prompt, images)
+        except ValueError:  # the images smaller than a merged patch are rejected by both
+            with pytest.raises(ValueError):
+                dataset._estimate_image_prompt_length(prompt, images)
+
+            continue
+
+        assert dataset._estimate_image_prompt_length(prompt, images) == expected
+        assert dataset._get_prompt_length(example) == expected
+        assert dataset._get_prompt_length(undecoded_example) == expected
+
+
+def _collate_padded_reference(dataset: RLHFDataset, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The previous layout, in which each example is padded in `__getitem__` and the batch is stacked."""
+    padded_features = []
+    for feature in features:
+        input_ids = feature["input_ids"].long()
+        input_ids, attention_mask, position_ids = VF.postprocess_data(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            position_ids=feature["position_ids"].long(),
+            max_length=dataset.max_prompt_length,
+            pad_token_id=dataset.tokenizer.pad_token_id,
+            left_pad=True,
+            truncation=dataset.truncation,
+        )
+        padded_features.append(
+            {**feature, "input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids}
+        )
+
+    return collate_fn(padded_features)
+
+
+@pytest.mark.parametrize("truncation", ["left", "right"])
+@pytest.mark.parametrize("is_image", [False, True])
+def test_collate_fn_pads_compact_examples(tmp_path, processor, truncation: str, is_image: bool):
+    if is_image:
+        data_dir = _make_image_dataset(str(tmp_path), IMAGE_SIZES[1:7])
+    else:
+        rows = {"prompt": [f"question {idx} " * idx for idx in range(6)], "answer": [str(idx) for idx in range(6)]}
+        datasets.Dataset.from_dict(rows).to_parquet(f"{tmp_path}/train.parquet")
+        data_dir = str(tmp_path)
+
+    dataset = RLHFDataset(
+        data_dir,
+        tokenizer=processor.tokenizer,
+        processor=processor if is_image else None,
+        max_prompt_length=72 if is_image else 24,  # some of the prompts are truncated
+        truncation=truncation,
+        min_pixels=3136,
+        max_pixels=12544,
+        filter_overlong_prompts=False,
+    )
+    features = [dataset[idx] for idx in range(len(dataset))]
+    assert all(feature["input_ids"].dtype == torch.int32 for feature in features)
+    assert any(feature["input_ids"].size(-1) > dataset.max_prompt_length for feature in features)
+    assert any(feature["input_ids"].size(-1) < dataset.max_prompt_length for feature in features)
+
+    batch = dataset.collate_fn(features)
+    expected = _collate_padded_reference(dataset, features)
+    assert batch.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, torch.Tensor):
+            assert batch[key].dtype == value.dtype and torch.equal(batch[key], value), key
+        else:
+            assert batch[key].tolist() == value.tolist(), key
+
+
+def test_collate_fn_keeps_equal_length_prompt_ids_1d():
+    features = [{"raw_prompt_ids": [1, 2, 3], "ground_truth": "0"}, {"raw_prompt_ids": [4, 5, 6], "ground_truth": "1"}]
+    batch = collate_fn(features)
+    # concatenated with the batches of other prompt lengths, e.g. the partial samples of the last step
+    assert batch["raw_prompt_ids"].shape == (2,) and batch["raw_prompt_ids"][1] == [4, 5, 6]
+    other = collate_fn([{"raw_prompt_ids": [7], "ground_truth": "2"}])
+    concatenated = DataProto.concat([DataProto(non_tensor_batch=batch), DataProto(non_tensor_batch=other)])
+    assert concatenated.non_tensor_batch["raw_prompt_ids"].tolist() == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_streaming_dataset_reshuffles_each_epoch(tmp_path, monkeypatch, tokenizer, num_workers: int):
+    monkeypatch.setattr(datasets.config, "SLEEP_TIME_ON_THREADS_SHUTDOWN", 0)  # waited at the end of each epoch
+    rows = {"prompt": [f"question {idx}" for idx in range(64)], "answer": [str(idx) for idx in range(64)]}
+    datasets.Dataset.from_dict(rows).to_parquet(f"{tmp_path}/train.parquet")
+
+    def make_prefetcher(state_dict: Optional[Dict[str, Any]] = None) -> DataPrefetcher:
+        dataset = StreamingRLHFDataset(str(tmp_path), tokenizer=tokenizer, processor=None, shuffle_buffer_size=16)
+        dataloader = StatefulDataLoader(
+            dataset,
+            batch_size=8,
+            collate_fn=dataset.collate_fn,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0,
+        )
+        if state_dict is not None:
+            dataloader.load_state_dict(state_dict)
+
+        return DataPrefetcher(dataloader, DataProto.from_single_dict, 0)
+
+    def get_answers(prefetcher: DataPrefetcher) -> List[str]:
+        return prefetcher.get().non_tensor_batch["ground_truth"].tolist()
+
+    prefetcher = make_prefetcher()
+    epochs = [sum((get_answers(prefetcher) for _ in range(8)), []) for _ in range(3)]
+    assert all(sorted(epoch, key=int) == rows["answer"] for epoch in epochs)
+    assert epochs[0] != epochs[1] and epochs[1] != epochs[2]
+
+    # the resumed dataset continues in the same epoch
+    prefetcher = make_prefetcher()
+    for _ in range(8 + 3):
+        prefetcher.get()
+
+    resumed_prefetcher = make_prefetcher(prefetcher.state_dict)
+    resumed_prefetcher.get()
+    assert resumed_prefetcher.dataloader.dataset.epoch == 1
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_prefetcher_reports_worker_metrics(tmp_path, tokenizer, num_workers: int):
+    rows = {"prompt": [f"question {idx}" for idx in range(32)], "answer": [str(idx) for idx in range(32)]}
+    datasets.Dataset.from_dict(rows).to_parquet(f"{tmp_path}/train.parquet")
+    dataset = RLHFDataset(str(tmp_path), tokenizer=tokenizer, processor=None)
+    dataloader = StatefulDataLoader(
+        dataset, batch_size=4, collate_fn=WorkerStatsCollator(dataset), num_workers=num_workers
+    )
+    start_time = time.perf_counter()
+    prefetcher = DataPrefetcher(dataloader, DataProto.from_single_dict, 1)
+    for _ in range(4):
+        assert len(prefetcher.get()) == 4  # the worker stats are not in the batch
+
+    metrics = prefetcher.get_metrics()
+    # the throughput is over the wall-clock time, the workers load the samples in their own time
+    assert 16 / (time.perf_counter() - start_time) <= metrics["data/throughput"]
+    for worker_id in range(max(num_workers, 1)):
+        assert metrics[f"data/worker_{worker_id}/load_time"] > 0
+        assert metrics[f"data/worker_{worker_id}/throughput"] > 0
+
+    assert set(metrics) >= {"data/fetch_time", "data/queue_size", "data/prompt_padding_ratio"}
+
+
+def test_length_info_is_kept_by_filter_and_cache(tmp_path, monkeypatch, processor):
+    data_dir = _make_image_dataset(str(tmp_path / "data"), IMAGE_SIZES[1:])
+    kwargs = dict(
+        tokenizer=processor.tokenizer,
+        processor=processor,
+        max_prompt_length=600,
+        min_pixels=3136,
+        max_pixels=200704,
+        filter_overlong_prompts_workers=1,
+    )
+    dataset = RLHFDataset(data_dir, **kwargs)
+    cached_dataset = RLHFDataset(data_dir, cache_dir=str(tmp_path / "cache"), **kwargs)
+    loaded_dataset = RLHFDataset(data_dir, cache_dir=str(tmp_path / "cache"), **kwargs)
+    assert 0 < len(dataset) < len(IMAGE_SIZES) - 1
+
+    # the lengths are not computed again
+    monkeypatch.setattr(RLHFDataset, "_compute_length_info", None)
+    prompt_lengths, num_images = dataset.get_length_info()
+    assert prompt_lengths == [dataset._get_prompt_length(example) for example in dataset.dataset]
+    assert num_images == [len(example["images"]) for example in dataset.dataset]
+    assert max(num_images) > 1
+    for other_dataset in (cached_dataset, loaded_dataset):
+        assert other_dataset.preprocessed
+        assert other_dataset.get_length_info() == (prompt_lengths, num_images)
+        assert "num_images" not in other_dataset[0]
+
+
+def test_length_grouped_sampler_empty():
+    assert list(LengthGroupedSampler([], [], batch_size=4)) == []
+
+
+def test_preprocessed_cache_rejects_other_layouts(tmp_path, monkeypatch, tokenizer):
+    rows = {"prompt": [f"question {idx}" for idx in range(4)], "answer": [str(idx) for idx in range(4)]}
+    datasets.Dataset.from_dict(rows).to_parquet(f"{tmp_path}/data/train.parquet")
+    kwargs = dict(tokenizer=tokenizer, processor=None, max_prompt_length=64, cache_dir=str(tmp_path / "cache"))
+    RLHFDataset(str(tmp_path / "data"), **kwargs)
+    (cache_name,) = os.listdir(tmp_path / "cache")
+
+    # a new layout is saved to a new path
+    with monkeypatch.context() as patch:
+        patch.setattr(dataset_module, "PREPROCESSED_CACHE_VERSION", dataset_module.PREPROCESSED_CACHE_VERSION + 1)
+        RLHFDataset(str(tmp_path / "data"), **kwargs)
+        assert len(os.listdir(tmp_path / "cache")) == 2
+
+    # the padded layout without the number of images
+    padded = {"input_ids": [[0] * 64] * 4, "attention_mask": [[1] * 64] * 4, "position_ids": [list(range(64))] * 4}
+    padded.update(raw_prompt_ids=[[0]] * 4, ground_truth=rows["answer"])
+    shutil.rmtree(tmp_path / "cache" / cache_name)
+    datasets.Dataset.from_dict(padded).save_to_disk(str(tmp_path / "cache" / cache_name))
+    with pytest.raises(ValueError, match="remove it"):
+        RLHFDataset(str(tmp_path / "data"), **kwargs)
+
+
+def test_preprocessed_cache_depends_on_processor_settings(tmp_path):
+    data_dir = _make_image_dataset(str(tmp_path), IMAGE_SIZES[:2])
+    fingerprints = set()
+    for processor_pixels in [{}, {"min_pixels": 3136, "max_pixels": 200704}, {"patch_size": 16}]:
+        processor = make_processor(**processor_pixels)
+        dataset = RLHFDataset(
+            data_dir, tokenizer=processor.tokenizer, processor=processor, filter_overlong_prompts=False
+        )
+        fingerprints.add(dataset._fingerprint(filter_overlong_prompts=True))
+
+    assert len(fingerprints) == 3
+
+
+@pytest.mark.parametrize(
+    "chat_template",
+    [CHAT_TEMPLATE, QWEN2_VL_TEMPLATE, NUMBERED_IMAGES_TEMPLATE, TRIMMED_TEMPLATE],
+    ids=["plain", "qwen2vl", "numbered_images", "trimmed"],
+)
+def test_cached_chat_template_matches_apply_chat_template(tmp_path, chat_template: str):
+    processor = make_processor()
+    processor.chat_template = processor.tokenizer.chat_template = chat_template
+    datasets.Dataset.from_dict({"prompt": ["question"], "answer": ["0"]}).to_parquet(f"{tmp_path}/train.parquet")
+    dataset = RLHFDataset(
+        str(tmp_path), tokenizer=processor.tokenizer, processor=processor, filter_overlong_prompts=False
+    )
+    if chat_template == QWEN2_VL_TEMPLATE:
+        assert dataset.chat_template_pieces.keys() == {"text", "image", "video"}
+    elif chat_template == NUMBERED_IMAGES_TEMPLATE:  # the image pieces differ by the image index
+        assert dataset.chat_template_pieces.keys() == {"text", "video"}
+    elif chat_template == TRIMMED_TEMPLATE:  # the text contents are not placed verbatim
+        assert "text" not in dataset.chat_template_pieces
+
+    for messages in CHAT_MESSAGES:
+        is_text = all(isinstance(message["content"], str) for message in messages)
+        tokenizer = processor.tokenizer if is_text else processor
+        expected = tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        assert dataset._apply_chat_template(messages) == expected
@@ -0,0 +1,91 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import datasets
+import ray
+from conftest import make_tokenizer
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from verl.trainer.config import PPOConfig
+from verl.trainer.main import Runner
+
+
+REWARD_FUNCTION = os.path.join(os.path.dirname(__file__), "..", "examples", "reward_function", "math.py")
+
+
+def _make_config(tmp_path) -> PPOConfig:
+    tokenizer = make_tokenizer()
+    model_config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        num_key_value_heads=1,
+        tie_word_embeddings=True,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    Qwen2ForCausalLM(model_config).save_pretrained(tmp_path / "model")
+    tokenizer.save_pretrained(tmp_path / "model")
+    datasets.Dataset.from_dict(
+        {"prompt": [f"{idx} + {idx} = ?" for idx in range(16)], "answer": [str(2 * idx) for idx in range(16)]}
+    ).to_parquet(str(tmp_path / "data" / "train.parquet"))
+
+    config = PPOConfig()
+    config.data.train_files = config.data.val_files = str(tmp_path / "data")
+    config.data.max_prompt_length, config.data.max_response_length = 32, 16
+    config.data.rollout_batch_size, config.data.val_batch_size = 4, 4
+    config.data.min_pixels = config.data.max_pixels = None
+    config.data.num_workers, config.data.filter_overlong_prompts_workers = 0, 1
+    config.algorithm.disable_kl = True
+    actor = config.worker.actor
+    actor.global_batch_size = 4
+    actor.micro_batch_size_per_device_for_update, actor.micro_batch_size_per_device_for_experience = 2, 4
+    actor.padding_free = actor.dynamic_batching = actor.use_torch_compile = False
+    actor.model.model_path = str(tmp_path / "model")
+    actor.model.enable_gradient_checkpointing = False
+    for fsdp_config in (actor.fsdp, config.worker.ref.fsdp, config.worker.critic.fsdp):
+        fsdp_config.enable_rank0_init = False
+        fsdp_config.mp_param_dtype = "fp32"
+
+    config.worker.rollout.name = "stub"
+    config.worker.rollout.n = 2
+    config.worker.rollout.partial_rollout_ratio = 0.5
+    config.worker.reward.reward_function = f"{REWARD_FUNCTION}:compute_score"
+    config.trainer.device = "cpu"
+    config.trainer.n_gpus_per_node = 2
+    config.trainer.logger = ("console",)
+    config.trainer.max_steps = 2
+    config.trainer.val_before_train = False
+    config.trainer.save_freq = 2
+    config.trainer.save_checkpoint_path = str(tmp_path / "checkpoints")
+    config.deep_post_init()
+    return config
+
+
+def test_fit_on_cpu_with_stub_rollout(tmp_path):
+    config = _make_config(tmp_path)
+    ray.init(num_cpus=8)  # the runner, the reward managers and a cpu for each of the 2 workers
+    try:
+        ray.get(Runner.remote().run.remote(config))
+    finally:
+        ray.shutdown()
+
+    # the workers train with gloo, the carried over partial samples are saved in the checkpoint
+    checkpoint_path = tmp_path / "checkpoints" / "global_step_2"
+    assert (checkpoint_path / "actor" / "model_world_size_2_rank_1.pt").exists()
+    assert (checkpoint_path / "rollout_samples.pt").exists()
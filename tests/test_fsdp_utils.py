@@ -0,0 +1,86 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import nn
+from torch.distributed._tensor import Replicate, Shard, distribute_tensor
+from torch.distributed.device_mesh import init_device_mesh
+
+from verl.utils.fsdp_utils import FrozenParamTracker, gather_weight_bucket, get_weight_bucket_layout
+
+
+def _gather_worker(rank: int, world_size: int, init_method: str) -> None:
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        device_mesh = init_device_mesh("cpu", (world_size,))
+        generator = torch.Generator().manual_seed(0)
+        full_tensors = {
+            "even": torch.randn(8, 4, generator=generator),
+            "uneven": torch.randn(5, 3, generator=generator),
+            "single_row": torch.randn(1, 4, generator=generator),
+            "bias": torch.randn(7, generator=generator).bfloat16(),
+            "conv": torch.randn(3, 2, 2, 2, generator=generator).half(),
+        }
+        weights = [(name, distribute_tensor(tensor, device_mesh, [Shard(0)])) for name, tensor in full_tensors.items()]
+        weights.append(("replicated", distribute_tensor(full_tensors["even"], device_mesh, [Replicate()])))
+        weights.append(("plain", full_tensors["uneven"]))
+        full_tensors.update(replicated=full_tensors["even"], plain=full_tensors["uneven"])
+
+        layout = get_weight_bucket_layout(weights)
+        assert layout.shapes == [full_tensors[name].shape for name, _ in weights]
+        assert layout.dtypes == [full_tensors[name].dtype for name, _ in weights]
+        assert layout.offsets[-2:] == [-1, -1]  # the replicated and plain weights are not in the buffer
+        assert all(offset % 16 == 0 for offset in layout.offsets[:-2])
+        for bucket_layout in (None, layout, layout):  # the layout is computed once and reused
+            gathered, works = gather_weight_bucket(weights, bucket_layout)
+            assert len(works) == 5
+            for work in works:
+                work.wait()
+
+            assert [name for name, _ in gathered] == [name for name, _ in weights]
+            for name, tensor in gathered:
+                assert tensor.dtype == full_tensors[name].dtype
+                assert torch.equal(tensor, full_tensors[name])
+    finally:
+        dist.destroy_process_group()
+
+
+def test_gather_weight_bucket_gloo(tmp_path):
+    world_size = 2
+    mp.spawn(_gather_worker, args=(world_size, f"file://{tmp_path}/init"), nprocs=world_size)
+
+
+def test_frozen_param_tracker():
+    model = nn.ModuleDict({"visual": nn.Linear(4, 4), "lm_head": nn.Linear(4, 4), "norm": nn.BatchNorm1d(4)})
+    model["visual"].requires_grad_(False)
+    optimizer = torch.optim.AdamW(
+        [param for name, param in model.named_parameters() if param.requires_grad and not name.startswith("norm")]
+    )
+    tracker = FrozenParamTracker(model, optimizer)
+    # the parameters not in the optimizer are frozen, the buffers are always synced
+    assert tracker.frozen_param_names == {"visual.weight", "visual.bias", "norm.weight", "norm.bias"}
+    assert not tracker.update()
+
+    # unfreezing the vision tower changes the frozen parameters
+    model["visual"].requires_grad_(True)
+    optimizer.add_param_group({"params": list(model["visual"].parameters())})
+    assert tracker.update()
+    assert tracker.frozen_param_names == {"norm.weight", "norm.bias"}
+    assert not tracker.update()
+
+    # without an optimizer, the parameters are frozen if they do not require grad
+    model["lm_head"].requires_grad_(False)
+    assert FrozenParamTracker(model).frozen_param_names == {"lm_head.weight", "lm_head.bias"}
@@ -0,0 +1,75 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import Dict, List
+
+import pytest
+import torch
+from transformers import (
+    Qwen2_5_VLConfig,
+    Qwen2_5_VLForConditionalGeneration,
+    Qwen2Config,
+    Qwen2ForCausalLM,
+    Qwen2VLConfig,
+    Qwen2VLForConditionalGeneration,
+)
+
+from verl.utils.model_utils import get_checkpoint_key_mapping
+
+
+def rename_weight_keys_loop(keys: List[str], model: torch.nn.Module) -> Dict[str, str]:
+    """The per-parameter renaming that `get_checkpoint_key_mapping` replaces, kept as the reference."""
+    if not hasattr(model, "_checkpoint_conversion_mapping"):
+        return {key: key for key in keys}
+
+    reverse_key_mapping = {v: k for k, v in model._checkpoint_conversion_mapping.items()}
+    key_mapping = {}
+    for original_key in keys:
+        key = original_key
+        for pattern, replacement in reverse_key_mapping.items():
+            replacement = replacement.lstrip("^")  # strip off un-needed chars and patterns
+            replacement = re.sub(r"\(.*\)", "", replacement)
+            key, n_replace = re.subn(pattern, replacement, key)
+            # Early exit of the loop
+            if n_replace > 0:
+                break
+
+        key_mapping[original_key] = key
+
+    return key_mapping
+
+
+TEXT_CONFIG = dict(vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4)
+VISION_CONFIG = dict(depth=2, embed_dim=32, hidden_size=32, num_heads=4, out_hidden_size=32)
+
+
+@pytest.mark.parametrize(
+    "model_class, config",
+    [
+        (Qwen2ForCausalLM, Qwen2Config(**TEXT_CONFIG)),
+        (Qwen2VLForConditionalGeneration, Qwen2VLConfig(vision_config=VISION_CONFIG, **TEXT_CONFIG)),
+        (Qwen2_5_VLForConditionalGeneration, Qwen2_5_VLConfig(vision_config=VISION_CONFIG, **TEXT_CONFIG)),
+    ],
+)
+def test_checkpoint_key_mapping_matches_loop(model_class, config):
+    with torch.device("meta"):
+        model = model_class(config)
+
+    keys = list(model.state_dict().keys())
+    key_mapping = get_checkpoint_key_mapping(keys, model)
+    assert key_mapping == rename_weight_keys_loop(keys, model)
+    if getattr(model, "_checkpoint_conversion_mapping", None):  # the checkpoint keys of qwen2vl
+        assert any(key.startswith("visual.") for key in key_mapping.values())
+        assert any(key.startswith("model.layers.") for key in key_mapping.values())
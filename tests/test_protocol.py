@@ -0,0 +1,206 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+from typing import List
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from PIL import Image
+
+from verl.protocol import DataProto, DataProtoBuilder, all_gather_data_proto, get_group_index
+
+
+def _make_data() -> DataProto:
+    images = [Image.new("RGB", (28, 28)), Image.new("RGB", (56, 56))]
+    data = DataProto.from_dict(
+        tensors={"input_ids": torch.arange(8).view(2, 4), "attention_mask": torch.ones(2, 4, dtype=torch.long)},
+        non_tensors={
+            "uid": np.array(["a", "b"], dtype=object),
+            "scores": np.array([0.5, 1.0]),
+            "multi_modal_data": np.array([{"images": images[:1]}, {"images": images[1:]}], dtype=object),
+        },
+        meta_info={"temperature": 1.0, "metrics": {"lengths": [4, 4]}},
+    )
+    data.batch.lock_()
+    return data
+
+
+def test_copy_shares_unmodified_columns():
+    data = _make_data()
+    copied = data.copy()
+    copied.batch["attention_mask"] = torch.zeros(2, 4, dtype=torch.long)
+    copied.batch["responses"] = torch.zeros(2, 1)
+    copied.non_tensor_batch["scores"] = np.zeros(2)
+    copied.non_tensor_batch.pop("uid")
+    copied.meta_info["temperature"] = 0.0
+
+    # the replaced, added and popped keys are isolated
+    assert data.batch.is_locked and set(data.batch.keys()) == {"input_ids", "attention_mask"}
+    assert torch.all(data.batch["attention_mask"] == 1)
+    assert data.non_tensor_batch["scores"].tolist() == [0.5, 1.0]
+    assert "uid" in data.non_tensor_batch
+    assert data.meta_info["temperature"] == 1.0
+
+    # the unmodified columns are shared without copies
+    assert copied.batch["input_ids"].data_ptr() == data.batch["input_ids"].data_ptr()
+    assert copied.non_tensor_batch["multi_modal_data"] is data.non_tensor_batch["multi_modal_data"]
+    assert copied.meta_info["metrics"] is data.meta_info["metrics"]
+
+
+def test_deep_copy_isolates_in_place_edits():
+    data, expected = _make_data(), _make_data()
+    copied = data.copy(deep=True)
+
+    copied.batch["input_ids"][0, 0] = 100
+    copied.batch["attention_mask"].zero_()
+    copied.batch["responses"] = torch.zeros(2, 1)
+    copied.non_tensor_batch["uid"][0] = "c"
+    copied.non_tensor_batch["scores"] *= 2
+    copied.non_tensor_batch["multi_modal_data"][0]["images"].append(Image.new("RGB", (28, 28)))
+    copied.non_tensor_batch["multi_modal_data"][1]["videos"] = []
+    copied.non_tensor_batch.pop("uid")
+    copied.meta_info["temperature"] = 0.0
+    copied.meta_info["metrics"]["lengths"].append(1)
+
+    assert data.batch.is_locked and data.batch.keys() == expected.batch.keys()
+    for key in data.batch.keys():
+        assert torch.equal(data.batch[key], expected.batch[key])
+
+    assert data.non_tensor_batch["uid"].tolist() == ["a", "b"]
+    assert data.non_tensor_batch["scores"].tolist() == [0.5, 1.0]
+    assert [len(item["images"]) for item in data.non_tensor_batch["multi_modal_data"]] == [1, 1]
+    assert "videos" not in data.non_tensor_batch["multi_modal_data"][1]
+    assert data.meta_info == expected.meta_info
+
+    # the images are shared instead of copied
+    image = data.non_tensor_batch["multi_modal_data"][0]["images"][0]
+    assert copied.non_tensor_batch["multi_modal_data"][0]["images"][0] is image
+
+
+def test_make_iterator_shuffles_each_epoch():
+    data = DataProto.from_dict(
+        tensors={"input_ids": torch.arange(16).view(8, 2)},
+        non_tensors={"uid": np.arange(8)},
+        meta_info={"temperature": 1.0},
+    )
+    uids = [mini_batch.non_tensor_batch["uid"].tolist() for mini_batch in data.make_iterator(4, epochs=2)]
+    assert uids == [[0, 1, 2, 3], [4, 5, 6, 7]] * 2
+
+    mini_batches = list(data.make_iterator(4, epochs=2, seed=1, dataloader_kwargs={"shuffle": True}))
+    for mini_batch in mini_batches:
+        assert (mini_batch.batch["input_ids"][:, 0] // 2).tolist() == mini_batch.non_tensor_batch["uid"].tolist()
+        assert mini_batch.meta_info == data.meta_info
+
+    uids = [
+        sum((mini_batch.non_tensor_batch["uid"].tolist() for mini_batch in mini_batches[i : i + 2]), [])
+        for i in (0, 2)
+    ]
+    assert sorted(uids[0]) == sorted(uids[1]) == list(range(8))
+    assert uids[0] != uids[1]  # permuted again at each epoch
+
+    with pytest.raises(ValueError, match="Unsupported dataloader kwargs"):
+        data.make_iterator(mini_batch_size=4, epochs=1, dataloader_kwargs={"num_workers": 2})
+
+
+def test_repeated_samples_share_multi_modal_data():
+    data = _make_data().repeat(repeat_times=3, interleave=True)
+    first_indices, group_index = get_group_index(data.non_tensor_batch["multi_modal_data"])
+    assert first_indices.tolist() == [0, 3] and group_index.tolist() == [0, 0, 0, 1, 1, 1]
+
+    # the references stay shared after the batch is chunked and sent to the workers
+    chunks = [pickle.loads(pickle.dumps(chunk)) for chunk in data.chunk(2)]
+    for chunk in chunks:
+        assert len(set(map(id, chunk.non_tensor_batch["multi_modal_data"]))) == 1
+
+    first_indices, group_index = get_group_index(DataProto.concat(chunks).non_tensor_batch["multi_modal_data"])
+    assert len(first_indices) == 2 and group_index.tolist() == [0, 0, 0, 1, 1, 1]
+
+
+def _make_rank_data(rank: int) -> DataProto:
+    generator = torch.Generator().manual_seed(rank)
+    data = DataProto.from_dict(
+        tensors={
+            "input_ids": torch.arange(6).view(2, 3) + rank * 10,
+            "attention_mask": torch.tensor([[True, False, True], [False, True, True]]) ^ bool(rank),
+            "log_probs": torch.randn(2, 5, generator=generator).half(),
+            "values": torch.randn(2, 7, generator=generator).bfloat16(),
+            "advantages": torch.randn(2, 3, generator=generator, dtype=torch.float64),
+            "position_ids": torch.arange(2 * 3 * 3, dtype=torch.int32).view(2, 3, 3) * (rank + 1),
+            "response_length": torch.tensor([rank, rank + 1], dtype=torch.uint8),
+        },
+        meta_info={"eos_token_id": 1},
+    )
+    raw_prompt_ids = np.empty(2, dtype=object)
+    raw_prompt_ids[:] = [list(range(rank + idx)) for idx in range(2)]
+    data.non_tensor_batch = {  # the typed arrays are kept as they are
+        "uid": np.array([f"rank{rank}-{idx}" * (rank + 1) for idx in range(2)], dtype=object),
+        "multi_modal_data": np.array([{"images": [b"x" * (rank * 100 + idx)]} for idx in range(2)], dtype=object),
+        "raw_prompt_ids": raw_prompt_ids,
+        "finished": np.array([True, bool(rank)]),
+        "finish_time": np.array([0.5, 1.5]) * (rank + 1),
+        "sample_index": np.array([rank, rank], dtype=np.int32),
+    }
+    return data
+
+
+def _all_gather_worker(rank: int, world_size: int, init_method: str) -> None:
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        data = _make_rank_data(rank)
+        all_gather_data_proto(data, size=world_size, group=dist.group.WORLD)
+        expected = DataProto.concat([_make_rank_data(other_rank) for other_rank in range(world_size)])
+        assert len(data) == len(expected)
+        for key in expected.batch.keys():
+            assert data.batch[key].dtype == expected.batch[key].dtype
+            assert torch.equal(data.batch[key], expected.batch[key])
+
+        assert data.non_tensor_batch.keys() == expected.non_tensor_batch.keys()
+        for key, value in expected.non_tensor_batch.items():
+            assert data.non_tensor_batch[key].dtype == value.dtype
+            assert data.non_tensor_batch[key].tolist() == value.tolist()
+
+        assert data.meta_info == {"eos_token_id": 1}
+    finally:
+        dist.destroy_process_group()
+
+
+def test_all_gather_data_proto_gloo(tmp_path):
+    world_size = 2
+    mp.spawn(_all_gather_worker, args=(world_size, f"file://{tmp_path}/init"), nprocs=world_size)
+
+
+def _make_groups(uids: List[str]) -> DataProto:
+    return DataProto.from_dict(
+        tensors={"index": torch.arange(len(uids))}, non_tensors={"uid": np.array(uids, dtype=object)}
+    )
+
+
+def test_builder_truncates_at_group_boundaries():
+    builder = DataProtoBuilder(max_size=5, group_key="uid")
+    builder.append(_make_groups(["a", "a", "b", "b"]))
+    builder.append(_make_groups(["c", "c", "d", "d"]))
+    assert builder.build().non_tensor_batch["uid"].tolist() == ["a", "a", "b", "b"]
+
+    builder = DataProtoBuilder(max_size=6, group_key="uid")
+    builder.append(_make_groups(["a", "a", "b", "b"]))
+    builder.append(_make_groups(["c", "c", "d", "d"]))
+    assert builder.build().non_tensor_batch["uid"].tolist() == ["a", "a", "b", "b", "c", "c"]
+
+    builder = DataProtoBuilder(max_size=3)
+    builder.append(_make_groups(["a", "a", "b", "b"]))
+    assert builder.build().non_tensor_batch["uid"].tolist() == ["a", "a", "b"]
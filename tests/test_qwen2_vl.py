@@ -0,0 +1,189 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict, List, Optional
+
+import pytest
+import torch
+from PIL import Image
+
+from verl.models.transformers.qwen2_vl import get_rope_index, get_rope_index_batch
+
+
+def get_rope_index_loop(
+    processor,
+    input_ids: torch.Tensor,
+    image_grid_thw: Optional[torch.Tensor] = None,
+    video_grid_thw: Optional[torch.Tensor] = None,
+    second_per_grid_ts: Optional[List[float]] = None,
+    attention_mask: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """The per-example implementation that `get_rope_index_batch` replaces, kept as the reference."""
+    spatial_merge_size = processor.image_processor.merge_size
+    tokens_per_second = 2
+    image_token_id = processor.tokenizer.convert_tokens_to_ids("<|image_pad|>")
+    video_token_id = processor.tokenizer.convert_tokens_to_ids("<|video_pad|>")
+    vision_start_token_id = processor.tokenizer.convert_tokens_to_ids("<|vision_start|>")
+    if image_grid_thw is None and video_grid_thw is None:
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        return position_ids.unsqueeze(0).expand(3, -1)
+
+    position_ids = torch.ones(3, input_ids.size(0), dtype=input_ids.dtype)
+    image_index, video_index = 0, 0
+    input_ids = input_ids[attention_mask == 1]
+    vision_start_indices = torch.argwhere(input_ids == vision_start_token_id)
+    vision_tokens = input_ids[vision_start_indices + 1]
+    image_nums = (vision_tokens == image_token_id).sum()
+    video_nums = (vision_tokens == video_token_id).sum()
+    input_tokens = input_ids.tolist()
+    llm_pos_ids_list: list = []
+    st = 0
+    remain_images, remain_videos = image_nums, video_nums
+    for _ in range(image_nums + video_nums):
+        if image_token_id in input_tokens and remain_images > 0:
+            ed_image = input_tokens.index(image_token_id, st)
+        else:
+            ed_image = len(input_tokens) + 1
+        if video_token_id in input_tokens and remain_videos > 0:
+            ed_video = input_tokens.index(video_token_id, st)
+        else:
+            ed_video = len(input_tokens) + 1
+        if ed_image < ed_video:
+            t, h, w = image_grid_thw[image_index]
+            second_per_grid_t = 0
+            image_index += 1
+            remain_images -= 1
+            ed = ed_image
+        else:
+            t, h, w = video_grid_thw[video_index]
+            second_per_grid_t = second_per_grid_ts[video_index] if second_per_grid_ts is not None else 1.0
+            video_index += 1
+            remain_videos -= 1
+            ed = ed_video
+
+        llm_grid_t, llm_grid_h, llm_grid_w = t.item(), h.item() // spatial_merge_size, w.item() // spatial_merge_size
+        text_len = ed - st
+        st_idx = llm_pos_ids_list[-1].max() + 1 if len(llm_pos_ids_list) > 0 else 0
+        llm_pos_ids_list.append(torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx)
+        t_index = torch.arange(llm_grid_t).view(-1, 1).expand(-1, llm_grid_h * llm_grid_w)
+        t_index = (t_index * second_per_grid_t * tokens_per_second).long().flatten()
+        h_index = torch.arange(llm_grid_h).view(1, -1, 1).expand(llm_grid_t, -1, llm_grid_w).flatten()
+        w_index = torch.arange(llm_grid_w).view(1, 1, -1).expand(llm_grid_t, llm_grid_h, -1).flatten()
+        llm_pos_ids_list.append(torch.stack([t_index, h_index, w_index]) + text_len + st_idx)
+        st = ed + llm_grid_t * llm_grid_h * llm_grid_w
+
+    if st < len(input_tokens):
+        st_idx = llm_pos_ids_list[-1].max() + 1 if len(llm_pos_ids_list) > 0 else 0
+        text_len = len(input_tokens) - st
+        llm_pos_ids_list.append(torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx)
+
+    llm_positions = torch.cat(llm_pos_ids_list, dim=1).reshape(3, -1)
+    position_ids[..., attention_mask == 1] = llm_positions
+    return position_ids
+
+
+def _make_example(processor, num_images: int, num_videos: int, seed: int, second_per_grid_t: Optional[float]):
+    generator = torch.Generator().manual_seed(seed)
+    sizes = torch.randint(28, 400, size=(num_images + num_videos, 2), generator=generator).tolist()
+    images = [Image.new("RGB", tuple(size)) for size in sizes[:num_images]]
+    videos = [[Image.new("RGB", tuple(size))] * 4 for size in sizes[num_images:]]
+    text = f"example {seed}: "
+    text += "look <|vision_start|><|image_pad|><|vision_end|> then " * num_images
+    text += "watch <|vision_start|><|video_pad|><|vision_end|> and " * num_videos
+    text += "answer." * (seed % 3 + 1)
+    model_inputs = processor(
+        images=images or None, videos=videos or None, text=[text], add_special_tokens=False, return_tensors="pt"
+    )
+    example = {"input_ids": model_inputs["input_ids"][0]}
+    example["image_grid_thw"] = model_inputs.get("image_grid_thw")
+    example["video_grid_thw"] = model_inputs.get("video_grid_thw")
+    example["second_per_grid_ts"] = [second_per_grid_t] * num_videos if second_per_grid_t is not None else None
+    return example
+
+
+def _pad_batch(examples: List[Dict[str, Any]], pad_token_id: int, left_pad: bool):
+    max_length = max(len(example["input_ids"]) for example in examples) + 3
+    input_ids = torch.full((len(examples), max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros_like(input_ids)
+    for idx, example in enumerate(examples):
+        length = len(example["input_ids"])
+        span = slice(max_length - length, max_length) if left_pad else slice(0, length)
+        input_ids[idx, span] = example["input_ids"]
+        attention_mask[idx, span] = 1
+
+    return input_ids, attention_mask
+
+
+def _concat(values: List[Optional[Any]]) -> Optional[Any]:
+    values = [value for value in values if value is not None]
+    if len(values) == 0:
+        return None
+    elif isinstance(values[0], torch.Tensor):
+        return torch.cat(values)
+    else:
+        return sum(values, [])
+
+
+@pytest.mark.parametrize("left_pad", [True, False])
+@pytest.mark.parametrize(
+    "vision_counts, second_per_grid_t",
+    [
+        ([(0, 0), (0, 0)], None),  # text-only
+        ([(3, 0), (1, 0), (5, 0)], None),  # multi-image
+        ([(0, 1), (0, 2)], None),  # video without second_per_grid_ts
+        ([(0, 1), (0, 2)], 0.5),
+        ([(2, 1), (0, 0), (1, 0), (0, 1)], 1.0),  # mixed
+    ],
+)
+def test_get_rope_index_batch_matches_loop(processor, left_pad, vision_counts, second_per_grid_t):
+    examples = [
+        _make_example(processor, num_images, num_videos, seed, second_per_grid_t)
+        for seed, (num_images, num_videos) in enumerate(vision_counts)
+    ]
+    input_ids, attention_mask = _pad_batch(examples, processor.tokenizer.pad_token_id, left_pad)
+    expected = torch.stack(
+        [
+            get_rope_index_loop(
+                processor,
+                input_ids[idx],
+                image_grid_thw=example["image_grid_thw"],
+                video_grid_thw=example["video_grid_thw"],
+                second_per_grid_ts=example["second_per_grid_ts"],
+                attention_mask=attention_mask[idx],
+            )
+            for idx, example in enumerate(examples)
+        ]
+    )
+    position_ids = get_rope_index_batch(
+        processor,
+        input_ids,
+        image_grid_thw=_concat([example["image_grid_thw"] for example in examples]),
+        video_grid_thw=_concat([example["video_grid_thw"] for example in examples]),
+        second_per_grid_ts=_concat([example["second_per_grid_ts"] for example in examples]),
+        attention_mask=attention_mask,
+    )
+    assert position_ids.shape == (len(examples), 3, input_ids.size(-1))
+    assert torch.equal(position_ids, expected)
+
+    for idx, example in enumerate(examples):  # the single-example wrapper used by the dataset
+        single_position_ids = get_rope_index(
+            processor,
+            input_ids[idx],
+            image_grid_thw=example["image_grid_thw"],
+            video_grid_thw=example["video_grid_thw"],
+            second_per_grid_ts=example["second_per_grid_ts"],
+            attention_mask=attention_mask[idx],
+        )
+        assert torch.equal(single_position_ids, expected[idx])
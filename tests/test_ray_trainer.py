@@ -0,0 +1,103 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from verl.protocol import DataProto
+from verl.trainer.ray_trainer import RayPPOTrainer
+from verl.utils.seqlen_balancing import ResponseLengthPredictor
+
+
+def _generate(samples: List[Tuple[str, int]], finished: List[bool], rollout_age: List[int]):
+    uids = np.array([uid for uid, _ in samples], dtype=object)
+    sample_ids = torch.tensor([sample_id for _, sample_id in samples])
+    gen_batch = DataProto.from_dict(tensors={"input_ids": sample_ids.view(-1, 1)})
+    batch = DataProto.from_dict(tensors={"sample_id": sample_ids}, non_tensors={"uid": uids})
+    batch.non_tensor_batch["rollout_age"] = np.array(rollout_age, dtype=np.int64)
+    partial_response_ids = np.empty(len(samples), dtype=object)
+    for idx in range(len(samples)):
+        partial_response_ids[idx] = np.zeros(1, dtype=np.int64)
+
+    gen_batch_output = DataProto.from_dict(tensors={"responses": sample_ids.view(-1, 1)})
+    gen_batch_output.non_tensor_batch = {  # kept as the typed arrays of the rollout
+        "finished": np.array(finished),
+        "finish_time": np.arange(len(samples), dtype=np.float64),
+        "partial_response_ids": partial_response_ids,
+    }
+    return gen_batch, batch, gen_batch_output
+
+
+def test_collect_finished_samples_keeps_groups_contiguous():
+    trainer = SimpleNamespace(partial_samples=None, finished_samples=None)
+    metrics = defaultdict(list)
+    samples = [("a", 0), ("a", 1), ("b", 2), ("b", 3), ("c", 4), ("c", 5)]
+    step = _generate(samples, [True, False, True, True, True, False], [0] * 6)
+    released = RayPPOTrainer._collect_finished_samples(trainer, *step, metrics)
+    assert released.non_tensor_batch["uid"].tolist() == ["b", "b"]
+    assert trainer.partial_samples.non_tensor_batch["uid"].tolist() == ["a", "c"]
+
+    # the waiting samples finished last time are released with their siblings
+    samples = [("a", 1), ("c", 5), ("d", 6), ("d", 7)]
+    step = _generate(samples, [True] * 4, [1, 1, 0, 0])
+    released = RayPPOTrainer._collect_finished_samples(trainer, *step, metrics)
+    assert released.non_tensor_batch["uid"].tolist() == ["a", "a", "c", "c", "d", "d"]
+    assert released.batch["sample_id"].tolist() == [0, 1, 4, 5, 6, 7]
+    assert trainer.finished_samples is None
+
+
+def test_rollout_samples_are_restored_from_checkpoint(tmp_path):
+    trainer = SimpleNamespace(partial_samples=None, finished_samples=None)
+    samples = [("a", 0), ("a", 1), ("b", 2), ("b", 3)]
+    step = _generate(samples, [True, False, True, True], [0] * 4)
+    RayPPOTrainer._collect_finished_samples(trainer, *step, defaultdict(list))
+    RayPPOTrainer._save_rollout_samples(trainer, str(tmp_path))
+
+    restored = SimpleNamespace(partial_samples=None, finished_samples=None)
+    RayPPOTrainer._load_rollout_samples(restored, str(tmp_path))
+    for name in ("partial_samples", "finished_samples"):
+        samples, restored_samples = getattr(trainer, name), getattr(restored, name)
+        assert restored_samples.batch.keys() == samples.batch.keys()
+        for key in samples.batch.keys():
+            assert torch.equal(restored_samples.batch[key], samples.batch[key])
+
+        assert restored_samples.non_tensor_batch.keys() == samples.non_tensor_batch.keys()
+        assert restored_samples.non_tensor_batch["uid"].tolist() == samples.non_tensor_batch["uid"].tolist()
+
+    # nothing is saved without carried over samples
+    RayPPOTrainer._save_rollout_samples(
+        SimpleNamespace(partial_samples=None, finished_samples=None), str(tmp_path / "empty")
+    )
+    assert not (tmp_path / "empty").exists()
+
+
+def test_length_balancing_skip_is_logged_once(capsys):
+    length_predictor = ResponseLengthPredictor()
+    length_predictor.update(np.arange(6), np.arange(6, dtype=np.float64))
+    trainer = SimpleNamespace(
+        length_predictor=length_predictor,
+        actor_rollout_ref_wg=SimpleNamespace(world_size=4),
+        length_balancing_skip_logged=False,
+    )
+    metrics = defaultdict(list)
+    for _ in range(3):
+        batch = DataProto.from_dict(non_tensors={"dataset_index": np.arange(6)})
+        RayPPOTrainer._sort_by_predicted_length(trainer, batch, metrics)
+
+    assert capsys.readouterr().out.count("Skip balancing") == 1
+    assert metrics["rollout/length_balancing_skipped"] == [1.0] * 3
@@ -0,0 +1,70 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import torch
+from conftest import make_prompts
+
+from verl.workers.reward import BatchFunctionRewardManager, RewardConfig, make_stream_reward_chunk
+from verl.workers.rollout.config import RolloutConfig
+from verl.workers.rollout.stub_rollout import StubRollout
+
+
+REWARD_FUNCTION = """
+def main(reward_inputs):
+    return [
+        {"overall": reward_input["response_length"] / 10.0, "accuracy": float(reward_input["ground_truth"] == "1")}
+        for reward_input in reward_inputs
+    ]
+"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 32])
+def test_stream_reward_matches_batch_reward(tmp_path, tokenizer, chunk_size: int):
+    (tmp_path / "reward.py").write_text(REWARD_FUNCTION)
+    reward_config = RewardConfig(reward_function=str(tmp_path / "reward.py"))
+    reward_config.post_init()
+    reward_fn = BatchFunctionRewardManager(reward_config, tokenizer)
+    rollout_config = RolloutConfig(name="stub", n=4)
+    rollout_config.response_length = 32
+    rollout = StubRollout(rollout_config, tokenizer)
+
+    prompts = make_prompts(tokenizer, batch_size=8, prompt_length=8)
+    prompts.non_tensor_batch["uid"] = np.array([f"uid{idx}" for idx in range(8)], dtype=object)
+    prompts.non_tensor_batch["ground_truth"] = np.array([str(idx % 2) for idx in range(8)], dtype=object)
+    uids, ground_truths = prompts.non_tensor_batch["uid"], prompts.non_tensor_batch["ground_truth"]
+    callback_indices = []
+
+    def completion_callback(indices, outputs):
+        callback_indices.extend(indices)
+        reward_fn.compute_stream_reward(make_stream_reward_chunk(prompts, indices, outputs, 0, 32))
+
+    output = rollout.generate_sequences(prompts, completion_callback=completion_callback, chunk_size=chunk_size)
+    assert sorted(callback_indices) == list(range(8))
+
+    output.non_tensor_batch["uid"] = np.repeat(uids, 4)
+    output.non_tensor_batch["ground_truth"] = np.repeat(ground_truths, 4)
+    reward_tensor, reward_metrics = reward_fn.collect_stream_reward(output)
+    expected_tensor, expected_metrics = reward_fn.compute_reward(output)
+    assert torch.equal(reward_tensor, expected_tensor)
+    assert reward_metrics == expected_metrics
+    assert len(reward_fn.stream_scores) == 0
+
+    # the scores of a generation that is never collected are dropped
+    prompts.non_tensor_batch["raw_prompt_ids"] = np.array([[0]] * 8, dtype=object)  # popped by the rollout
+    rollout.generate_sequences(prompts, completion_callback=completion_callback, chunk_size=chunk_size)
+    assert len(reward_fn.stream_scores) == 32
+    reward_fn.clear_stream_reward()
+    assert len(reward_fn.stream_scores) == 0
@@ -0,0 +1,72 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from transformers import Qwen2Config
+
+from verl.workers.rollout.memory import estimate_weight_bytes, get_kv_cache_bytes_per_token, plan_rollout_memory
+
+
+GB = 1024**3
+PLAN_KWARGS = dict(
+    total_bytes=80 * GB,
+    weight_bytes=16 * GB,
+    kv_cache_bytes_per_token=1024**2 // 16,  # a block of 16 tokens is 1 MB
+    block_size=16,
+    max_prompt_length=1024,
+    max_sequence_length=4096,
+    max_num_batched_tokens=8192,
+    reserved_bytes=2 * GB,
+    max_gpu_memory_utilization=0.9,
+)
+
+
+def test_plan_is_bounded_by_free_memory():
+    plan = plan_rollout_memory(free_bytes=40 * GB, **PLAN_KWARGS)
+    assert plan.num_kv_cache_blocks == (40 - 16 - 2) * 1024
+    assert plan.max_num_seqs == plan.num_kv_cache_blocks // 256
+    assert plan.gpu_memory_utilization == pytest.approx(40 / 80)
+    assert plan.max_num_batched_tokens == 8192
+
+    # the free memory above the utilization bound is not used
+    plan = plan_rollout_memory(free_bytes=80 * GB, **PLAN_KWARGS)
+    assert plan.gpu_memory_utilization == pytest.approx(0.9, abs=1e-3)
+
+
+def test_plan_is_capped_by_concurrency():
+    plan = plan_rollout_memory(free_bytes=40 * GB, max_concurrency=4, **PLAN_KWARGS)
+    assert plan.num_kv_cache_blocks == 4 * 256
+    assert plan.max_num_seqs == 4
+    # the prompts of the running sequences are prefilled in a step, a step fits the longest sequence
+    assert plan.max_num_batched_tokens == 4096
+    assert plan.gpu_memory_utilization == pytest.approx((16 + 2 + 1) / 80)
+
+    # more concurrency than the free memory is bounded by the free memory
+    plan = plan_rollout_memory(free_bytes=40 * GB, max_concurrency=1 << 20, **PLAN_KWARGS)
+    assert plan.num_kv_cache_blocks == (40 - 16 - 2) * 1024
+
+
+def test_plan_rejects_memory_without_a_sequence():
+    with pytest.raises(ValueError, match="cannot hold a sequence"):
+        plan_rollout_memory(free_bytes=18 * GB, **PLAN_KWARGS)
+
+
+def test_weight_and_kv_cache_bytes():
+    assert estimate_weight_bytes(1000, dtype_size=2, tensor_parallel_size=2, margin_ratio=0.0) == 1000
+    assert estimate_weight_bytes(1000, dtype_size=2, tensor_parallel_size=2) == 1100
+
+    config = Qwen2Config(hidden_size=256, num_attention_heads=8, num_key_value_heads=2, num_hidden_layers=4)
+    assert get_kv_cache_bytes_per_token(config, dtype_size=2, tensor_parallel_size=1) == 2 * 4 * 2 * 32 * 2
+    # the kv heads are replicated if tp is larger than the number of kv heads
+    assert get_kv_cache_bytes_per_token(config, dtype_size=2, tensor_parallel_size=4) == 2 * 4 * 1 * 32 * 2
@@ -0,0 +1,42 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import torch
+
+from verl.protocol import DataProto
+from verl.utils.seqlen_balancing import prepare_dynamic_batch, restore_dynamic_batch
+
+
+def test_prepare_dynamic_batch_reuses_partitions():
+    lengths = torch.tensor([7, 1, 3, 8, 2, 5, 6, 4])
+    attention_mask = (torch.arange(8) < lengths[:, None]).long()
+    data = DataProto.from_dict(
+        tensors={"input_ids": torch.arange(64).view(8, 8), "attention_mask": attention_mask},
+        non_tensors={"uid": np.arange(8)},
+    )
+    micro_batches, batch_idx_list = prepare_dynamic_batch(data, max_token_len=16)
+    assert all(micro_batch.batch["attention_mask"].sum() <= 16 for micro_batch in micro_batches)
+    for micro_batch, batch_idx in zip(micro_batches, batch_idx_list):
+        assert micro_batch.non_tensor_batch["uid"].tolist() == batch_idx
+
+    # the partitions given are reused without planning again
+    reused_batches, reused_idx_list = prepare_dynamic_batch(data, max_token_len=16, batch_idx_list=batch_idx_list)
+    assert reused_idx_list is batch_idx_list
+    for micro_batch, reused_batch in zip(micro_batches, reused_batches):
+        assert torch.equal(micro_batch.batch["input_ids"], reused_batch.batch["input_ids"])
+
+    input_ids = torch.cat([micro_batch.batch["input_ids"] for micro_batch in reused_batches])
+    assert torch.equal(restore_dynamic_batch(input_ids, reused_idx_list), data.batch["input_ids"])
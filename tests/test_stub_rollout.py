@@ -0,0 +1,103 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import torch
+from conftest import make_prompts
+
+from verl.trainer.metrics import compute_prefix_cache_metrics
+from verl.workers.rollout.config import RolloutConfig
+from verl.workers.rollout.stub_rollout import StubRollout
+
+
+def test_stub_rollout_samples_plain_tokens(tokenizer):
+    config = RolloutConfig(name="stub", n=4)
+    config.response_length = 64
+    rollout = StubRollout(config, tokenizer)
+    output = rollout.generate_sequences(make_prompts(tokenizer, batch_size=8, prompt_length=16))
+    responses, response_mask = output.batch["responses"], output.batch["response_mask"].bool()
+    assert responses.shape == (32, 64)
+
+    # the tokens before the last one are plain text, the stopped responses end with an eos token
+    lengths = response_mask.sum(-1)
+    text_mask = torch.arange(64) < (lengths - 1).unsqueeze(-1)
+    text_ids = responses[text_mask]
+    assert text_ids.max() < tokenizer.vocab_size
+    assert not np.isin(text_ids.numpy(), tokenizer.all_special_ids).any()
+    last_ids = responses[torch.arange(32), lengths - 1]
+    assert torch.all((last_ids == tokenizer.eos_token_id) | (lengths == 64))
+    assert torch.all(responses[~response_mask] == tokenizer.pad_token_id)
+
+
+def test_stub_rollout_reports_and_resets_prefix_cache_stats(tokenizer):
+    config = RolloutConfig(name="stub", n=4, enable_prefix_caching=True)
+    config.response_length = 16
+    rollout = StubRollout(config, tokenizer)
+    rollout.generate_sequences(make_prompts(tokenizer, batch_size=8, prompt_length=40))
+    stats = rollout.get_prefix_cache_stats()
+    # each of the 4 samples prefills 40 tokens, 3 of them hit the 2 full blocks of the first one
+    assert stats == {"num_prompt_tokens": 8 * 4 * 40, "num_cached_tokens": 8 * 3 * 32}
+    assert compute_prefix_cache_metrics([stats, dict.fromkeys(stats, 0)]) == {
+        "prefix_cache/hit_rate": 3 * 32 / (4 * 40),
+        "prefix_cache/prefill_tokens_saved": 8 * 3 * 32,
+    }
+    assert rollout.get_prefix_cache_stats() == {"num_prompt_tokens": 0, "num_cached_tokens": 0}
+
+    config.enable_prefix_caching = False
+    rollout.generate_sequences(make_prompts(tokenizer, batch_size=8, prompt_length=40))
+    assert rollout.get_prefix_cache_stats() == {"num_prompt_tokens": 8 * 4 * 40, "num_cached_tokens": 0}
+
+
+def _make_partial_prompts(tokenizer, partial_lengths):
+    prompts = make_prompts(tokenizer, batch_size=len(partial_lengths), prompt_length=16)
+    prompts.meta_info["n"] = 1
+    prompts.non_tensor_batch["partial_response_ids"] = np.empty(len(partial_lengths), dtype=object)
+    for idx, length in enumerate(partial_lengths):
+        prompts.non_tensor_batch["partial_response_ids"][idx] = np.arange(100, 100 + length, dtype=np.int64)
+
+    return prompts
+
+
+def test_stub_rollout_continues_partial_responses(tokenizer):
+    config = RolloutConfig(name="stub", partial_rollout_ratio=0.5)
+    config.response_length = 64
+    rollout = StubRollout(config, tokenizer)
+    partial_lengths = 4 * np.arange(8)
+    prompts = _make_partial_prompts(tokenizer, partial_lengths)
+    batch_partial_response_ids = prompts.non_tensor_batch["partial_response_ids"]
+    output = rollout.generate_sequences(prompts)
+    finished = output.non_tensor_batch["finished"]
+    assert finished.sum() >= 4 and len(output.non_tensor_batch["finish_time"]) == 8
+    assert rollout.get_prefix_cache_stats()["num_prompt_tokens"] == 8 * 16 + partial_lengths.sum()
+
+    # the responses continue from the partial ones, the unfinished ones stop at the same step without an eos token
+    lengths = np.array([len(ids) for ids in output.non_tensor_batch["partial_response_ids"]])
+    generated_lengths = lengths - partial_lengths
+    assert np.all(generated_lengths >= 1)
+    assert np.all(generated_lengths[finished] <= generated_lengths[~finished].min(initial=64))
+    assert len(set(generated_lengths[~finished].tolist())) <= 1
+    for idx, partial_response_ids in enumerate(output.non_tensor_batch["partial_response_ids"]):
+        assert partial_response_ids.tolist() == output.batch["responses"][idx, : lengths[idx]].tolist()
+        assert partial_response_ids[: partial_lengths[idx]].tolist() == batch_partial_response_ids[idx].tolist()
+        assert (partial_response_ids[-1] == tokenizer.eos_token_id) == (finished[idx] and lengths[idx] < 64)
+
+
+def test_stub_rollout_stops_partial_rollout_at_token_budget(tokenizer):
+    config = RolloutConfig(name="stub", partial_rollout_token_budget=20, stub_response_length_std=0.0)
+    config.response_length = 64
+    rollout = StubRollout(config, tokenizer)
+    output = rollout.generate_sequences(_make_partial_prompts(tokenizer, [1] * 8))
+    # the 8 samples decode concurrently, the budget of 20 tokens is used up at the third step
+    lengths = [len(ids) for ids in output.non_tensor_batch["partial_response_ids"]]
+    assert lengths == [1 + 3] * 8 and not output.non_tensor_batch["finished"].any()
@@ -0,0 +1,49 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+
+import numpy as np
+import pytest
+import torch
+
+from verl.utils.torch_functional import pad_2d_list_to_length, pad_2d_list_to_numpy
+
+
+@pytest.mark.parametrize(
+    "response, max_length",
+    [
+        ([[1, 2, 3], [4], [5, 6]], None),
+        ([[], [2**31 - 1, 7], [3]], None),  # an empty first row
+        ([array("l", [1, 2]), (3,), []], 6),
+        ([[0.5, -1.0], []], 3),
+        ([[], []], None),
+        ([[], []], 2),
+    ],
+)
+def test_pad_2d_list_to_numpy(response, max_length):
+    target_length = max([len(sub_list) for sub_list in response] + [max_length or 0])
+    expected = [list(sub_list) + [0] * (target_length - len(sub_list)) for sub_list in response]
+    padded = pad_2d_list_to_numpy(response, 0, max_length=max_length)
+    assert padded.tolist() == expected
+    first_row = next((sub_list for sub_list in response if len(sub_list) != 0), [0])
+    assert padded.dtype == np.asarray(first_row).dtype
+    assert pad_2d_list_to_numpy(response, 0, max_length=max_length, dtype=np.int32).dtype == np.int32
+    assert torch.equal(pad_2d_list_to_length(response, 0, max_length), torch.from_numpy(padded))
+
+
+def test_pad_2d_list_to_numpy_empty():
+    assert pad_2d_list_to_numpy([], 0).shape == (0, 0)
+    padded = pad_2d_list_to_numpy([], 0, max_length=4, dtype=np.int32)
+    assert padded.shape == (0, 4) and padded.dtype == np.int32
@@ -15,7 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 import torch
 
@@ -44,107 +44,101 @@ else:
     )
 
 
-def get_rope_index(
+def get_rope_index_batch(
     processor: "Qwen2VLProcessor",
     input_ids: torch.Tensor,
     image_grid_thw: Optional[torch.Tensor] = None,
     video_grid_thw: Optional[torch.Tensor] = None,
-    second_per_grid_ts: Optional[torch.Tensor] = None,
+    second_per_grid_ts: Optional[Union[torch.Tensor, List[float]]] = None,
     attention_mask: Optional[torch.Tensor] = None,
 ) -> torch.Tensor:
     """
-    Gets the position ids for Qwen2-VL, it should be generated before sharding the sequence.
-    The batch dim has been removed and the input_ids should be a 1D tensor representing a single example.
+    Gets the position ids for Qwen2-VL of a padded batch, it should be generated before sharding the sequence.
+    The input_ids should be a 2D tensor (bsz, seqlen), the grids are ordered by example and then by occurrence.
+    Returns a tensor of shape (bsz, 3, seqlen).
     https://github.com/huggingface/transformers/blob/v4.52.4/src/transformers/models/qwen2_5_vl/modeling_qwen2_5_vl.py#L1405
     """
     spatial_merge_size = processor.image_processor.merge_size
     tokens_per_second = 2
     image_token_id = processor.tokenizer.convert_tokens_to_ids("<|image_pad|>")
     video_token_id = processor.tokenizer.convert_tokens_to_ids("<|video_pad|>")
-    vision_start_token_id = processor.tokenizer.convert_tokens_to_ids("<|vision_start|>")
-    if input_ids is not None and (image_grid_thw is not None or video_grid_thw is not None):
-        if attention_mask is None:
-            attention_mask = torch.ones_like(input_ids)
-
-        position_ids = torch.ones(3, input_ids.size(0), dtype=input_ids.dtype, device=input_ids.device)  # (3, seqlen)
-        image_index, video_index = 0, 0
-        input_ids = input_ids[attention_mask == 1]
-        image_nums, video_nums = 0, 0
-        vision_start_indices = torch.argwhere(input_ids == vision_start_token_id)
-        vision_tokens = input_ids[vision_start_indices + 1]
-        image_nums = (vision_tokens == image_token_id).sum()
-        video_nums = (vision_tokens == video_token_id).sum()
-        input_tokens = input_ids.tolist()
-        llm_pos_ids_list: list = []
-        st = 0
-        remain_images, remain_videos = image_nums, video_nums
-        for _ in range(image_nums + video_nums):
-            if image_token_id in input_tokens and remain_images > 0:
-                ed_image = input_tokens.index(image_token_id, st)
-            else:
-                ed_image = len(input_tokens) + 1
-            if video_token_id in input_tokens and remain_videos > 0:
-                ed_video = input_tokens.index(video_token_id, st)
-            else:
-                ed_video = len(input_tokens) + 1
-            if ed_image < ed_video:
-                t, h, w = (
-                    image_grid_thw[image_index][0],
-                    image_grid_thw[image_index][1],
-                    image_grid_thw[image_index][2],
-                )
-                second_per_grid_t = 0
-                image_index += 1
-                remain_images -= 1
-                ed = ed_image
-            else:
-                t, h, w = (
-                    video_grid_thw[video_index][0],
-                    video_grid_thw[video_index][1],
-                    video_grid_thw[video_index][2],
-                )
-                if second_per_grid_ts is not None:
-                    second_per_grid_t = second_per_grid_ts[video_index]
-                else:
-                    second_per_grid_t = 1.0
-
-                video_index += 1
-                remain_videos -= 1
-                ed = ed_video
-
-            llm_grid_t, llm_grid_h, llm_grid_w = (
-                t.item(),
-                h.item() // spatial_merge_size,
-                w.item() // spatial_merge_size,
-            )
-            text_len = ed - st
-
-            st_idx = llm_pos_ids_list[-1].max() + 1 if len(llm_pos_ids_list) > 0 else 0
-            llm_pos_ids_list.append(torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx)
-
-            t_index = torch.arange(llm_grid_t).view(-1, 1).expand(-1, llm_grid_h * llm_grid_w)
-            t_index = (t_index * second_per_grid_t * tokens_per_second).long().flatten()
-            h_index = torch.arange(llm_grid_h).view(1, -1, 1).expand(llm_grid_t, -1, llm_grid_w).flatten()
-            w_index = torch.arange(llm_grid_w).view(1, 1, -1).expand(llm_grid_t, llm_grid_h, -1).flatten()
-            llm_pos_ids_list.append(torch.stack([t_index, h_index, w_index]) + text_len + st_idx)
-            st = ed + llm_grid_t * llm_grid_h * llm_grid_w
-
-        if st < len(input_tokens):
-            st_idx = llm_pos_ids_list[-1].max() + 1 if len(llm_pos_ids_list) > 0 else 0
-            text_len = len(input_tokens) - st
-            llm_pos_ids_list.append(torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx)
-
-        llm_positions = torch.cat(llm_pos_ids_list, dim=1).reshape(3, -1)
-        position_ids[..., attention_mask == 1] = llm_positions.to(position_ids.device)
-    else:
-        if attention_mask is not None:
-            position_ids = attention_mask.long().cumsum(-1) - 1
-            position_ids.masked_fill_(attention_mask == 0, 1)
-            position_ids = position_ids.unsqueeze(0).expand(3, -1).to(input_ids.device)
+    batch_size, seqlen = input_ids.shape
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+
+    valid_mask = attention_mask == 1
+    is_image = (input_ids == image_token_id) & valid_mask
+    is_video = (input_ids == video_token_id) & valid_mask
+    if image_grid_thw is None and video_grid_thw is None:
+        is_image, is_video = torch.zeros_like(is_image), torch.zeros_like(is_video)
+
+    # each run of vision tokens is a vision block, the blocks are matched with the grids in order
+    is_image_start, is_video_start = is_image.clone(), is_video.clone()
+    is_image_start[:, 1:] &= ~is_image[:, :-1]
+    is_video_start[:, 1:] &= ~is_video[:, :-1]
+    is_block_start = (is_image_start | is_video_start).flatten()
+    block_start_indices = torch.nonzero(is_block_start).squeeze(1)
+    block_is_video = is_video_start.flatten()[block_start_indices]
+    block_thw = torch.zeros(len(block_start_indices), 3, dtype=torch.long, device=input_ids.device)
+    block_second_per_grid_t = torch.zeros(len(block_start_indices), dtype=torch.float32, device=input_ids.device)
+    if image_grid_thw is not None:
+        block_thw[~block_is_video] = image_grid_thw.to(block_thw)
+
+    if video_grid_thw is not None:
+        block_thw[block_is_video] = video_grid_thw.to(block_thw)
+        if second_per_grid_ts is not None:
+            block_second_per_grid_t[block_is_video] = torch.as_tensor(second_per_grid_ts).to(block_second_per_grid_t)
         else:
-            position_ids = torch.arange(input_ids.shape[1], device=input_ids.device).view(1, -1).expand(3, -1)
+            block_second_per_grid_t[block_is_video] = 1.0
+
+    llm_grid_t = block_thw[:, 0]
+    llm_grid_h = block_thw[:, 1] // spatial_merge_size
+    llm_grid_w = block_thw[:, 2] // spatial_merge_size
+
+    # the (t, h, w) index of each vision token inside its block
+    vision_indices = torch.nonzero((is_image | is_video).flatten()).squeeze(1)
+    block_ids = torch.cumsum(is_block_start, dim=0)[vision_indices] - 1
+    offsets = vision_indices - block_start_indices[block_ids]
+    grid_h, grid_w = llm_grid_h[block_ids], llm_grid_w[block_ids]
+    t_index = ((offsets // (grid_h * grid_w)) * block_second_per_grid_t[block_ids] * tokens_per_second).long()
+    h_index = (offsets // grid_w) % grid_h
+    w_index = offsets % grid_w
+
+    # text tokens advance the position by one, a vision block advances it by its largest index plus one
+    max_t_index = ((llm_grid_t - 1) * block_second_per_grid_t * tokens_per_second).long()
+    block_span = torch.maximum(max_t_index, torch.maximum(llm_grid_h, llm_grid_w) - 1) + 1
+    increments = valid_mask.long().flatten()
+    increments[vision_indices] = 0
+    increments[block_start_indices + llm_grid_t * llm_grid_h * llm_grid_w - 1] = block_span
+    increments = increments.view(batch_size, seqlen)
+    start_positions = (torch.cumsum(increments, dim=-1) - increments).flatten()
+
+    position_ids = start_positions.unsqueeze(0).repeat(3, 1)  # (3, bsz * seqlen)
+    position_ids[:, vision_indices] += torch.stack([t_index, h_index, w_index])
+    position_ids[:, ~valid_mask.flatten()] = 1
+    return position_ids.view(3, batch_size, seqlen).transpose(0, 1).to(input_ids.dtype)
+
 
-    return position_ids
+def get_rope_index(
+    processor: "Qwen2VLProcessor",
+    input_ids: torch.Tensor,
+    image_grid_thw: Optional[torch.Tensor] = None,
+    video_grid_thw: Optional[torch.Tensor] = None,
+    second_per_grid_ts: Optional[Union[torch.Tensor, List[float]]] = None,
+    attention_mask: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """
+    Gets the position ids for Qwen2-VL, it should be generated before sharding the sequence.
+    The batch dim has been removed and the input_ids should be a 1D tensor representing a single example.
+    """
+    return get_rope_index_batch(
+        processor,
+        input_ids=input_ids.unsqueeze(0),
+        image_grid_thw=image_grid_thw,
+        video_grid_thw=video_grid_thw,
+        second_per_grid_ts=second_per_grid_ts,
+        attention_mask=attention_mask.unsqueeze(0) if attention_mask is not None else None,
+    )[0]  # (3, seqlen)
 
 
 def qwen2_vl_attn_forward(
@@ -29,7 +29,6 @@ import torch
 from numpy.typing import NDArray
 from tensordict import TensorDict
 from torch.distributed import ProcessGroup
-from torch.utils.data import DataLoader
 
 from .utils.py_functional import union_two_dict
 
@@ -42,7 +41,7 @@ except Exception:
     pass
 
 
-__all__ = ["DataProto", "union_tensor_dict"]
+__all__ = ["DataProto", "DataProtoBuilder", "union_tensor_dict"]
 
 
 def pad_dataproto_to_divisor(data: "DataProto", size_divisor: int) -> Tuple["DataProto", int]:
@@ -128,6 +127,21 @@ def union_numpy_dict(tensor_dict1: Dict[str, NDArray], tensor_dict2: Dict[str, N
     return tensor_dict1
 
 
+def get_group_index(values: NDArray) -> Tuple[NDArray, NDArray]:
+    """Group the samples sharing the same object, e.g., the multi-modal data repeated for the responses of a prompt,
+    since the repeated object arrays hold the references and pickling keeps them shared.
+
+    Returns:
+        Tuple[NDArray, NDArray]: the index of the first sample of each group, and the group index of each sample.
+    """
+    object_ids = np.fromiter((id(value) for value in values), dtype=np.int64, count=len(values))
+    _, first_indices, group_index = np.unique(object_ids, return_index=True, return_inverse=True)
+    order = np.argsort(first_indices)  # number the groups by their first samples
+    group_ranks = np.empty_like(order)
+    group_ranks[order] = np.arange(len(order))
+    return first_indices[order], group_ranks[group_index.reshape(-1)]
+
+
 def batch_collate(features: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
     if len(features) == 0:
         return {}
@@ -160,17 +174,24 @@ def fold_batch_dim(data: "DataProto", new_batch_size: int):
     return DataProto(batch=tensor, non_tensor_batch=non_tensor, meta_info=data.meta_info)
 
 
-def collate_fn(data_items: list["DataProtoItem"]):
-    batch = []
-    non_tensor_batch = []
-    for data in data_items:
-        batch.append(data.batch)
-        non_tensor_batch.append(data.non_tensor_batch)
-
-    batch = torch.stack(batch).contiguous()
-    non_tensor_batch = batch_collate(non_tensor_batch)
-    non_tensor_batch = {key: np.array(value, dtype=object) for key, value in non_tensor_batch.items()}
-    return DataProto(batch=batch, non_tensor_batch=non_tensor_batch)
+def _copy_value(value: Any) -> Any:
+    """Copy the tensors, arrays and containers recursively, other objects are shared."""
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    elif isinstance(value, np.ndarray):
+        value = value.copy()
+        if value.dtype == object:
+            flat_value = value.reshape(-1)  # a view of the copy
+            for idx, item in enumerate(flat_value):
+                flat_value[idx] = _copy_value(item)
+
+        return value
+    elif isinstance(value, dict):
+        return {key: _copy_value(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    else:
+        return value
 
 
 @dataclass
@@ -400,6 +421,28 @@ class DataProto:
 
         return DataProto(batch=sub_batch, non_tensor_batch=non_tensor_batch, meta_info=sub_meta_info)
 
+    def copy(self, deep: bool = False) -> "DataProto":
+        """Make a copy of the DataProto whose keys can be added, replaced or popped without affecting the original.
+
+        By default the columns are shared: the tensors and arrays are not copied until a key is replaced, so the
+        copy is nearly free. Use ``deep=True`` if the values will be modified in place, then the tensors, arrays
+        and containers are copied, while the other objects (e.g., images and bytes) are still shared, which is
+        much cheaper than ``copy.deepcopy`` for multi-modal batches.
+
+        Args:
+            deep (bool): whether to copy the values for in-place modification.
+
+        Returns:
+            DataProto: the copied DataProto.
+        """
+        if not deep:
+            batch = self.batch.clone(recurse=False) if self.batch is not None else None
+            return DataProto(batch=batch, non_tensor_batch=dict(self.non_tensor_batch), meta_info=dict(self.meta_info))
+
+        batch = self.batch.clone() if self.batch is not None else None
+        non_tensor_batch = {key: _copy_value(value) for key, value in self.non_tensor_batch.items()}
+        return DataProto(batch=batch, non_tensor_batch=non_tensor_batch, meta_info=_copy_value(self.meta_info))
+
     def index_select(self, index: Union[List[int], NDArray, torch.Tensor]) -> "DataProto":
         """Select a subset of the DataProto via index.
 
@@ -519,42 +562,44 @@ class DataProto:
     def make_iterator(
         self, mini_batch_size: int, epochs: int, seed: int = None, dataloader_kwargs: Dict[str, Any] = None
     ):
-        """Make an iterator from the DataProto. This is built upon that TensorDict can be used as a normal Pytorch
-        dataset. See https://pytorch.org/tensordict/tutorials/data_fashion for more details.
+        """Make an iterator from the DataProto. Each mini-batch is a slice of the batch, or an index select over
+        a permutation if shuffled, instead of collating the samples one by one through a DataLoader.
 
         Args:
             mini_batch_size (int): mini-batch size when iterating the dataset. We require that
                 ``batch.batch_size[0] % mini_batch_size == 0``
             epochs (int): number of epochs when iterating the dataset.
-            dataloader_kwargs: internally, it returns a DataLoader over the batch.
-                The dataloader_kwargs is the kwargs passed to the DataLoader
+            seed (int, optional): the seed of the permutation generator.
+            dataloader_kwargs: the DataLoader kwargs of the iterator, only ``shuffle`` is supported since the
+                samples are not loaded by a DataLoader. The samples are permuted again at each epoch if shuffled.
 
         Returns:
             Iterator: an iterator that yields a mini-batch data at a time. The total number of iteration steps is
             ``self.batch.batch_size * epochs // mini_batch_size``
         """
         assert self.batch.batch_size[0] % mini_batch_size == 0, f"{self.batch.batch_size[0]} % {mini_batch_size} != 0"
+        dataloader_kwargs = dataloader_kwargs or {}
+        assert isinstance(dataloader_kwargs, dict)
+        unsupported_kwargs = set(dataloader_kwargs.keys()) - {"shuffle"}
+        if unsupported_kwargs:
+            raise ValueError(f"Unsupported dataloader kwargs: {sorted(unsupported_kwargs)}.")
+
+        shuffle = dataloader_kwargs.get("shuffle", False)
         if seed is not None:
             generator = torch.Generator()
             generator.manual_seed(seed)
         else:
             generator = None
 
-        dataloader_kwargs = dataloader_kwargs or {}
-        assert isinstance(dataloader_kwargs, dict)
-        train_dataloader = DataLoader(
-            dataset=self,
-            batch_size=mini_batch_size,
-            collate_fn=collate_fn,
-            generator=generator,
-            **dataloader_kwargs,
-        )
-
         def get_data():
             for _ in range(epochs):
-                for data in train_dataloader:
-                    setattr(data, "meta_info", self.meta_info)
-                    yield data
+                if shuffle:
+                    indices = torch.randperm(len(self), generator=generator)
+                    for mini_batch_indices in indices.split(mini_batch_size):
+                        yield self.index_select(mini_batch_indices)
+                else:
+                    for start in range(0, len(self), mini_batch_size):
+                        yield self.slice_select(start, start + mini_batch_size)
 
         return iter(get_data())
 
@@ -630,7 +675,8 @@ class DataProto:
 
     def repeat(self, repeat_times: int, interleave: bool = True) -> "DataProto":
         """
-        Repeat the batch data a specified number of times.
+        Repeat the batch data a specified number of times. The object arrays repeat the references, so the repeated
+        samples share the same objects, see `get_group_index`.
 
         Args:
             repeat_times (int): Number of times to repeat the data.
@@ -671,6 +717,64 @@ class DataProto:
         )
 
 
+class DataProtoBuilder:
+    """
+    An append-only builder that accumulates DataProto parts and concatenates them only once.
+    Compared with calling ``DataProto.concat`` every time a part arrives, each row is copied at most once,
+    and the rows beyond ``max_size`` are dropped by slicing before the concatenation, so they are never copied.
+    If ``group_key`` is specified, the rows of a group (contiguous in each part) are never split by the truncation.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, group_key: Optional[str] = None):
+        self.max_size = max_size
+        self.group_key = group_key
+        self.parts: List[DataProto] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, data: DataProto) -> None:
+        if len(data) == 0:
+            return
+
+        self.parts.append(data)
+        self.size += len(data)
+
+    def build(self) -> DataProto:
+        """Concatenate the parts, truncated to ``max_size`` if specified.
+
+        Returns:
+            DataProto: the concatenated DataProto
+        """
+        assert len(self.parts) != 0, "cannot build an empty DataProto"
+        remaining = self.size if self.max_size is None else min(self.size, self.max_size)
+        parts = []
+        for part in self.parts:
+            if remaining <= 0:
+                break
+
+            if len(part) > remaining:
+                if self.group_key is not None:  # drop the group that would be cut in half
+                    group_ids = part.non_tensor_batch[self.group_key]
+                    while remaining > 0 and group_ids[remaining - 1] == group_ids[remaining]:
+                        remaining -= 1
+
+                    if remaining == 0:
+                        break
+
+                part = part[:remaining]  # slicing returns a view
+
+            parts.append(part)
+            remaining -= len(part)
+
+        assert len(parts) != 0, f"the first group is larger than {self.max_size=}"
+        if len(parts) == 1:
+            return parts[0]
+
+        return DataProto.concat(parts)
+
+
 @dataclass
 class DataProtoFuture:
     """
@@ -750,13 +854,55 @@ def allgather_dict_tensors(
     return output
 
 
+_GATHER_ALIGNMENT = 16
+
+
 def all_gather_data_proto(data: DataProto, size: int, group: ProcessGroup) -> None:
     # Note that this is an inplace operator just like torch.distributed.all_gather
+    # the tensors and the pickled non_tensor_batch are packed into one byte buffer and gathered by one collective
     prev_device = data.batch.device
-    data.batch = data.batch.cuda(device=torch.cuda.current_device())
-    data.batch = allgather_dict_tensors(data.batch.contiguous(), size=size, group=group, dim=0)
-    data.batch = data.batch.to(prev_device)
-    # all gather non_tensor_batch
-    all_non_tensor_batch = [None for _ in range(size)]
-    torch.distributed.all_gather_object(all_non_tensor_batch, data.non_tensor_batch, group=group)
+    if torch.distributed.get_backend(group) == "nccl":
+        device = torch.device("cuda", torch.cuda.current_device())
+    else:
+        device = torch.device("cpu")
+
+    keys = sorted(data.batch.keys())
+    tensors = [data.batch[key].contiguous() for key in keys]
+    chunks, offsets = [], []
+    buffer_size = 0
+    for tensor in tensors:
+        chunk = tensor.view(-1).view(torch.uint8)
+        aligned_size = -(-chunk.numel() // _GATHER_ALIGNMENT) * _GATHER_ALIGNMENT  # keep the dtype views aligned
+        chunks.append(chunk)
+        if aligned_size > chunk.numel():
+            chunks.append(chunk.new_zeros(aligned_size - chunk.numel()))
+
+        offsets.append(buffer_size)
+        buffer_size += aligned_size
+
+    # the pickled non_tensor_batch has different sizes on each rank, so we pad it to the largest one
+    payload = torch.frombuffer(bytearray(pickle.dumps(data.non_tensor_batch)), dtype=torch.uint8)
+    payload_sizes = torch.zeros(size, 1, dtype=torch.long, device=device)
+    torch.distributed.all_gather(
+        list(payload_sizes.unbind(0)), torch.tensor([payload.numel()], device=device), group=group
+    )
+    payload_sizes = payload_sizes.view(-1).tolist()
+    chunks.append(payload)
+    chunks.append(payload.new_zeros(max(payload_sizes) - payload.numel()))
+
+    buffer = torch.cat([chunk.to(device) for chunk in chunks])
+    output = torch.empty(size, buffer.numel(), dtype=torch.uint8, device=device)
+    torch.distributed.all_gather(list(output.unbind(0)), buffer, group=group)
+
+    gathered = {}
+    for key, tensor, offset in zip(keys, tensors, offsets):
+        nbytes = tensor.numel() * tensor.element_size()
+        value = output[:, offset : offset + nbytes].contiguous().view(tensor.dtype)
+        gathered[key] = value.view(size * tensor.size(0), *tensor.shape[1:]).to(prev_device)
+
+    data.batch = TensorDict(source=gathered, batch_size=data.batch.batch_size[0] * size)
+    payloads = output[:, buffer_size:].cpu()
+    all_non_tensor_batch = [
+        pickle.loads(payloads[rank, : payload_sizes[rank]].numpy().tobytes()) for rank in range(size)
+    ]
     data.non_tensor_batch = {k: np.concatenate([d[k] for d in all_non_tensor_batch]) for k in data.non_tensor_batch}
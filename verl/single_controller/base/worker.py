@@ -129,7 +129,7 @@ class Worker(WorkerHelper):
         self._rank = rank
         self._world_size = world_size
 
-        if "AMD" in torch.cuda.get_device_name():
+        if torch.cuda.is_available() and "AMD" in torch.cuda.get_device_name():
             os.environ["CUDA_VISIBLE_DEVICES"] = os.getenv("ROCR_VISIBLE_DEVICES")
             os.environ["LOCAL_RANK"] = os.getenv("RAY_LOCAL_RANK")
             cuda_visible_devices = os.getenv("LOCAL_RANK", "0")
@@ -277,6 +277,9 @@ class RayWorkerGroup(WorkerGroup):
                     "RAY_LOCAL_WORLD_SIZE": str(local_world_size),
                     "RAY_LOCAL_RANK": str(local_rank),
                 }
+                if not use_gpu:  # the workers use cpu even if the node has gpus
+                    env_vars["CUDA_VISIBLE_DEVICES"] = ""
+
                 if rank != 0:
                     env_vars["MASTER_ADDR"] = self._master_addr
                     env_vars["MASTER_PORT"] = self._master_port
@@ -54,6 +54,16 @@ class DataConfig:
     max_pixels: Optional[int] = 4194304
     filter_overlong_prompts: bool = True
     filter_overlong_prompts_workers: int = 16
+    cache_dir: Optional[str] = None
+    streaming: bool = False
+    shuffle_buffer_size: int = 10000
+    group_by_length: bool = False
+    group_size: int = 16
+    num_prefetch_batches: int = 1
+    num_workers: int = 8
+    persistent_workers: bool = True
+    pin_memory: bool = False
+    prefetch_factor: int = 2
 
     def post_init(self):
         if self.image_dir is not None:
@@ -70,6 +80,9 @@ class DataConfig:
                 print(f"Format prompt file {self.format_prompt} not found.")
                 self.format_prompt = None
 
+        if self.cache_dir is not None:  # ray job uses absolute path
+            self.cache_dir = os.path.abspath(self.cache_dir)
+
 
 @dataclass
 class AlgorithmConfig:
@@ -133,7 +146,9 @@ class TrainerConfig:
     nnodes: int = 1
     """number of nodes for training"""
     n_gpus_per_node: int = 8
-    """number of gpus per node for training"""
+    """number of gpus per node for training, or number of cpu workers per node on cpu"""
+    device: str = "cuda"
+    """device of the workers, `cuda` or `cpu`, the cpu workers use gloo and the stub rollout"""
     max_try_make_batch: int = 20
     """max number of generations for online filtering, -1 means no limit"""
     critic_warmup: int = 0
@@ -160,6 +175,9 @@ class TrainerConfig:
     """automatically find the last checkpoint in the save checkpoint path to resume training"""
 
     def post_init(self):
+        if self.device not in ("cuda", "cpu"):
+            raise ValueError(f"Unknown device {self.device}, please use `cuda` or `cpu`.")
+
         if self.save_checkpoint_path is None:
             self.save_checkpoint_path = os.path.join("checkpoints", self.project_name, self.experiment_name)
 
@@ -12,19 +12,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Optional
+import time
+from collections import defaultdict
+from queue import Queue
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional
 
+import numpy as np
 import torch
-from torch.utils.data import RandomSampler, SequentialSampler
+from torch.utils.data import Dataset, RandomSampler, SequentialSampler, get_worker_info
 from torchdata.stateful_dataloader import StatefulDataLoader
 from transformers import PreTrainedTokenizer, ProcessorMixin
 
-from ..utils.dataset import RLHFDataset, collate_fn
+from ..protocol import DataProto
+from ..utils.dataset import LengthGroupedSampler, RLHFDataset, StreamingRLHFDataset
 from .config import DataConfig
 
 
+WORKER_STATS_KEY = "_worker_stats"
+
+
+class WorkerStatsCollator:
+    """
+    Collates the samples in the dataloader worker, and attaches the id of the worker and the time it spent on loading
+    the samples of the batch. They are popped by the prefetcher before the batch is processed.
+    """
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset  # the dataset of the main process, used without workers
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        worker_info = get_worker_info()
+        dataset = worker_info.dataset if worker_info is not None else self.dataset
+        batch_dict = dataset.collate_fn(features)
+        batch_dict[WORKER_STATS_KEY] = {
+            "worker_id": worker_info.id if worker_info is not None else 0,
+            "load_time": dataset.pop_load_time(),
+        }
+        return batch_dict
+
+
 def create_dataloader(config: DataConfig, tokenizer: PreTrainedTokenizer, processor: Optional[ProcessorMixin]) -> None:
-    train_dataset = RLHFDataset(
+    dataset_kwargs = dict(
         data_path=config.train_files,
         tokenizer=tokenizer,
         processor=processor,
@@ -42,27 +71,49 @@ def create_dataloader(config: DataConfig, tokenizer: PreTrainedTokenizer, proces
         filter_overlong_prompts=config.filter_overlong_prompts,
         filter_overlong_prompts_workers=config.filter_overlong_prompts_workers,
     )
-    # use sampler for better ckpt resume
-    if config.shuffle:
-        train_dataloader_generator = torch.Generator()
-        train_dataloader_generator.manual_seed(config.seed)
-        sampler = RandomSampler(data_source=train_dataset, generator=train_dataloader_generator)
-    else:
-        sampler = SequentialSampler(data_source=train_dataset)
-
     if config.mini_rollout_batch_size is not None:
         train_batch_size = config.mini_rollout_batch_size
     else:
         train_batch_size = config.rollout_batch_size
 
+    if config.streaming:
+        # the stateful dataloader saves the position of each worker in the stream
+        train_dataset = StreamingRLHFDataset(
+            **dataset_kwargs,
+            shuffle=config.shuffle,
+            seed=config.seed,
+            shuffle_buffer_size=config.shuffle_buffer_size,
+        )
+        sampler = None
+    else:
+        train_dataset = RLHFDataset(**dataset_kwargs, cache_dir=config.cache_dir)
+        # use sampler for better ckpt resume
+        if config.group_by_length:
+            prompt_lengths, num_images = train_dataset.get_length_info(config.filter_overlong_prompts_workers)
+            sampler = LengthGroupedSampler(
+                prompt_lengths, num_images, batch_size=train_batch_size, group_size=config.group_size, seed=config.seed
+            )
+        elif config.shuffle:
+            train_dataloader_generator = torch.Generator()
+            train_dataloader_generator.manual_seed(config.seed)
+            sampler = RandomSampler(data_source=train_dataset, generator=train_dataloader_generator)
+        else:
+            sampler = SequentialSampler(data_source=train_dataset)
+
+    # persistent workers keep the forked dataset and processor across epochs instead of re-creating them
+    dataloader_kwargs = dict(
+        num_workers=config.num_workers,
+        pin_memory=config.pin_memory,
+        persistent_workers=config.num_workers > 0 and config.persistent_workers,
+        prefetch_factor=config.prefetch_factor if config.num_workers > 0 else None,
+    )
     train_dataloader = StatefulDataLoader(
         dataset=train_dataset,
         batch_size=train_batch_size,
         sampler=sampler,
-        num_workers=8,
-        collate_fn=collate_fn,
-        pin_memory=False,
         drop_last=True,
+        collate_fn=WorkerStatsCollator(train_dataset),
+        **dataloader_kwargs,
     )
 
     val_dataset = RLHFDataset(
@@ -79,6 +130,7 @@ def create_dataloader(config: DataConfig, tokenizer: PreTrainedTokenizer, proces
         min_pixels=config.min_pixels,
         max_pixels=config.max_pixels,
         filter_overlong_prompts=config.filter_overlong_prompts,
+        cache_dir=config.cache_dir,
     )
 
     if config.val_batch_size == -1:
@@ -90,14 +142,112 @@ def create_dataloader(config: DataConfig, tokenizer: PreTrainedTokenizer, proces
         dataset=val_dataset,
         batch_size=val_batch_size,
         shuffle=False,
-        num_workers=8,
-        collate_fn=collate_fn,
-        pin_memory=False,
         drop_last=False,
+        collate_fn=val_dataset.collate_fn,
+        **dataloader_kwargs,
     )
 
-    assert len(train_dataloader) >= 1
+    if not config.streaming:
+        assert len(train_dataloader) >= 1
+        print(f"Size of train dataloader: {len(train_dataloader)}")
+
     assert len(val_dataloader) >= 1
-    print(f"Size of train dataloader: {len(train_dataloader)}")
     print(f"Size of val dataloader: {len(val_dataloader)}")
     return train_dataloader, val_dataloader
+
+
+class DataPrefetcher:
+    """
+    Fetches and prepares the next batches in a background thread while the current step is running.
+    The dataloader state of the last consumed batch is kept for checkpointing, since the prefetched batches
+    have been taken from the dataloader but not trained on. With `num_prefetch_batches=0` it fetches synchronously.
+    """
+
+    def __init__(
+        self,
+        dataloader: StatefulDataLoader,
+        process_fn: Callable[[Dict[str, Any]], DataProto],
+        num_prefetch_batches: int = 1,
+    ):
+        self.dataloader = dataloader
+        self.process_fn = process_fn
+        self.data_iterator = iter(dataloader)
+        self.state_dict = dataloader.state_dict()
+        self.metrics = defaultdict(list)
+        self.worker_metrics = defaultdict(lambda: defaultdict(list))
+        self.start_time = time.perf_counter()
+        if num_prefetch_batches > 0:
+            self.queue = Queue(maxsize=num_prefetch_batches)
+            self.thread = Thread(target=self._prefetch, daemon=True)
+            self.thread.start()
+        else:
+            self.queue = None
+
+    def _fetch(self):
+        start_time = time.perf_counter()
+        try:
+            batch_dict = next(self.data_iterator)
+        except StopIteration:
+            dataset = self.dataloader.dataset
+            if hasattr(dataset, "set_epoch"):  # the streaming dataset is shuffled by the epoch
+                dataset.set_epoch(dataset.epoch + 1)
+
+            self.data_iterator = iter(self.dataloader)
+            batch_dict = next(self.data_iterator)
+
+        fetch_time = time.perf_counter() - start_time
+        worker_stats = batch_dict.pop(WORKER_STATS_KEY, None)
+        # take the state right after fetching, so that it matches this batch
+        return self.process_fn(batch_dict), self.dataloader.state_dict(), fetch_time, worker_stats
+
+    def _prefetch(self):
+        while True:
+            try:
+                self.queue.put(self._fetch())
+            except Exception as e:  # raise it in the main thread
+                self.queue.put(e)
+                return
+
+    def get(self) -> DataProto:
+        if self.queue is not None:
+            self.metrics["queue_size"].append(self.queue.qsize())
+            item = self.queue.get()
+        else:
+            item = self._fetch()
+
+        if isinstance(item, Exception):
+            raise item
+
+        batch, self.state_dict, fetch_time, worker_stats = item
+        self.metrics["fetch_time"].append(fetch_time)
+        self.metrics["num_samples"].append(len(batch))
+        if worker_stats is not None:
+            worker_metrics = self.worker_metrics[worker_stats["worker_id"]]
+            worker_metrics["load_time"].append(worker_stats["load_time"])
+            worker_metrics["num_samples"].append(len(batch))
+
+        # the padding if the prompts of this batch were padded to the longest one, reduced by grouping by length
+        prompt_length = batch.batch["attention_mask"].sum(-1).float()
+        self.metrics["prompt_padding_ratio"].append((1.0 - prompt_length.mean() / prompt_length.max()).item())
+        return batch
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Gets the metrics of the batches consumed since the last call, and resets them. The throughput is the samples
+        consumed per second of wall-clock time, and the throughput of each worker is the samples it loaded per second
+        of its loading time, which shows how many workers a node needs.
+        """
+        end_time, num_samples = time.perf_counter(), self.metrics.pop("num_samples")
+        metrics = {
+            "data/throughput": sum(num_samples) / max(end_time - self.start_time, 1e-6),
+            **{f"data/{key}": np.mean(value) for key, value in self.metrics.items()},
+        }
+        for worker_id, worker_metrics in sorted(self.worker_metrics.items()):
+            load_time = sum(worker_metrics["load_time"])
+            metrics[f"data/worker_{worker_id}/load_time"] = np.mean(worker_metrics["load_time"])
+            metrics[f"data/worker_{worker_id}/throughput"] = sum(worker_metrics["num_samples"]) / max(load_time, 1e-6)
+
+        self.start_time = end_time
+        self.metrics = defaultdict(list)
+        self.worker_metrics = defaultdict(lambda: defaultdict(list))
+        return metrics
@@ -63,7 +63,9 @@ class Runner:
             Role.ActorRolloutRef: global_pool_id,
             Role.Critic: global_pool_id,
         }
-        resource_pool_manager = ResourcePoolManager(resource_pool_spec=resource_pool_spec, mapping=mapping)
+        resource_pool_manager = ResourcePoolManager(
+            resource_pool_spec=resource_pool_spec, mapping=mapping, use_gpu=config.trainer.device == "cuda"
+        )
 
         if config.worker.reward.reward_type == "sequential":
             RewardManager = SequentialFunctionRewardManager
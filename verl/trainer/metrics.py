@@ -121,3 +121,12 @@ def compute_throughout_metrics(batch: DataProto, timing_raw: Dict[str, float], n
         "perf/time_per_step": time,
         "perf/throughput": total_num_tokens / (time * num_gpus),
     }
+
+
+def compute_prefix_cache_metrics(prefix_cache_stats: List[Dict[str, int]]) -> Dict[str, Any]:
+    num_prompt_tokens = sum(stats["num_prompt_tokens"] for stats in prefix_cache_stats)
+    num_cached_tokens = sum(stats["num_cached_tokens"] for stats in prefix_cache_stats)
+    return {
+        "prefix_cache/hit_rate": num_cached_tokens / max(num_prompt_tokens, 1),
+        "prefix_cache/prefill_tokens_saved": num_cached_tokens,
+    }
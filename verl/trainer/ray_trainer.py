@@ -18,9 +18,9 @@ This trainer supports model-agonistic model initialization with huggingface
 
 import json
 import os
+import time
 import uuid
 from collections import defaultdict
-from copy import deepcopy
 from dataclasses import dataclass, field
 from enum import IntEnum, auto
 from typing import Any, Dict, List, Optional, Type
@@ -32,7 +32,7 @@ from ray.experimental.tqdm_ray import tqdm
 from torchdata.stateful_dataloader import StatefulDataLoader
 from transformers import PreTrainedTokenizer, ProcessorMixin
 
-from ..protocol import DataProto, pad_dataproto_to_divisor, unpad_dataproto
+from ..protocol import DataProto, DataProtoBuilder, pad_dataproto_to_divisor, unpad_dataproto
 from ..single_controller.base import Worker
 from ..single_controller.ray import RayClassWithInitArgs, RayResourcePool, RayWorkerGroup
 from ..single_controller.ray.base import create_colocated_worker_cls
@@ -40,15 +40,17 @@ from ..utils import torch_functional as VF
 from ..utils.checkpoint import CHECKPOINT_TRACKER, find_latest_ckpt, remove_obsolete_ckpt
 from ..utils.logger import Tracker
 from ..utils.py_functional import convert_dict_to_str, timer
-from ..utils.seqlen_balancing import get_seqlen_balanced_partitions, log_seqlen_unbalance
+from ..utils.seqlen_balancing import ResponseLengthPredictor, get_seqlen_balanced_partitions, log_seqlen_unbalance
 from ..workers.fsdp_workers import FSDPWorker
 from ..workers.reward import FunctionRewardManager
 from . import core_algos
 from .config import PPOConfig
 from .core_algos import AdvantageEstimator, FixedKLController, KLController, compute_kl, get_kl_controller
+from .data_loader import DataPrefetcher
 from .metrics import (
     compute_data_metrics,
     compute_length_metrics,
+    compute_prefix_cache_metrics,
     compute_throughout_metrics,
     compute_timing_metrics,
     reduce_metrics,
@@ -77,6 +79,7 @@ class ResourcePoolManager:
 
     resource_pool_spec: dict[str, list[int]]
     mapping: dict[Role, str]
+    use_gpu: bool = True  # the workers without gpus use cpu and gloo
     resource_pool_dict: dict[str, RayResourcePool] = field(default_factory=dict)
 
     def create_resource_pool(self):
@@ -85,7 +88,10 @@ class ResourcePoolManager:
             # For FSDP backend, we recommend using max_colocate_count=1 that merge all WorkerGroups into one.
             # For Megatron backend, we recommend using max_colocate_count>1 that can utilize different WorkerGroup for differnt models
             resource_pool = RayResourcePool(
-                process_on_nodes=process_on_nodes, use_gpu=True, max_colocate_count=1, name_prefix=resource_pool_name
+                process_on_nodes=process_on_nodes,
+                use_gpu=self.use_gpu,
+                max_colocate_count=1,
+                name_prefix=resource_pool_name,
             )
             self.resource_pool_dict[resource_pool_name] = resource_pool
 
@@ -101,10 +107,11 @@ class ResourcePoolManager:
 
     def _check_resource_available(self):
         """Check if the resource pool can be satisfied in this ray cluster."""
-        gpus_available = ray.available_resources().get("GPU", 0)
-        gpus_required = self.get_num_gpus()
-        if gpus_available < gpus_required:
-            raise ValueError(f"Total available GPUs {gpus_available} is less than total desired GPUs {gpus_required}.")
+        resource_name = "GPU" if self.use_gpu else "CPU"  # each worker takes a gpu or a cpu
+        available = ray.available_resources().get(resource_name, 0)
+        required = self.get_num_gpus()
+        if available < required:
+            raise ValueError(f"Total available {resource_name}s {available} is less than total desired {required}.")
 
 
 def apply_kl_penalty(data: DataProto, kl_ctrl: KLController, kl_penalty="kl"):
@@ -237,6 +244,35 @@ class RayPPOTrainer:
         ):
             raise ValueError("GRPO and RLOO algorithm need `config.worker.rollout.n > 1`.")
 
+        if config.data.streaming and config.trainer.max_steps is None:
+            raise ValueError("Streaming dataset has no length, please set `config.trainer.max_steps`.")
+
+        if config.trainer.device == "cpu":
+            if config.worker.rollout.name == "vllm":
+                raise ValueError("vLLM rollout needs cuda, please use the stub rollout on cpu.")
+
+            if config.worker.actor.padding_free or config.worker.critic.padding_free:
+                raise ValueError("Padding free needs flash attention, please disable it on cpu.")
+
+            fsdp_configs = (config.worker.actor.fsdp, config.worker.critic.fsdp, config.worker.ref.fsdp)
+            if any(fsdp_config.enable_rank0_init for fsdp_config in fsdp_configs):
+                raise ValueError("Rank0 init syncs the module states on cuda, please disable it on cpu.")
+
+        self.partial_rollout = (
+            config.worker.rollout.partial_rollout_ratio < 1.0 or config.worker.rollout.partial_rollout_token_budget > 0
+        )
+        if self.partial_rollout and (
+            config.algorithm.adv_estimator == AdvantageEstimator.REMAX or config.worker.reward.stream_reward
+        ):
+            raise ValueError("Partial rollout does not support the remax advantage estimator or the stream reward.")
+
+        self.partial_samples: Optional[DataProto] = None  # unfinished samples to resume in the next generation
+        self.finished_samples: Optional[DataProto] = None  # finished samples waiting for the other samples of a prompt
+        self.length_predictor: Optional[ResponseLengthPredictor] = None
+        if config.worker.rollout.sort_by_predicted_length:
+            self.length_predictor = ResponseLengthPredictor()
+            self.length_balancing_skip_logged = False  # the skip is reported once, then only in the metrics
+
         if config.trainer.max_steps is not None:
             self.training_steps = config.trainer.max_steps
         elif config.data.mini_rollout_batch_size is not None:
@@ -306,6 +342,8 @@ class RayPPOTrainer:
         # we should create rollout at the end so that vllm can have a better estimation of kv cache memory
         self.actor_rollout_ref_wg = all_wg["actor_rollout_ref"]
         self.actor_rollout_ref_wg.init_model()
+        if self.config.worker.reward.stream_reward:
+            self.actor_rollout_ref_wg.set_stream_reward_fn(self.reward_fn)
 
     def _save_checkpoint(self) -> None:
         # path: {save_checkpoint_path}/global_step_{global_step}/{actor,critic}
@@ -328,8 +366,9 @@ class RayPPOTrainer:
             self.critic_wg.save_checkpoint(critic_path, save_model_only=self.config.trainer.save_model_only)
 
         dataloader_path = os.path.join(folder_path, "dataloader.pt")
-        dataloader_state_dict = self.train_dataloader.state_dict()
+        dataloader_state_dict = self.data_prefetcher.state_dict  # skip the prefetched batches
         torch.save(dataloader_state_dict, dataloader_path)
+        self._save_rollout_samples(folder_path)
 
         checkpointer_tracker_info = {
             "best_global_step": self.best_global_step,
@@ -370,6 +409,21 @@ class RayPPOTrainer:
         else:
             print(f"No dataloader state found at {dataloader_path}, will start from scratch.")
 
+        self._load_rollout_samples(load_checkpoint_path)
+
+    def _save_rollout_samples(self, folder_path: str) -> None:
+        """Save the samples carried over to the next step, their prompts have been consumed from the dataloader."""
+        rollout_samples = {"partial_samples": self.partial_samples, "finished_samples": self.finished_samples}
+        if any(samples is not None for samples in rollout_samples.values()):
+            torch.save(rollout_samples, os.path.join(folder_path, "rollout_samples.pt"))
+
+    def _load_rollout_samples(self, folder_path: str) -> None:
+        rollout_samples_path = os.path.join(folder_path, "rollout_samples.pt")
+        if os.path.exists(rollout_samples_path):
+            rollout_samples = torch.load(rollout_samples_path, weights_only=False)
+            self.partial_samples = rollout_samples["partial_samples"]
+            self.finished_samples = rollout_samples["finished_samples"]
+
     def _maybe_log_val_generations(
         self, inputs: List[str], outputs: List[str], labels: List[str], scores: List[float]
     ) -> None:
@@ -403,7 +457,8 @@ class RayPPOTrainer:
                 non_tensor_batch_keys=["raw_prompt_ids", "multi_modal_data"],
             )
             repeat_times = self.config.worker.rollout.val_override_config.get("n", 1)
-            test_gen_batch.meta_info = self.config.worker.rollout.val_override_config
+            # the rollouts sample config.n responses if n is not given
+            test_gen_batch.meta_info = {**self.config.worker.rollout.val_override_config, "n": repeat_times}
             test_gen_batch.meta_info["min_pixels"] = self.config.data.min_pixels
             test_gen_batch.meta_info["max_pixels"] = self.config.data.max_pixels
             test_gen_batch.meta_info["video_fps"] = self.config.data.video_fps
@@ -437,13 +492,17 @@ class RayPPOTrainer:
             for key, value in compute_length_metrics(test_batch).items():
                 length_metrics_lst[key].append(value)
 
-        self.actor_rollout_ref_wg.release_rollout_engine()
+        prefix_cache_stats = self.actor_rollout_ref_wg.release_rollout_engine()
         self._maybe_log_val_generations(sample_inputs, sample_outputs, sample_labels, sample_scores)
         self.val_reward_score = torch.cat(reward_tensor_lst, dim=0).sum(-1).mean().item()
         val_reward_metrics = {f"val/{key}_reward": value for key, value in reduce_metrics(reward_metrics_lst).items()}
         val_length_metrics = {f"val_{key}": value for key, value in reduce_metrics(length_metrics_lst).items()}
+        val_metrics = {"val/reward_score": self.val_reward_score, **val_reward_metrics, **val_length_metrics}
+        if self.config.worker.rollout.enable_prefix_caching:
+            val_metrics.update({f"val_{k}": v for k, v in compute_prefix_cache_metrics(prefix_cache_stats).items()})
+
         print("Finish validation.")
-        return {"val/reward_score": self.val_reward_score, **val_reward_metrics, **val_length_metrics}
+        return val_metrics
 
     def _balance_batch(self, batch: DataProto, metrics: Dict[str, Any], logging_prefix: str = "global_seqlen") -> None:
         """Reorder the data on single controller such that each dp rank gets similar total tokens"""
@@ -462,40 +521,154 @@ class RayPPOTrainer:
         )
         metrics.update(global_balance_stats)
 
+    def _prepare_batch_data(self, batch_dict: Dict[str, Any]) -> DataProto:
+        meta_info = {
+            "min_pixels": self.config.data.min_pixels,
+            "max_pixels": self.config.data.max_pixels,
+            "video_fps": self.config.data.video_fps,
+        }
+        batch = DataProto.from_single_dict(batch_dict, meta_info=meta_info)
+        batch.non_tensor_batch["uid"] = np.array([str(uuid.uuid4()) for _ in range(len(batch))], dtype=object)
+        return batch
+
+    def _add_partial_samples(self, batch: DataProto) -> DataProto:
+        """Expand the prompts into single samples, and prepend the unfinished samples of the last generation."""
+        batch = batch.repeat(repeat_times=self.config.worker.rollout.n, interleave=True)
+        partial_response_ids = np.empty(len(batch), dtype=object)
+        for idx in range(len(batch)):
+            partial_response_ids[idx] = np.zeros(0, dtype=np.int64)
+
+        batch.non_tensor_batch["partial_response_ids"] = partial_response_ids
+        batch.non_tensor_batch["rollout_age"] = np.zeros(len(batch), dtype=np.int64)
+        if self.partial_samples is not None:
+            batch = DataProto.concat([self.partial_samples, batch])
+            self.partial_samples = None
+
+        return batch
+
+    def _collect_finished_samples(
+        self, gen_batch: DataProto, batch: DataProto, gen_batch_output: DataProto, metrics: Dict[str, List[Any]]
+    ) -> DataProto:
+        """Carry the unfinished samples over to the next generation, and return the finished samples of the prompts
+        whose samples all finished. The other finished samples wait for their siblings, so each group is complete.
+        """
+        finished = gen_batch_output.non_tensor_batch.pop("finished")
+        finish_time = gen_batch_output.non_tensor_batch.pop("finish_time")
+        partial_response_ids = gen_batch_output.non_tensor_batch.pop("partial_response_ids")
+        metrics["rollout/tail_latency"].append(np.max(finish_time) - np.median(finish_time))
+        metrics["rollout/carried_over_samples"].append(np.sum(~finished))
+
+        unfinished_uids = set()
+        unfinished_indices = np.flatnonzero(~finished)
+        if len(unfinished_indices) != 0:
+            partial_samples = gen_batch[unfinished_indices].union(batch[unfinished_indices])
+            partial_samples.non_tensor_batch["partial_response_ids"] = partial_response_ids[unfinished_indices]
+            partial_samples.non_tensor_batch["rollout_age"] += 1
+            partial_samples.non_tensor_batch.pop("predicted_response_length", None)  # predicted again next time
+            partial_samples.meta_info.pop("n", None)
+            unfinished_uids = set(partial_samples.non_tensor_batch["uid"])
+            self.partial_samples = partial_samples
+
+        finished_indices = np.flatnonzero(finished)
+        finished_samples = batch[finished_indices].union(gen_batch_output[finished_indices])
+        if self.finished_samples is not None:
+            finished_samples = DataProto.concat([self.finished_samples, finished_samples])
+
+        is_waiting = np.array([uid in unfinished_uids for uid in finished_samples.non_tensor_batch["uid"]], dtype=bool)
+        self.finished_samples = finished_samples[np.flatnonzero(is_waiting)] if np.any(is_waiting) else None
+        finished_samples = finished_samples[np.flatnonzero(~is_waiting)]
+        # the samples of a group finish at different generations, keep them contiguous in the order of the groups
+        _, first_indices, group_indices = np.unique(
+            finished_samples.non_tensor_batch["uid"], return_index=True, return_inverse=True
+        )
+        finished_samples = finished_samples[np.argsort(first_indices[group_indices], kind="stable")]
+        rollout_age = finished_samples.non_tensor_batch.pop("rollout_age")
+        if len(rollout_age) != 0:
+            metrics["rollout/sample_age_mean"].append(np.mean(rollout_age))
+            metrics["rollout/sample_age_max"].append(np.max(rollout_age))
+
+        return finished_samples
+
+    def _sort_by_predicted_length(self, batch: DataProto, metrics: Dict[str, List[Any]]) -> None:
+        """Balance the predicted response lengths across the ranks, each rank submits the longest ones first."""
+        predicted_length = self.length_predictor.predict(batch.non_tensor_batch["dataset_index"])
+        batch.non_tensor_batch["predicted_response_length"] = predicted_length
+        world_size = self.actor_rollout_ref_wg.world_size
+        if self.length_predictor.is_fitted and len(batch) % world_size != 0:  # the partitions must be equal-sized
+            metrics["rollout/length_balancing_skipped"].append(1.0)
+            if not self.length_balancing_skip_logged:
+                print(f"Skip balancing the predicted lengths: {len(batch)=} is not divisible by {world_size=}.")
+                self.length_balancing_skip_logged = True
+        elif self.length_predictor.is_fitted:
+            metrics["rollout/length_balancing_skipped"].append(0.0)
+            partitions = get_seqlen_balanced_partitions(
+                np.ceil(predicted_length).astype(np.int64).tolist(), k_partitions=world_size, equal_size=True
+            )
+            batch.reorder(torch.tensor([idx for partition in partitions for idx in partition]))
+
+    def _update_length_predictor(self, batch: DataProto, metrics: Dict[str, List[Any]]) -> None:
+        dataset_index = batch.non_tensor_batch["dataset_index"]
+        response_length = batch.batch["response_mask"].sum(-1).float().numpy()
+        if self.length_predictor.is_fitted:
+            predicted_length = self.length_predictor.predict(dataset_index)
+            relative_error = np.abs(predicted_length - response_length) / np.maximum(response_length, 1.0)
+            metrics["rollout/length_prediction_error"].append(np.mean(relative_error))
+
+        self.length_predictor.update(dataset_index, response_length)
+
     def _make_batch_data(self, metrics: Dict[str, Any]) -> DataProto:
-        batch = None
+        rollout_batch_size = self.config.data.rollout_batch_size
+        batch_builder = DataProtoBuilder(max_size=rollout_batch_size * self.config.worker.rollout.n, group_key="uid")
         all_metrics = defaultdict(list)
+        rollout_metrics = defaultdict(list)
         num_try_make_batch = 0
+        stream_reward = self.config.worker.reward.stream_reward
         print("Start generating batch...")
+        data_wait_time = 0.0
         while True:
             num_try_make_batch += 1
-            try:
-                batch_dict = next(self.data_iterator)
-            except StopIteration:
-                self.data_iterator = iter(self.train_dataloader)
-                batch_dict = next(self.data_iterator)
-
-            meta_info = {
-                "min_pixels": self.config.data.min_pixels,
-                "max_pixels": self.config.data.max_pixels,
-                "video_fps": self.config.data.video_fps,
-            }
-            new_batch: DataProto = DataProto.from_single_dict(batch_dict, meta_info=meta_info)
+            start_time = time.perf_counter()
+            new_batch = self.data_prefetcher.get()
+            data_wait_time += time.perf_counter() - start_time
+            if self.partial_rollout:
+                new_batch = self._add_partial_samples(new_batch)
+
+            use_length_predictor = self.length_predictor is not None and "dataset_index" in new_batch.non_tensor_batch
+            if use_length_predictor:
+                self._sort_by_predicted_length(new_batch, rollout_metrics)
 
             # pop those keys for generation
             gen_batch = new_batch.pop(
                 batch_keys=["input_ids", "attention_mask", "position_ids"],
-                non_tensor_batch_keys=["raw_prompt_ids", "multi_modal_data"],
+                non_tensor_batch_keys=[
+                    "raw_prompt_ids",
+                    "multi_modal_data",
+                    "partial_response_ids",
+                    "predicted_response_length",
+                ],
                 meta_info_keys=["min_pixels", "max_pixels", "video_fps"],
             )
+            if stream_reward:  # the rollout workers need these keys to score the finished responses
+                gen_batch.non_tensor_batch["uid"] = new_batch.non_tensor_batch["uid"]
+                gen_batch.non_tensor_batch["ground_truth"] = new_batch.non_tensor_batch["ground_truth"]
+                gen_batch.meta_info["stream_reward"] = True
+                ray.get(self.reward_fn.clear_stream_reward.remote())  # the scores of a failed step are never collected
 
             # generate a batch
-            gen_batch_output = self.actor_rollout_ref_wg.generate_sequences(gen_batch)
+            if self.partial_rollout:  # each sample is a single request, the carried over samples break the alignment
+                gen_batch.meta_info["n"] = 1
+                gen_batch, pad_size = pad_dataproto_to_divisor(gen_batch, self.actor_rollout_ref_wg.world_size)
+                gen_batch_output = self.actor_rollout_ref_wg.generate_sequences(gen_batch)
+                gen_batch = unpad_dataproto(gen_batch, pad_size=pad_size)
+                gen_batch_output = unpad_dataproto(gen_batch_output, pad_size=pad_size)
+            else:
+                gen_batch_output = self.actor_rollout_ref_wg.generate_sequences(gen_batch)
 
             if self.config.algorithm.adv_estimator == "remax":
-                gen_baseline_batch = deepcopy(gen_batch)
+                gen_baseline_batch = gen_batch.copy()
                 gen_baseline_batch.meta_info["temperature"] = 0
                 gen_baseline_batch.meta_info["n"] = 1
+                gen_baseline_batch.meta_info["stream_reward"] = False
                 gen_baseline_output = self.actor_rollout_ref_wg.generate_sequences(gen_baseline_batch)
 
                 new_batch = new_batch.union(gen_baseline_output)
@@ -506,41 +679,32 @@ class RayPPOTrainer:
                 new_batch.batch["reward_baselines"] = reward_baseline_tensor
                 del gen_baseline_batch, gen_baseline_output
 
-            new_batch.non_tensor_batch["uid"] = np.array(
-                [str(uuid.uuid4()) for _ in range(len(new_batch.batch))], dtype=object
-            )
-            # repeat to align with repeated responses in rollout
-            new_batch = new_batch.repeat(repeat_times=self.config.worker.rollout.n, interleave=True)
-            new_batch = new_batch.union(gen_batch_output)
-
-            # filter group
-            if self.config.algorithm.online_filtering:
-                reward_tensor, reward_metrics = ray.get(self.reward_fn.compute_reward.remote(new_batch))
-                # new_batch.batch["token_level_scores"] = reward_tensor
-                
-                import copy
-
-                # 1. 显式地克隆这个锁定的 TensorDict。
-                #    .clone() 是一个只读操作，这一定会成功。
-                #    (recurse=False 表示浅克隆，通常足够且更快)
-                unlocked_batch_clone = new_batch.batch.clone(recurse=False)
-
-                # 2. 现在 unlocked_batch_clone 是一个全新的、未锁定的对象。
-                #    我们可以安全地用标准方式给它添加新键。
-                unlocked_batch_clone["token_level_scores"] = reward_tensor
+            if self.partial_rollout:
+                new_batch = self._collect_finished_samples(gen_batch, new_batch, gen_batch_output, rollout_metrics)
+                if len(new_batch) == 0:
+                    print("No prompt has finished all its samples. Continue generating...")
+                    continue
+            else:
+                # repeat to align with repeated responses in rollout
+                new_batch = new_batch.repeat(repeat_times=self.config.worker.rollout.n, interleave=True)
+                new_batch = new_batch.union(gen_batch_output)
 
-                # 3. 和之前的方案一样，创建一个 DataProto 父对象的副本。
-                new_batch_proto_copy = copy.copy(new_batch)
+            if use_length_predictor:
+                self._update_length_predictor(new_batch, rollout_metrics)
 
-                # 4. 将父副本的 .batch 属性指向我们新创建的、已更新的克隆体。
-                new_batch_proto_copy.batch = unlocked_batch_clone
+            if stream_reward or self.config.algorithm.online_filtering:
+                if stream_reward:  # the responses have been scored during generation
+                    reward_tensor, reward_metrics = ray.get(self.reward_fn.collect_stream_reward.remote(new_batch))
+                else:
+                    reward_tensor, reward_metrics = ray.get(self.reward_fn.compute_reward.remote(new_batch))
 
-                # 5. 将 new_batch 变量指向这个最终的、全新的对象。
-                new_batch = new_batch_proto_copy
-                
+                new_batch = new_batch.copy()  # the batch of the rollout output cannot be modified in place
+                new_batch.batch["token_level_scores"] = reward_tensor
                 for k, v in reward_metrics.items():
                     all_metrics[k].extend(v)
 
+            # filter group
+            if self.config.algorithm.online_filtering:
                 filter_scores = reward_metrics[self.config.algorithm.filter_key]
                 uids = new_batch.non_tensor_batch["uid"]
                 uid2scores = defaultdict(list)
@@ -556,9 +720,8 @@ class RayPPOTrainer:
                 kept_sample_idxs = [idx for idx, uid in enumerate(uids) if uid in kept_uids]
                 new_batch = new_batch[kept_sample_idxs]
 
-            batch = DataProto.concat([batch, new_batch]) if batch is not None else new_batch
-            current_batch_size = len(batch) // self.config.worker.rollout.n
-            rollout_batch_size = self.config.data.rollout_batch_size
+            batch_builder.append(new_batch)
+            current_batch_size = len(batch_builder) // self.config.worker.rollout.n
             if current_batch_size < rollout_batch_size:
                 print(f"{current_batch_size=} < {rollout_batch_size=}")
                 max_try_make_batch = self.config.trainer.max_try_make_batch
@@ -570,10 +733,13 @@ class RayPPOTrainer:
                     )
             else:
                 print(f"{current_batch_size=} >= {rollout_batch_size=}. Finish generating.")
-                if self.config.algorithm.online_filtering:
+                metrics["perf/time_wait_data"] = data_wait_time
+                metrics.update(self.data_prefetcher.get_metrics())
+                metrics.update(reduce_metrics(rollout_metrics))
+                if stream_reward or self.config.algorithm.online_filtering:
                     metrics.update({f"reward/{k}": v for k, v in reduce_metrics(all_metrics).items()})
 
-                return batch[: self.config.data.rollout_batch_size * self.config.worker.rollout.n]
+                return batch_builder.build()
 
     def fit(self):
         """
@@ -598,7 +764,9 @@ class RayPPOTrainer:
             if self.config.trainer.val_only:
                 return
 
-        self.data_iterator = iter(self.train_dataloader)
+        self.data_prefetcher = DataPrefetcher(
+            self.train_dataloader, self._prepare_batch_data, self.config.data.num_prefetch_batches
+        )
         while self.global_step < self.training_steps:
             self.global_step += 1
 
@@ -606,9 +774,12 @@ class RayPPOTrainer:
             with timer("step", timing_raw):
                 # make a batch of data
                 with timer("gen", timing_raw):
-                    self.actor_rollout_ref_wg.prepare_rollout_engine()
+                    sync_metrics = self.actor_rollout_ref_wg.prepare_rollout_engine()
+                    metrics.update(sync_metrics[0])
                     batch = self._make_batch_data(metrics=metrics)
-                    self.actor_rollout_ref_wg.release_rollout_engine()
+                    prefix_cache_stats = self.actor_rollout_ref_wg.release_rollout_engine()
+                    if self.config.worker.rollout.enable_prefix_caching:
+                        metrics.update(compute_prefix_cache_metrics(prefix_cache_stats))
 
                 # balance the number of valid tokens on each dp rank.
                 # NOTE: this breaks the order of data inside the batch.
@@ -631,8 +802,8 @@ class RayPPOTrainer:
                 if self.config.algorithm.use_vppo_on_perception:
                     # compute log_probs with augmented images
                     with timer("aug", timing_raw):
-                        aug_batch = deepcopy(batch)
-                        aug_log_probs = self.actor_rollout_ref_wg.compute_aug_log_probs(aug_batch)
+                        # the workers receive their own copy of the batch, no need to copy it on the driver
+                        aug_log_probs = self.actor_rollout_ref_wg.compute_aug_log_probs(batch)
                         batch = batch.union(aug_log_probs)
 
                 # compute ref_log_probs
@@ -28,6 +28,8 @@ from filelock import FileLock
 from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 from transformers import PreTrainedTokenizer, ProcessorMixin
 
+from ..device import is_cuda_available
+
 
 CHECKPOINT_TRACKER = "checkpoint_tracker.json"
 
@@ -94,16 +96,20 @@ class BaseCheckpointManager(ABC):
     def get_rng_state() -> Dict[str, Any]:
         rng_state = {
             "cpu": torch.get_rng_state(),
-            "cuda": torch.cuda.get_rng_state(),
             "numpy": np.random.get_state(),
             "random": random.getstate(),
         }
+        if is_cuda_available():
+            rng_state["cuda"] = torch.cuda.get_rng_state()
+
         return rng_state
 
     @staticmethod
     def load_rng_state(rng_state: Dict[str, Any]):
         torch.set_rng_state(rng_state["cpu"])
-        torch.cuda.set_rng_state(rng_state["cuda"])
+        if is_cuda_available() and "cuda" in rng_state:
+            torch.cuda.set_rng_state(rng_state["cuda"])
+
         np.random.set_state(rng_state["numpy"])
         random.setstate(rng_state["random"])
 
@@ -12,24 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import dataclasses
+import hashlib
+import json
 import math
 import os
+import shutil
+import time
 from collections import defaultdict
+from functools import cached_property, lru_cache
 from io import BytesIO
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
+import pyarrow.compute as pc
 import torch
-from datasets import load_dataset
+from datasets import Image as ImageFeature
+from datasets import load_dataset, load_from_disk
 from jinja2 import Template
 from PIL import Image
 from PIL.Image import Image as ImageObject
 from qwen_vl_utils.vision_process import fetch_video
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, Sampler
 from transformers import PreTrainedTokenizer, ProcessorMixin
+from transformers.models.qwen2_vl.image_processing_qwen2_vl import smart_resize
 
 from ..models.transformers.qwen2_vl import get_rope_index
-from . import torch_functional as VF
+
+
+# bump it when the layout of the preprocessed examples changes, so that the old caches are not loaded
+PREPROCESSED_CACHE_VERSION = 2
+PREPROCESSED_COLUMNS = ("input_ids", "position_ids", "raw_prompt_ids", "ground_truth", "num_images")
+RESIZE_REDUCING_GAP = 3.0
 
 
 def collate_fn(features: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -46,38 +60,110 @@ def collate_fn(features: List[Dict[str, Any]]) -> Dict[str, Any]:
         tensors[key] = torch.stack(value, dim=0)
 
     for key, value in non_tensors.items():
-        non_tensors[key] = np.array(value, dtype=object)
+        non_tensors[key] = np.empty(len(value), dtype=object)
+        for idx, item in enumerate(value):  # avoid stacking equal-length prompt ids
+            non_tensors[key][idx] = item
 
     return {**tensors, **non_tensors}
 
 
+@lru_cache(maxsize=None)
+def _compile_template(source: str) -> Template:
+    return Template(source)
+
+
+def _get_resized_size(
+    width: int, height: int, min_pixels: Optional[int], max_pixels: Optional[int]
+) -> Tuple[int, int]:
+    if max_pixels is not None and (width * height) > max_pixels:
+        resize_factor = math.sqrt(max_pixels / (width * height))
+        width, height = int(width * resize_factor), int(height * resize_factor)
+
+    if min_pixels is not None and (width * height) < min_pixels:
+        resize_factor = math.sqrt(min_pixels / (width * height))
+        width, height = int(width * resize_factor), int(height * resize_factor)
+
+    return width, height
+
+
+def _get_image_file(image: Union[Dict[str, Any], bytes, str]) -> Union[BytesIO, str]:
+    if isinstance(image, dict):  # the undecoded images only keep the path if the bytes are not embedded
+        image = image["bytes"] if image.get("bytes") is not None else image["path"]
+
+    return BytesIO(image) if isinstance(image, bytes) else image
+
+
+def _disable_image_decoding(feature: Any) -> Any:
+    """Returns a copy of the dataset feature in which the images are kept as bytes or paths."""
+    if isinstance(feature, ImageFeature):
+        return ImageFeature(decode=False)
+    elif isinstance(feature, dict):
+        return {key: _disable_image_decoding(value) for key, value in feature.items()}
+    elif isinstance(feature, list):
+        return [_disable_image_decoding(value) for value in feature]
+    elif hasattr(feature, "feature"):  # sequence of features
+        return dataclasses.replace(feature, feature=_disable_image_decoding(feature.feature))
+
+    return feature
+
+
 def process_image(
-    image: Union[Dict[str, Any], ImageObject, str], min_pixels: Optional[int], max_pixels: Optional[int]
-) -> ImageObject:
-    if isinstance(image, str):
-        image = Image.open(image)
-    elif isinstance(image, dict):
-        image = Image.open(BytesIO(image["bytes"]))
-    elif isinstance(image, bytes):
-        image = Image.open(BytesIO(image))
+    image: Union[Dict[str, Any], ImageObject, str],
+    min_pixels: Optional[int],
+    max_pixels: Optional[int],
+    return_numpy: bool = False,
+) -> Union[ImageObject, np.ndarray]:
+    """Resizes the image into the pixel range, returns a uint8 HWC array instead of a PIL image if `return_numpy`."""
+    if not isinstance(image, ImageObject):
+        image = Image.open(_get_image_file(image))
+
+    width, height = _get_resized_size(image.width, image.height, min_pixels, max_pixels)
+    if width < image.width and height < image.height:
+        # let the jpeg decoder downscale in the dct domain, a no-op for other formats or small reductions
+        image.draft(None, (width, height))
 
     image.load()  # avoid "Too many open files" errors
-    if max_pixels is not None and (image.width * image.height) > max_pixels:
-        resize_factor = math.sqrt(max_pixels / (image.width * image.height))
-        width, height = int(image.width * resize_factor), int(image.height * resize_factor)
-        image = image.resize((width, height))
-
-    if min_pixels is not None and (image.width * image.height) < min_pixels:
-        resize_factor = math.sqrt(min_pixels / (image.width * image.height))
-        width, height = int(image.width * resize_factor), int(image.height * resize_factor)
-        image = image.resize((width, height))
+    if (width, height) != image.size:
+        # box-reduce by an integer factor before resampling, so the filter runs over at most 3x the target size
+        image = image.resize((width, height), reducing_gap=RESIZE_REDUCING_GAP)
 
     if image.mode != "RGB":
         image = image.convert("RGB")
 
+    if return_numpy:  # the image processors convert the images to arrays anyway
+        return np.asarray(image)
+
     return image
 
 
+def get_image_size(
+    image: Union[Dict[str, Any], ImageObject, str], min_pixels: Optional[int], max_pixels: Optional[int]
+) -> Tuple[int, int]:
+    """Gets the (width, height) of the image after `process_image`, only the image header is read."""
+    if isinstance(image, ImageObject):
+        size = image.size
+    else:
+        with Image.open(_get_image_file(image)) as image_file:
+            size = image_file.size
+
+    return _get_resized_size(*size, min_pixels, max_pixels)
+
+
+def _encode_image(image: Union[Dict[str, Any], ImageObject, str]) -> Dict[str, bytes]:
+    """Encodes the original image without resizing it, `process_image` resizes it when it is used."""
+    if not isinstance(image, ImageObject):
+        image_file = _get_image_file(image)
+        if isinstance(image_file, BytesIO):
+            return {"bytes": image_file.getvalue()}
+
+        with open(image_file, "rb") as f:
+            return {"bytes": f.read()}
+
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")  # lossless
+    return {"bytes": buffer.getvalue()}
+
+
 def process_video(
     video: str, min_pixels: Optional[int], max_pixels: Optional[int], video_fps: float, return_fps: bool = False
 ) -> Union[List[ImageObject], Tuple[List[ImageObject], List[float]]]:
@@ -90,6 +176,8 @@ class RLHFDataset(Dataset):
     We assume the dataset contains a column that contains prompts and other information
     """
 
+    streaming = False
+
     def __init__(
         self,
         data_path: str,
@@ -108,6 +196,7 @@ class RLHFDataset(Dataset):
         max_pixels: Optional[int] = None,
         filter_overlong_prompts: bool = True,
         filter_overlong_prompts_workers: int = 16,
+        cache_dir: Optional[str] = None,
     ):
         self.tokenizer = tokenizer
         self.processor = processor
@@ -121,6 +210,7 @@ class RLHFDataset(Dataset):
         self.truncation = truncation
         self.min_pixels = min_pixels
         self.max_pixels = max_pixels
+        self.load_time = 0.0  # the time spent on loading the samples, each dataloader worker has its own copy
 
         if "@" in data_path:
             data_path, data_split = data_path.split("@")
@@ -136,24 +226,192 @@ class RLHFDataset(Dataset):
         #     self.dataset = load_dataset(file_type, data_files=data_path, split=data_split)
         # else:
         # load remote dataset from huggingface hub
-        self.dataset = load_dataset(data_path, split=data_split)
+        self.dataset = load_dataset(data_path, split=data_split, streaming=self.streaming)
 
         self.format_prompt = None
         if format_prompt:
             with open(format_prompt, encoding="utf-8") as f:
                 self.format_prompt = f.read()
 
+        self.chat_template_pieces = self._split_chat_template()
+
+        self.preprocessed = False
+        self.length_info: Optional[Dict[str, List[int]]] = None  # the prompt lengths and the numbers of images
+        if self.streaming:  # the examples are filtered lazily while streaming
+            if filter_overlong_prompts:
+                self.dataset = self.dataset.filter(self._filter_overlong_prompts)
+
+            return
+
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, self._fingerprint(filter_overlong_prompts))
+            if os.path.isdir(cache_path):
+                print(f"Loading preprocessed dataset from {cache_path}.")
+                self._load_preprocessed(cache_path)
+                return
+
         if filter_overlong_prompts:
-            self.dataset = self.dataset.filter(
-                self._filter_overlong_prompts,
-                desc="Filtering overlong prompts",
-                num_proc=filter_overlong_prompts_workers,
+            # the lengths are kept for the length-grouped sampler
+            self.length_info = self._compute_length_info(filter_overlong_prompts_workers)
+            indices = [
+                idx
+                for idx, prompt_length in enumerate(self.length_info["prompt_length"])
+                if prompt_length <= self.max_prompt_length
+            ]
+            self.dataset = self.dataset.select(indices)
+            self.length_info = {key: [value[idx] for idx in indices] for key, value in self.length_info.items()}
+
+        if cache_dir is not None:
+            # run the full preprocessing once, later runs slice the memory-mapped arrow files
+            self._save_preprocessed(cache_path, filter_overlong_prompts_workers)
+            self._load_preprocessed(cache_path)
+
+    def _fingerprint(self, filter_overlong_prompts: bool) -> str:
+        """Hash everything that affects the preprocessed examples."""
+        tokenizer = self.processor if self.processor is not None else self.tokenizer
+        state = {
+            "cache_version": PREPROCESSED_CACHE_VERSION,
+            "columns": PREPROCESSED_COLUMNS,
+            "dataset": self.dataset._fingerprint,
+            "tokenizer": tokenizer.__class__.__name__,
+            "name_or_path": self.tokenizer.name_or_path,
+            "chat_template": tokenizer.chat_template,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "keys": [self.prompt_key, self.answer_key, self.image_key, self.video_key],
+            "image_dir": self.image_dir,
+            "video_fps": self.video_fps,
+            "max_prompt_length": self.max_prompt_length,
+            "truncation": self.truncation,
+            "format_prompt": self.format_prompt,
+            "min_pixels": self.min_pixels,
+            "max_pixels": self.max_pixels,
+            "filter_overlong_prompts": filter_overlong_prompts,
+        }
+        for name in ("image_processor", "video_processor"):  # the pixel bounds, patch and merge sizes
+            sub_processor = getattr(self.processor, name, None)
+            state[name] = sub_processor.to_json_string() if sub_processor is not None else None
+
+        return hashlib.md5(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    def _save_preprocessed(self, cache_path: str, num_workers: int) -> None:
+        # an interrupted run leaves only the temporary directory, which is never loaded
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        self.dataset.map(
+            self._preprocess_example,
+            remove_columns=self.dataset.column_names,
+            desc="Preprocessing dataset",
+            num_proc=num_workers,
+        ).save_to_disk(tmp_path)
+        try:
+            os.rename(tmp_path, cache_path)
+            print(f"Saved preprocessed dataset to {cache_path}.")
+        except OSError:  # another process has saved the same dataset
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _load_preprocessed(self, cache_path: str) -> None:
+        dataset = load_from_disk(cache_path, keep_in_memory=False)
+        missing_columns = [column for column in PREPROCESSED_COLUMNS if column not in dataset.column_names]
+        if len(missing_columns) != 0 or "attention_mask" in dataset.column_names:  # padded by an old version
+            raise ValueError(
+                f"Preprocessed dataset {cache_path} has columns {dataset.column_names}, expected {PREPROCESSED_COLUMNS}. "
+                "Please remove it to preprocess the dataset again."
             )
 
+        # the lengths are read from the offsets of the memory-mapped arrays
+        prompt_lengths = pc.list_value_length(dataset.data.column("input_ids")).to_pylist()
+        self.length_info = {
+            "prompt_length": [min(prompt_length, self.max_prompt_length) for prompt_length in prompt_lengths],
+            "num_images": dataset.data.column("num_images").to_pylist(),
+        }
+        self.dataset = dataset.remove_columns("num_images").with_format(
+            "torch", columns=["input_ids", "position_ids"], output_all_columns=True
+        )
+        self.preprocessed = True
+
+    def _preprocess_example(self, example: Dict[str, Any]) -> Dict[str, Any]:
+        num_images = len(example[self.image_key]) if self.image_key in example else 0
+        example = self._process_example(example, encode_images=True)
+        example["num_images"] = num_images
+        example["input_ids"] = example["input_ids"].numpy()
+        example["position_ids"] = example["position_ids"].numpy()
+        return example
+
+    def _render_chat_template(self, content: Union[str, List[Dict[str, Any]]]) -> str:
+        return self._render_messages([{"role": "user", "content": content}])
+
+    def _render_messages(self, messages: List[Dict[str, Any]]) -> str:
+        # the text prompts use the chat template of the tokenizer, the multi-modal prompts use that of the processor
+        is_text = all(isinstance(message["content"], str) for message in messages)
+        tokenizer = self.tokenizer if is_text else self.processor
+        return tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+
+    def _split_chat_template(self) -> Dict[str, Tuple[str, ...]]:
+        """
+        Renders the chat template once with markers and splits it into static pieces, so that the prompts are built
+        by string concatenation. The content types whose contents are not placed verbatim are left out.
+        """
+        markers = ["\x000\x00", " \x001\x00 "]  # the outer spaces catch templates that strip the contents
+        probes = {"text": [markers[1]]}
+        if self.processor is not None:
+            for vision_type in ("image", "video"):
+                probes[vision_type] = [
+                    [{"type": "text", "text": markers[1]}],
+                    [{"type": vision_type}, {"type": "text", "text": markers[1]}, {"type": vision_type}],
+                ]
+
+        pieces = {}
+        for content_type, contents in probes.items():
+            try:
+                if content_type == "text":
+                    prefix, suffix = self._render_chat_template(markers[0]).split(markers[0])
+                    pieces[content_type] = (prefix, suffix)
+                else:
+                    content = [
+                        {"type": "text", "text": markers[0]},
+                        {"type": content_type},
+                        {"type": "text", "text": markers[1]},
+                    ]
+                    prefix, rest = self._render_chat_template(content).split(markers[0])
+                    vision_piece, suffix = rest.split(markers[1])
+                    pieces[content_type] = (prefix, vision_piece, suffix)
+
+                for content in contents:  # check the pieces against the template with other contents
+                    if self._join_chat_template(pieces[content_type], content) != self._render_chat_template(content):
+                        pieces.pop(content_type)
+                        break
+            except Exception:  # the template cannot be rendered or split with the markers
+                pieces.pop(content_type, None)
+
+        return pieces
+
+    @staticmethod
+    def _join_chat_template(pieces: Tuple[str, ...], content: Union[str, List[Dict[str, Any]]]) -> str:
+        if isinstance(content, str):
+            prefix, suffix = pieces
+            return prefix + content + suffix
+
+        prefix, vision_piece, suffix = pieces
+        return prefix + "".join(item["text"] if item["type"] == "text" else vision_piece for item in content) + suffix
+
+    def _apply_chat_template(self, messages: List[Dict[str, Any]]) -> str:
+        if len(messages) != 1 or messages[0]["role"] != "user":  # the pieces are split from a single user turn
+            return self._render_messages(messages)
+
+        content = messages[0]["content"]
+        if isinstance(content, str):
+            content_type = "text"
+        else:
+            content_type = next((item["type"] for item in content if item["type"] != "text"), "image")
+
+        if content_type in self.chat_template_pieces:
+            return self._join_chat_template(self.chat_template_pieces[content_type], content)
+
+        return self._render_chat_template(content)
+
     def _build_messages(self, example: Dict[str, Any]) -> List[Dict[str, Any]]:
         prompt_str: str = example[self.prompt_key]
         if self.format_prompt:
-            format_prompt = Template(self.format_prompt.strip())
+            format_prompt = _compile_template(self.format_prompt.strip())
             prompt_str = format_prompt.render(content=prompt_str)
 
         if self.image_key in example:
@@ -180,22 +438,54 @@ class RLHFDataset(Dataset):
         else:
             return [{"role": "user", "content": prompt_str}]
 
-    def _filter_overlong_prompts(self, example: Dict[str, Any]) -> bool:
+    def _estimate_image_prompt_length(self, prompt: str, images: List[Any]) -> int:
+        """Counts the prompt tokens as the qwen2vl processor does, using only the image sizes."""
+        image_processor = self.processor.image_processor
+        patch_size, merge_size = image_processor.patch_size, image_processor.merge_size
+        prompt_length = len(self.tokenizer.encode(prompt, add_special_tokens=False))
+        for image in images:
+            width, height = get_image_size(image, self.min_pixels, self.max_pixels)
+            resized_height, resized_width = smart_resize(
+                height,
+                width,
+                factor=patch_size * merge_size,
+                min_pixels=image_processor.size["shortest_edge"],
+                max_pixels=image_processor.size["longest_edge"],
+            )
+            # the processor expands each image token into one token per merged patch
+            num_image_tokens = (resized_height // patch_size) * (resized_width // patch_size) // (merge_size**2)
+            prompt_length += num_image_tokens - 1
+
+        return prompt_length
+
+    def _get_image_prompt_length(self, prompt: str, images: List[Any]) -> int:
+        processed_images = [] if len(images) != 0 else None  # text-only data
+        for image in images:
+            processed_images.append(process_image(image, self.min_pixels, self.max_pixels, return_numpy=True))
+
+        model_inputs = self.processor(
+            processed_images,
+            [prompt],
+            add_special_tokens=False,
+            return_tensors="pt",
+            input_data_format="channels_last",
+        )
+        return model_inputs["input_ids"].size(-1)
+
+    def _get_prompt_length(self, example: Dict[str, Any]) -> int:
         messages = self._build_messages(example)
         if self.image_key in example:
-            prompt = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            prompt = self._apply_chat_template(messages)
             images = example[self.image_key]
             if self.image_dir is not None and len(images) != 0 and isinstance(images[0], str):  # image paths
                 images = [os.path.join(self.image_dir, image) for image in images]
 
-            processed_images = [] if len(images) != 0 else None  # text-only data
-            for image in images:
-                processed_images.append(process_image(image, self.min_pixels, self.max_pixels))
+            if "Qwen2VLImageProcessor" in self.processor.image_processor.__class__.__name__:
+                return self._estimate_image_prompt_length(prompt, images)
 
-            model_inputs = self.processor(processed_images, [prompt], add_special_tokens=False, return_tensors="pt")
-            return model_inputs["input_ids"].size(-1) <= self.max_prompt_length
+            return self._get_image_prompt_length(prompt, images)
         elif self.video_key in example:
-            prompt = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            prompt = self._apply_chat_template(messages)
             videos = example[self.video_key]
             if self.image_dir is not None and len(videos) != 0 and isinstance(videos[0], str):  # video paths
                 videos = [os.path.join(self.image_dir, video) for video in videos]
@@ -207,35 +497,141 @@ class RLHFDataset(Dataset):
             model_inputs = self.processor(
                 videos=processed_videos, text=[prompt], add_special_tokens=False, return_tensors="pt"
             )
-            return model_inputs["input_ids"].size(-1) <= self.max_prompt_length
+            return model_inputs["input_ids"].size(-1)
         else:
-            input_ids = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
-            return len(input_ids) <= self.max_prompt_length
+            prompt = self._apply_chat_template(messages)
+            return len(self.tokenizer.encode(prompt, add_special_tokens=False))
+
+    def _filter_overlong_prompts(self, example: Dict[str, Any]) -> bool:
+        return self._get_prompt_length(example) <= self.max_prompt_length
+
+    def _get_length_info(self, example: Dict[str, Any]) -> Dict[str, int]:
+        num_images = len(example[self.image_key]) if self.image_key in example else 0
+        return {"prompt_length": self._get_prompt_length(example), "num_images": num_images}
+
+    def _compute_length_info(self, num_workers: int) -> Dict[str, List[int]]:
+        # the prompt lengths only need the image headers, so the images are not decoded
+        image_feature = self.dataset.features.get(self.image_key)
+        dataset = self.dataset
+        if image_feature is not None:
+            dataset = dataset.cast_column(self.image_key, _disable_image_decoding(image_feature))
+
+        length_info = dataset.map(
+            self._get_length_info,
+            remove_columns=dataset.column_names,
+            desc="Estimating prompt lengths",
+            num_proc=num_workers,
+        )
+        return {"prompt_length": list(length_info["prompt_length"]), "num_images": list(length_info["num_images"])}
+
+    def get_length_info(self, num_workers: int = 16) -> Tuple[List[int], List[int]]:
+        """Gets the estimated prompt length and the number of images of each example."""
+        if self.length_info is None:  # computed when filtering or loading the preprocessed dataset
+            self.length_info = self._compute_length_info(num_workers)
+
+        return self.length_info["prompt_length"], self.length_info["num_images"]
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, index):
+        start_time = time.perf_counter()
         example: dict = self.dataset[index]
+        if not self.preprocessed:
+            example = self._process_example(example)
+
+        example["dataset_index"] = index  # a stable key of the prompt across epochs
+        self.load_time += time.perf_counter() - start_time
+        return example
+
+    def pop_load_time(self) -> float:
+        """Gets the time spent on loading the samples since the last call, and resets it."""
+        load_time, self.load_time = self.load_time, 0.0
+        return load_time
+
+    @cached_property
+    def vision_token_ids(self) -> torch.Tensor:
+        """The ids of the vision placeholder tokens, computed once in each dataloader worker."""
+        return torch.tensor(self.tokenizer.convert_tokens_to_ids(["<|image_pad|>", "<|video_pad|>"]))
+
+    def _get_raw_prompt_ids(self, input_ids: torch.Tensor, prompt: str) -> List[int]:
+        """Gets the prompt ids for vllm, in which each image or video is a single placeholder token."""
+        if self.processor is None:
+            return input_ids.tolist()
+
+        if "Qwen2VLImageProcessor" not in self.processor.image_processor.__class__.__name__:
+            return self.tokenizer.encode(prompt, add_special_tokens=False)
+
+        # the processor repeats each placeholder token by the number of vision tokens
+        is_repeated = torch.zeros_like(input_ids, dtype=torch.bool)
+        is_repeated[1:] = torch.isin(input_ids[1:], self.vision_token_ids) & (input_ids[1:] == input_ids[:-1])
+        return input_ids[~is_repeated].tolist()
+
+    def collate_fn(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Left-pads the unpadded int32 ids of the examples to the max prompt length, then collates the examples."""
+        # the padded tensors are allocated once for the batch, the ids are cast to int64 while copied into them
+        batch_size, max_length = len(features), self.max_prompt_length
+        position_shape = features[0]["position_ids"].shape[:-1]  # (3,) for qwen2vl mrope
+        input_ids = torch.full((batch_size, max_length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, max_length), dtype=torch.long)
+        position_ids = torch.zeros((batch_size, *position_shape, max_length), dtype=torch.long)
+        for idx, feature in enumerate(features):
+            feature_input_ids, feature_position_ids = feature["input_ids"], feature["position_ids"]
+            seq_length = feature_input_ids.size(-1)
+            if seq_length > max_length:
+                if self.truncation == "left":  # actually, left truncation may not be reasonable
+                    feature_input_ids = feature_input_ids[..., -max_length:]
+                    feature_position_ids = feature_position_ids[..., -max_length:]
+                elif self.truncation == "right":
+                    feature_input_ids = feature_input_ids[..., :max_length]
+                    feature_position_ids = feature_position_ids[..., :max_length]
+                else:
+                    raise RuntimeError(f"Input sequence length {seq_length} is longer than max length {max_length}.")
+
+                seq_length = max_length
+
+            input_ids[idx, max_length - seq_length :] = feature_input_ids
+            attention_mask[idx, max_length - seq_length :] = 1
+            position_ids[idx, ..., max_length - seq_length :] = feature_position_ids
+
+        batch = collate_fn(
+            [{k: v for k, v in feature.items() if k not in ("input_ids", "position_ids")} for feature in features]
+        )
+        batch["input_ids"] = input_ids
+        batch["attention_mask"] = attention_mask
+        batch["position_ids"] = position_ids
+        return batch
+
+    def _process_example(self, example: Dict[str, Any], encode_images: bool = False) -> Dict[str, Any]:
         messages = self._build_messages(example)
         example.pop(self.prompt_key, None)
 
         if self.image_key in example:
-            prompt = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            prompt = self._apply_chat_template(messages)
             images = example.pop(self.image_key)
             if self.image_dir is not None and len(images) != 0 and isinstance(images[0], str):  # image paths
                 images = [os.path.join(self.image_dir, image) for image in images]
 
             processed_images = [] if len(images) != 0 else None  # text-only data
             for image in images:
-                processed_images.append(process_image(image, self.min_pixels, self.max_pixels))
+                processed_images.append(process_image(image, self.min_pixels, self.max_pixels, return_numpy=True))
 
-            model_inputs = self.processor(processed_images, [prompt], add_special_tokens=False, return_tensors="pt")
+            model_inputs = self.processor(
+                processed_images,
+                [prompt],
+                add_special_tokens=False,
+                return_tensors="pt",
+                input_data_format="channels_last",
+            )
             input_ids = model_inputs.pop("input_ids")[0]
             attention_mask = model_inputs.pop("attention_mask")[0]
+            # store the original images, the consumers resize them in the same way as the uncached ones
+            if encode_images:
+                images = [_encode_image(image) for image in images]
+
             example["multi_modal_data"] = {"images": images}
         elif self.video_key in example:
-            prompt = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            prompt = self._apply_chat_template(messages)
             videos = example.pop(self.video_key)
             if self.image_dir is not None and len(videos) != 0 and isinstance(videos[0], str):  # video paths
                 videos = [os.path.join(self.image_dir, video) for video in videos]
@@ -259,7 +655,7 @@ class RLHFDataset(Dataset):
             attention_mask = model_inputs.pop("attention_mask")[0]
             example["multi_modal_data"] = {"videos": videos}
         else:
-            prompt = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            prompt = self._apply_chat_template(messages)
             model_inputs = self.tokenizer([prompt], add_special_tokens=False, return_tensors="pt")
             input_ids = model_inputs.pop("input_ids")[0]
             attention_mask = model_inputs.pop("attention_mask")[0]
@@ -277,16 +673,7 @@ class RLHFDataset(Dataset):
         else:
             position_ids = torch.clip(attention_mask.cumsum(dim=0) - 1, min=0, max=None)  # (seq_length,)
 
-        input_ids, attention_mask, position_ids = VF.postprocess_data(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-            max_length=self.max_prompt_length,
-            pad_token_id=self.tokenizer.pad_token_id,
-            left_pad=True,
-            truncation=self.truncation,
-        )
-        raw_prompt_ids = self.tokenizer.encode(prompt, add_special_tokens=False)
+        raw_prompt_ids = self._get_raw_prompt_ids(input_ids, prompt)
         if len(raw_prompt_ids) > self.max_prompt_length:
             if self.truncation == "left":
                 raw_prompt_ids = raw_prompt_ids[-self.max_prompt_length :]
@@ -295,9 +682,110 @@ class RLHFDataset(Dataset):
             elif self.truncation == "error":
                 raise RuntimeError(f"Prompt length {len(raw_prompt_ids)} is longer than {self.max_prompt_length}.")
 
-        example["input_ids"] = input_ids
-        example["attention_mask"] = attention_mask
-        example["position_ids"] = position_ids
+        # keep the unpadded ids in int32, the padded tensors and the masks are built by `collate_fn`
+        example["input_ids"] = input_ids.to(torch.int32)
+        example["position_ids"] = position_ids.to(torch.int32)
         example["raw_prompt_ids"] = raw_prompt_ids
         example["ground_truth"] = example.pop(self.answer_key)
         return example
+
+
+class LengthGroupedSampler(Sampler[int]):
+    """
+    Shuffles the examples, then sorts every group of `group_size` batches by the number of images and the prompt
+    length, so that the examples in one batch have similar lengths. The order of the batches is shuffled again.
+    """
+
+    def __init__(
+        self,
+        prompt_lengths: List[int],
+        num_images: List[int],
+        batch_size: int,
+        group_size: int = 16,
+        seed: int = 1,
+    ):
+        self.prompt_lengths = torch.tensor(prompt_lengths, dtype=torch.long)
+        self.num_images = torch.tensor(num_images, dtype=torch.long)
+        self.batch_size = batch_size
+        self.group_size = group_size
+        self.seed = seed
+        self.epoch = 0
+        self.yielded = 0
+
+    def __len__(self) -> int:
+        return len(self.prompt_lengths)
+
+    def _get_indices(self) -> List[int]:
+        if len(self) == 0:
+            return []
+
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(len(self), generator=generator)
+        # sort by the number of images first, then by the prompt length
+        sort_keys = self.num_images * (self.prompt_lengths.max() + 1) + self.prompt_lengths
+        batches = []
+        for group in indices.split(self.batch_size * self.group_size):
+            group = group[torch.argsort(sort_keys[group], descending=True)]
+            batches.extend(group.split(self.batch_size))
+
+        # keep the incomplete batch at the end so that the other batches are not misaligned
+        last_batch = [batches.pop()] if len(batches[-1]) < self.batch_size else []
+        batches = [batches[i] for i in torch.randperm(len(batches), generator=generator).tolist()] + last_batch
+        return torch.cat(batches).tolist()
+
+    def __iter__(self) -> Iterator[int]:
+        indices = self._get_indices()
+        for index in indices[self.yielded :]:
+            self.yielded += 1
+            yield index
+
+        self.epoch += 1
+        self.yielded = 0
+
+    def state_dict(self) -> Dict[str, int]:
+        return {"epoch": self.epoch, "yielded": self.yielded}
+
+    def load_state_dict(self, state_dict: Dict[str, int]) -> None:
+        self.epoch = state_dict["epoch"]
+        self.yielded = state_dict["yielded"]
+
+
+class StreamingRLHFDataset(RLHFDataset, IterableDataset):
+    """
+    Streams the dataset shards instead of loading the whole dataset, the examples are shuffled in a buffer.
+    The shards are split among the dataloader workers, and the position is saved by the stateful dataloader.
+    """
+
+    streaming = True
+
+    def __init__(self, *args, shuffle: bool = True, seed: int = 1, shuffle_buffer_size: int = 10000, **kwargs):
+        super().__init__(*args, **kwargs)
+        if shuffle:
+            self.dataset = self.dataset.shuffle(seed=seed, buffer_size=shuffle_buffer_size)
+
+    def __len__(self):
+        raise TypeError("Streaming dataset has no length.")
+
+    def __iter__(self):
+        start_time = time.perf_counter()
+        for example in self.dataset:
+            example = self._process_example(example)
+            self.load_time += time.perf_counter() - start_time
+            yield example
+            start_time = time.perf_counter()
+
+    @property
+    def epoch(self) -> int:
+        return self.dataset.epoch
+
+    def set_epoch(self, epoch: int) -> None:
+        """Shuffles the shards and the buffer with the seed of this epoch, it is shared with the persistent workers."""
+        self.dataset.set_epoch(epoch)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return self.dataset.state_dict()
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.dataset.set_epoch(state_dict["epoch"])  # the hf dataset only resumes in the epoch of the state
+        self.dataset.load_state_dict(state_dict)
@@ -0,0 +1,38 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The device of the workers, cuda with nccl if available, otherwise cpu with gloo (e.g. the stub rollout in CI).
+"""
+
+import torch
+
+
+def is_cuda_available() -> bool:
+    return torch.cuda.is_available()
+
+
+def get_device_name() -> str:
+    return "cuda" if is_cuda_available() else "cpu"
+
+
+def get_device_id() -> torch.device:
+    """Gets the current device of this process."""
+    if is_cuda_available():
+        return torch.device("cuda", torch.cuda.current_device())
+
+    return torch.device("cpu")
+
+
+def get_dist_backend() -> str:
+    return "nccl" if is_cuda_available() else "gloo"
@@ -16,6 +16,8 @@ from typing import TYPE_CHECKING, List, Tuple
 
 import torch
 
+from .device import is_cuda_available
+
 
 if TYPE_CHECKING:
     from transformers.models.llama.configuration_llama import LlamaConfig
@@ -34,7 +36,7 @@ def get_device_flops(unit: str = "T") -> float:
 
         return number
 
-    device_name = torch.cuda.get_device_name()
+    device_name = torch.cuda.get_device_name() if is_cuda_available() else "cpu"
     flops = float("inf")  # INF flops for unkown gpu type
     if "H100" in device_name or "H800" in device_name:
         flops = 989e12
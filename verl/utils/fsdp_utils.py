@@ -13,12 +13,16 @@
 # limitations under the License.
 
 import gc
+import math
 from collections import defaultdict
+from dataclasses import dataclass
 from functools import partial
-from typing import Callable, Union
+from typing import Callable, List, Optional, Set, Tuple, Union
 
 import torch
+import torch.distributed as dist
 from torch import nn
+from torch.distributed._tensor import DTensor, Shard
 from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 from torch.distributed.fsdp._runtime_utils import _lazy_init
 from torch.distributed.fsdp.wrap import transformer_auto_wrap_policy
@@ -26,6 +30,8 @@ from torch.optim import Optimizer
 from transformers import PreTrainedModel
 from transformers.trainer_pt_utils import get_module_class_from_name
 
+from .device import get_device_name, is_cuda_available
+
 
 def get_init_fn(model: nn.Module, device: Union[str, torch.device]) -> Callable[[nn.Module], None]:
     param_occurrence = defaultdict(int)
@@ -86,7 +92,7 @@ def offload_fsdp_model(model: FSDP, empty_cache: bool = True):
         flat_param._local_shard = flat_param.data
         assert id(flat_param._local_shard) != id(flat_param.data)
 
-    if empty_cache:
+    if empty_cache and is_cuda_available():
         torch.cuda.empty_cache()
 
 
@@ -100,7 +106,7 @@ def load_fsdp_model(model: FSDP, empty_cache: bool = True):
             continue
 
         flat_param = handle.flat_param
-        handle.flat_param_to("cuda", non_blocking=True)
+        handle.flat_param_to(get_device_name(), non_blocking=True)
         # the following still keeps id(._local_shard) != id(.data)
         flat_param._local_shard = flat_param.data
 
@@ -120,7 +126,7 @@ def offload_fsdp_optimizer(optimizer: Optimizer, empty_cache: bool = True):
                 if isinstance(value, torch.Tensor):
                     state[key] = value.to("cpu", non_blocking=True)
 
-    if empty_cache:
+    if empty_cache and is_cuda_available():
         torch.cuda.empty_cache()
 
 
@@ -134,7 +140,122 @@ def load_fsdp_optimizer(optimizer: Optimizer, empty_cache: bool = True):
             state = optimizer.state[param]
             for key, value in state.items():
                 if isinstance(value, torch.Tensor):
-                    state[key] = value.to("cuda", non_blocking=True)
+                    state[key] = value.to(get_device_name(), non_blocking=True)
 
     if empty_cache:
         gc.collect()
+
+
+def get_frozen_param_names(module: nn.Module, optimizer: Optional[Optimizer] = None) -> Set[str]:
+    """Get the names of the parameters that are not updated by the optimizer.
+
+    A parameter is frozen if it does not require grad or it is not in the optimizer. The buffers are never frozen
+    since they may be changed outside the optimizer, e.g., in the forward pass.
+    """
+    optimizer_params = None
+    if optimizer is not None:
+        optimizer_params = {id(param) for param_group in optimizer.param_groups for param in param_group["params"]}
+
+    return {
+        name.replace("_fsdp_wrapped_module.", "")
+        for name, param in module.named_parameters()
+        if not param.requires_grad or (optimizer_params is not None and id(param) not in optimizer_params)
+    }
+
+
+class FrozenParamTracker:
+    """Track the frozen parameters, whose values are kept by the inference engine after the first sync."""
+
+    def __init__(self, module: nn.Module, optimizer: Optional[Optimizer] = None):
+        self.module = module
+        self.optimizer = optimizer
+        self.frozen_param_names = get_frozen_param_names(module, optimizer)
+
+    def update(self) -> bool:
+        """Check the frozen parameters again, returns True if they changed, e.g., the vision tower is unfrozen."""
+        frozen_param_names = get_frozen_param_names(self.module, self.optimizer)
+        changed = frozen_param_names != self.frozen_param_names
+        self.frozen_param_names = frozen_param_names
+        return changed
+
+
+_GATHER_ALIGNMENT = 16
+
+
+@dataclass
+class WeightBucketLayout:
+    """The full shapes and dtypes of a bucket of weights and their byte offsets in the gather buffer.
+
+    The offset is -1 for the weights not gathered into the buffer, i.e., the plain tensors and the DTensors not
+    sharded along the first dim.
+    """
+
+    shapes: List[torch.Size]
+    dtypes: List[torch.dtype]
+    offsets: List[int]
+    buffer_size: int
+
+
+def _is_row_sharded(tensor: Union[torch.Tensor, DTensor]) -> bool:
+    return isinstance(tensor, DTensor) and tensor.device_mesh.ndim == 1 and tensor.placements == (Shard(0),)
+
+
+def get_weight_bucket_layout(weights: List[Tuple[str, Union[torch.Tensor, DTensor]]]) -> WeightBucketLayout:
+    """Compute the gather buffer layout of a bucket of weights, it only depends on the metadata of the weights."""
+    shapes, dtypes, offsets, buffer_size = [], [], [], 0
+    for _, tensor in weights:
+        shapes.append(tensor.shape)
+        dtypes.append(tensor.dtype)
+        if not _is_row_sharded(tensor):
+            offsets.append(-1)
+            continue
+
+        # the shards are split like torch.chunk, the smaller ones are padded to the first one
+        offsets.append(buffer_size)
+        shard_rows = -(-tensor.size(0) // tensor.device_mesh.size())
+        nbytes = tensor.device_mesh.size() * shard_rows * math.prod(tensor.shape[1:]) * tensor.element_size()
+        buffer_size += -(-nbytes // _GATHER_ALIGNMENT) * _GATHER_ALIGNMENT  # keep the dtype views aligned
+
+    return WeightBucketLayout(shapes=shapes, dtypes=dtypes, offsets=offsets, buffer_size=buffer_size)
+
+
+def gather_weight_bucket(
+    weights: List[Tuple[str, Union[torch.Tensor, DTensor]]], layout: Optional[WeightBucketLayout] = None
+) -> Tuple[List[Tuple[str, torch.Tensor]], List[dist.Work]]:
+    """Issue the all-gathers of a bucket of sharded weights asynchronously into one flat buffer.
+
+    The gathered weights are views of the buffer, they can be used after the returned works are waited.
+    The weights not sharded along the first dim are gathered synchronously. The layout can be computed once by
+    `get_weight_bucket_layout` and reused as long as the weights keep their shapes and dtypes.
+    """
+    if layout is None:
+        layout = get_weight_bucket_layout(weights)
+
+    buffer = None
+    gathered, works = [], []
+    for (name, tensor), shape, dtype, offset in zip(weights, layout.shapes, layout.dtypes, layout.offsets):
+        if not isinstance(tensor, DTensor):
+            gathered.append((name, tensor))
+            continue
+
+        if offset == -1:
+            gathered.append((name, tensor.full_tensor()))
+            continue
+
+        local_tensor = tensor.to_local()
+        if buffer is None:
+            buffer = torch.empty(layout.buffer_size, dtype=torch.uint8, device=local_tensor.device)
+
+        group_size = tensor.device_mesh.size()
+        shard_rows = -(-shape[0] // group_size)
+        if local_tensor.size(0) < shard_rows:
+            padding = local_tensor.new_zeros(shard_rows - local_tensor.size(0), *shape[1:])
+            local_tensor = torch.cat([local_tensor, padding])
+
+        nbytes = group_size * local_tensor.numel() * dtype.itemsize
+        output = buffer[offset : offset + nbytes].view(dtype).view(group_size * shard_rows, *shape[1:])
+        group = tensor.device_mesh.get_group()
+        works.append(dist.all_gather_into_tensor(output, local_tensor.contiguous(), group=group, async_op=True))
+        gathered.append((name, output[: shape[0]]))
+
+    return gathered, works
@@ -15,13 +15,16 @@
 Utilities to create common models
 """
 
+import re
 from functools import lru_cache
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import torch
 import torch.distributed as dist
 from torch import nn
 
+from .device import is_cuda_available
+
 
 @lru_cache
 def is_rank0() -> int:
@@ -30,7 +33,7 @@ def is_rank0() -> int:
 
 def print_gpu_memory_usage(prefix: str = "GPU memory usage") -> None:
     """Report the current GPU VRAM usage."""
-    if is_rank0():
+    if is_rank0() and is_cuda_available():
         free_mem, total_mem = torch.cuda.mem_get_info()
         print(f"{prefix}: {(total_mem - free_mem) / (1024**3):.2f} GB / {total_mem / (1024**3):.2f} GB.")
 
@@ -71,3 +74,31 @@ def print_model_size(model: nn.Module, name: Optional[str] = None) -> None:
             name = model.__class__.__name__
 
         print(f"{name} contains {n_params:.2f}{scale} parameters.")
+
+
+def get_checkpoint_key_mapping(keys: List[str], model: nn.Module) -> Dict[str, str]:
+    """Map the state dict keys to the original checkpoint keys, which are expected by the inference engine.
+
+    See https://github.com/huggingface/transformers/pull/38385
+    """
+    if not hasattr(model, "_checkpoint_conversion_mapping"):
+        return {key: key for key in keys}
+
+    reverse_key_mapping = []
+    for replacement, pattern in model._checkpoint_conversion_mapping.items():
+        replacement = replacement.lstrip("^")  # strip off un-needed chars and patterns
+        replacement = re.sub(r"\(.*\)", "", replacement)
+        reverse_key_mapping.append((re.compile(pattern), replacement))
+
+    key_mapping = {}
+    for key in keys:
+        new_key = key
+        for pattern, replacement in reverse_key_mapping:
+            new_key, n_replace = pattern.subn(replacement, key)
+            # Early exit of the loop
+            if n_replace > 0:
+                break
+
+        key_mapping[key] = new_key
+
+    return key_mapping
@@ -17,11 +17,13 @@ import heapq
 from itertools import chain
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import torch
 from tensordict import TensorDict
 from torch import distributed as dist
 
 from ..protocol import DataProto
+from .device import get_device_name
 
 
 class Set:
@@ -237,22 +239,22 @@ def ceildiv(a: float, b: float) -> float:
     return -(a // -b)
 
 
-def rearrange_micro_batches(
-    batch: TensorDict, max_token_len: int, dp_group: Optional[dist.ProcessGroup] = None
-) -> Tuple[List[TensorDict], List[List[int]]]:
-    """Split the batch into a list of micro_batches, where the max_token_len is smaller than max_token_len
-    and the number of valid tokens in each micro batch is well balanced.
+def get_micro_batch_partitions(
+    attention_mask: torch.Tensor, max_token_len: int, dp_group: Optional[dist.ProcessGroup] = None
+) -> List[List[int]]:
+    """Partition the samples into micro batches, where the number of tokens of each micro batch is smaller than
+    max_token_len and the number of valid tokens in each micro batch is well balanced.
     """
     # this is per local micro_bsz
-    max_seq_len = batch["attention_mask"].shape[-1]
+    max_seq_len = attention_mask.shape[-1]
     assert max_token_len >= max_seq_len, (
         f"max_token_len must be greater than the sequence length. Got {max_token_len=} and {max_seq_len=}"
     )
-    effective_seqlen = torch.sum(batch["attention_mask"], dim=-1)
+    effective_seqlen = torch.sum(attention_mask, dim=-1)
     total_seqlen = effective_seqlen.sum().item()
     num_micro_batches = min(len(effective_seqlen), ceildiv(total_seqlen, max_token_len))
     if dist.is_initialized():
-        num_micro_batches = torch.tensor([num_micro_batches], device="cuda")
+        num_micro_batches = torch.tensor([num_micro_batches], device=get_device_name())
         dist.all_reduce(num_micro_batches, op=dist.ReduceOp.MAX, group=dp_group)
         num_micro_batches = num_micro_batches.cpu().item()
 
@@ -265,12 +267,24 @@ def rearrange_micro_batches(
         return (sum(effective_seqlen[idx] ** 2 for idx in partition), min(partition) if partition else 0)
 
     micro_bsz_idx.sort(key=compute_workload, reverse=True)
+    return micro_bsz_idx
 
-    micro_batches = []
-    for partition in micro_bsz_idx:
-        curr_micro_batch = [batch[idx] for idx in partition]
-        micro_batches.append(torch.stack(curr_micro_batch))
 
+def rearrange_micro_batches(
+    batch: TensorDict,
+    max_token_len: int,
+    dp_group: Optional[dist.ProcessGroup] = None,
+    micro_bsz_idx: Optional[List[List[int]]] = None,
+) -> Tuple[List[TensorDict], List[List[int]]]:
+    """Split the batch into a list of micro_batches, where the max_token_len is smaller than max_token_len
+    and the number of valid tokens in each micro batch is well balanced. The partitions can be reused if given.
+    """
+    if micro_bsz_idx is None:
+        micro_bsz_idx = get_micro_batch_partitions(batch["attention_mask"], max_token_len, dp_group)
+
+    # gather the batch once in partition order, then each micro batch is a contiguous slice of it
+    indices = torch.tensor(list(chain.from_iterable(micro_bsz_idx)), dtype=torch.long)
+    micro_batches = list(batch[indices].split([len(partition) for partition in micro_bsz_idx], dim=0))
     return micro_batches, micro_bsz_idx
 
 
@@ -292,24 +306,32 @@ def get_reverse_idx(idx_map: List[int]) -> List[int]:
     return reverse_idx_map
 
 
-def prepare_dynamic_batch(data: DataProto, max_token_len: int) -> tuple[list[DataProto], list[list[int]]]:
+def prepare_dynamic_batch(
+    data: DataProto, max_token_len: int, batch_idx_list: Optional[List[List[int]]] = None
+) -> tuple[list[DataProto], list[list[int]]]:
     """
     Prepare a batch for dynamic batching.
 
     Args:
         data (DataProto): The input data.
         max_token_len (int): The maximum token length for dynamic batching.
+        batch_idx_list (List[List[int]], optional): The index lists returned before, which are reused if given.
 
     Returns:
         Tuple[List[DataProto], List[List[int]]]: A tuple containing a list of DataProto objects
         and a list of index lists.
     """
-    batch, batch_idx_list = rearrange_micro_batches(data.batch, max_token_len=max_token_len)
-    micro_batches = []
+    batch, batch_idx_list = rearrange_micro_batches(
+        data.batch, max_token_len=max_token_len, micro_bsz_idx=batch_idx_list
+    )
+    indices = np.fromiter(chain.from_iterable(batch_idx_list), dtype=np.int64)
+    non_tensor_batch = {key: value[indices] for key, value in data.non_tensor_batch.items()}
+    micro_batches, start = [], 0
     for i, batch_idx in enumerate(batch_idx_list):
-        tensors = dict(batch[i])
-        non_tensors = {key: value[batch_idx] for key, value in data.non_tensor_batch.items()}
-        micro_batches.append(DataProto.from_dict(tensors, non_tensors))
+        end = start + len(batch_idx)
+        non_tensors = {key: value[start:end] for key, value in non_tensor_batch.items()}
+        micro_batches.append(DataProto(batch=batch[i], non_tensor_batch=non_tensors))
+        start = end
 
     return micro_batches, batch_idx_list
 
@@ -328,3 +350,39 @@ def restore_dynamic_batch(data: torch.Tensor, batch_idx_list: List[List[int]]) -
     indices = list(chain.from_iterable(batch_idx_list))
     revert_indices = torch.tensor(get_reverse_idx(indices), dtype=torch.long)
     return data[revert_indices]
+
+
+class ResponseLengthPredictor:
+    """Predict the response length of each prompt by the moving average of its previous response lengths.
+
+    The prompts that have not been generated before are predicted by the moving average over all the prompts.
+    """
+
+    def __init__(self, decay: float = 0.5):
+        self.decay = decay
+        self.lengths: Dict[int, float] = {}
+        self.global_length: Optional[float] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.global_length is not None
+
+    def predict(self, keys: np.ndarray) -> np.ndarray:
+        default_length = self.global_length or 0.0
+        return np.array([self.lengths.get(key, default_length) for key in keys.tolist()], dtype=np.float64)
+
+    def update(self, keys: np.ndarray, response_lengths: np.ndarray) -> None:
+        # the samples of the same prompt are averaged first
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        mean_lengths = np.bincount(inverse, weights=response_lengths) / np.bincount(inverse)
+        for key, length in zip(unique_keys.tolist(), mean_lengths.tolist()):
+            if key in self.lengths:
+                length = self.decay * self.lengths[key] + (1.0 - self.decay) * length
+
+            self.lengths[key] = length
+
+        batch_length = float(np.mean(response_lengths))
+        if self.global_length is not None:
+            batch_length = self.decay * self.global_length + (1.0 - self.decay) * batch_length
+
+        self.global_length = batch_length
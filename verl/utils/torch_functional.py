@@ -16,8 +16,9 @@
 Contain small torch utilities
 """
 
-from typing import List, Literal, Optional, Tuple, Union
+from typing import List, Literal, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import torch
 import torch.distributed
 import torch.nn.functional as F
@@ -122,19 +123,35 @@ def get_response_mask(
     return response_mask
 
 
+def pad_2d_list_to_numpy(
+    response: List[Sequence[int]],
+    pad_token_id: int,
+    max_length: Optional[int] = None,
+    dtype: Optional[np.dtype] = None,
+) -> np.ndarray:
+    """Pad a 2D list (e.g. responses, log_probs) to a 2D numpy array.
+
+    The values are written into a preallocated array at once, no padded python lists are built. The dtype defaults
+    to the one of the first non-empty row, or int64 if all the rows are empty.
+    """
+    if dtype is None:  # an empty row would be float64 and promote the token ids
+        dtype = next((np.asarray(sub_list).dtype for sub_list in response if len(sub_list) != 0), np.int64)
+
+    lengths = np.fromiter(map(len, response), dtype=np.int64, count=len(response))
+    target_length = max(int(lengths.max(initial=0)), max_length or 0)
+    padded_response = np.full((len(response), target_length), pad_token_id, dtype=dtype)
+    if len(response) != 0:
+        values = np.concatenate([np.asarray(sub_list, dtype=dtype) for sub_list in response])
+        padded_response[np.arange(target_length) < lengths[:, None]] = values  # row-major, same order as values
+
+    return padded_response
+
+
 def pad_2d_list_to_length(
-    response: List[List[int]], pad_token_id: int, max_length: Optional[int] = None
+    response: List[Sequence[int]], pad_token_id: int, max_length: Optional[int] = None
 ) -> torch.Tensor:
     """Pad a 2D list (e.g. responses, log_probs) to a 2D tensor."""
-    max_response_length = max(len(sub_list) for sub_list in response)
-    if max_length is not None and max_length > max_response_length:
-        target_length = max_length
-    else:
-        target_length = max_response_length
-
-    padded_response = [tuple(sub_list) + (pad_token_id,) * (target_length - len(sub_list)) for sub_list in response]
-    tensor = torch.tensor(padded_response)
-    return tensor
+    return torch.from_numpy(pad_2d_list_to_numpy(response, pad_token_id, max_length))
 
 
 def pad_sequence_to_length(
@@ -94,6 +94,8 @@ class ActorConfig:
     """loss average mode: `token`, `seq`"""
     ppo_epochs: int = 1
     """number of ppo epochs for each rollout batch"""
+    shuffle: bool = False
+    """shuffle the samples into different mini-batches at each ppo epoch"""
     padding_free: bool = True
     """use padding-free training"""
     dynamic_batching: bool = True
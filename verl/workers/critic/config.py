@@ -37,6 +37,8 @@ class CriticConfig:
     """loss average mode: `token`, `seq`"""
     ppo_epochs: int = 1
     """number of ppo epochs for each rollout batch"""
+    shuffle: bool = False
+    """shuffle the samples into different mini-batches at each ppo epoch"""
     padding_free: bool = False
     """use padding-free training"""
     dynamic_batching: bool = True
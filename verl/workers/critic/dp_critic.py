@@ -178,21 +178,31 @@ class DataParallelPPOCritic(BasePPOCritic):
 
         # Split to make minibatch iterator for updating the actor
         # See PPO paper for details. https://arxiv.org/abs/1707.06347
-        mini_batches = data.select(select_keys, non_tensor_select_keys).split(self.config.global_batch_size_per_device)
+        data = data.select(select_keys, non_tensor_select_keys)
+        num_mini_batches = len(data) // self.config.global_batch_size_per_device
+        # the micro batch partitions are reused across ppo epochs if the mini batches are not shuffled
+        batch_idx_lists = {}
 
         metrics = defaultdict(list)
         for _ in range(self.config.ppo_epochs):
+            # the mini batches are views of the data, or index selects over a permutation if shuffled
+            mini_batch_iter = data.make_iterator(
+                self.config.global_batch_size_per_device, epochs=1, dataloader_kwargs={"shuffle": self.config.shuffle}
+            )
             if self.rank == 0:
-                mini_batches = tqdm(mini_batches, desc="Train mini-batches", position=1)
+                mini_batch_iter = tqdm(mini_batch_iter, total=num_mini_batches, desc="Train mini-batches", position=1)
 
-            for mini_batch in mini_batches:
+            for mini_batch_idx, mini_batch in enumerate(mini_batch_iter):
                 total_response_tokens = torch.sum(mini_batch.batch["response_mask"])
                 dist.all_reduce(total_response_tokens, op=dist.ReduceOp.SUM)
-
                 if self.config.dynamic_batching:
                     max_input_len = mini_batch.batch["input_ids"].size(-1)
                     max_token_len = self.config.micro_batch_size_per_device_for_update * max_input_len
-                    micro_batches, _ = prepare_dynamic_batch(mini_batch, max_token_len=max_token_len)
+                    micro_batches, batch_idx_list = prepare_dynamic_batch(
+                        mini_batch, max_token_len=max_token_len, batch_idx_list=batch_idx_lists.get(mini_batch_idx)
+                    )
+                    if not self.config.shuffle:
+                        batch_idx_lists[mini_batch_idx] = batch_idx_list
                 else:
                     micro_batches = mini_batch.split(self.config.micro_batch_size_per_device_for_update)
 
@@ -15,10 +15,12 @@
 The main entry point to run the PPO algorithm
 """
 
-from typing import Literal, Optional, Union, cast
+from functools import partial
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple, Union, cast
 
 import numpy as np
 import psutil
+import ray
 import torch
 import torch.distributed as dist
 from accelerate import init_empty_weights
@@ -37,11 +39,12 @@ from transformers import (
 from transformers.modeling_utils import no_init_weights
 
 from ..models.monkey_patch import apply_ulysses_patch
-from ..protocol import DataProto
+from ..protocol import DataProto, get_group_index
 from ..single_controller.base import Worker
 from ..single_controller.base.decorator import Dispatch, register
 from ..utils.checkpoint.fsdp_checkpoint_manager import FSDPCheckpointManager
 from ..utils.dataset import process_image, process_video
+from ..utils.device import get_device_id, get_device_name, get_dist_backend, is_cuda_available
 from ..utils.flops_counter import FlopsCounter
 from ..utils.fsdp_utils import (
     get_fsdp_wrap_policy,
@@ -56,13 +59,18 @@ from ..utils.tokenizer import get_processor, get_tokenizer
 from ..utils.torch_dtypes import PrecisionType
 from ..utils.torch_functional import AnyPrecisionAdamW, get_constant_schedule_with_warmup
 from .config import ActorConfig, CriticConfig, FSDPConfig, ModelConfig, OptimConfig, WorkerConfig
-from .rollout import vLLMRollout
-from .sharding_manager import FSDPVLLMShardingManager
+from .reward import make_stream_reward_chunk
+from .rollout import BaseRollout, StubRollout, get_rollout_builder, register_rollout
+from .sharding_manager import BaseShardingManager, StubShardingManager
 from .sharding_manager.fsdp_ulysses import FSDPUlyssesShardingManager
 
 from . import perc_utils
 
 
+if TYPE_CHECKING:
+    from vllm import RequestOutput
+
+
 class FSDPWorker(Worker):
     def __init__(
         self,
@@ -73,13 +81,14 @@ class FSDPWorker(Worker):
         self.config = config
         self.role = role
         self._cache = {}
+        self._stream_reward_fn = None
 
         if not dist.is_initialized():
-            dist.init_process_group(backend="nccl")
+            dist.init_process_group(backend=get_dist_backend())
 
-        # improve numerical stability
-        torch.backends.cuda.matmul.allow_tf32 = False
-        torch.backends.cuda.matmul.allow_bf16_reduced_precision_reduction = False
+        if is_cuda_available():  # improve numerical stability
+            torch.backends.cuda.matmul.allow_tf32 = False
+            torch.backends.cuda.matmul.allow_bf16_reduced_precision_reduction = False
 
         self._has_actor = self.role in ["actor", "actor_rollout", "actor_rollout_ref"]
         self._has_critic = self.role == "critic"
@@ -112,16 +121,18 @@ class FSDPWorker(Worker):
         # create main device mesh
         fsdp_size = config.fsdp.fsdp_size
         if fsdp_size <= 0 or fsdp_size >= world_size:
-            self.device_mesh = init_device_mesh("cuda", mesh_shape=(world_size,), mesh_dim_names=("fsdp",))
+            self.device_mesh = init_device_mesh(get_device_name(), mesh_shape=(world_size,), mesh_dim_names=("fsdp",))
         else:  # hsdp
             self.device_mesh = init_device_mesh(
-                "cuda", mesh_shape=(world_size // fsdp_size, fsdp_size), mesh_dim_names=("ddp", "fsdp")
+                get_device_name(),
+                mesh_shape=(world_size // fsdp_size, fsdp_size),
+                mesh_dim_names=("ddp", "fsdp"),
             )
 
         # create ulysses device mesh
         if config.ulysses_size > 1:
             self.ulysses_device_mesh = init_device_mesh(
-                "cuda",
+                get_device_name(),
                 mesh_shape=(world_size // config.ulysses_size, config.ulysses_size),
                 mesh_dim_names=("dp", "sp"),
             )
@@ -187,6 +198,9 @@ class FSDPWorker(Worker):
             apply_ulysses_patch(self.model_config.model_type)
             self.print_rank0("Ulysses patch applied!")
 
+        # the workers without cuda (e.g. the stub rollout on cpu) fall back to sdpa
+        attn_implementation = "flash_attention_2" if is_cuda_available() else "sdpa"
+
         if fsdp_config.torch_dtype is None:
             torch_dtype = torch.float32 if role != "ref" else torch.bfloat16
         else:
@@ -204,8 +218,8 @@ class FSDPWorker(Worker):
                 model_config.model_path,
                 config=self.model_config,
                 torch_dtype=torch_dtype,
-                attn_implementation="flash_attention_2",
-                device_map="cpu" if fsdp_config.enable_rank0_init else "cuda",
+                attn_implementation=attn_implementation,
+                device_map="cpu" if fsdp_config.enable_rank0_init else get_device_name(),
                 low_cpu_mem_usage=True,
                 trust_remote_code=model_config.trust_remote_code,
             )
@@ -214,7 +228,7 @@ class FSDPWorker(Worker):
                 model = auto_class.from_config(
                     self.model_config,
                     torch_dtype=torch_dtype,
-                    attn_implementation="flash_attention_2",
+                    attn_implementation=attn_implementation,
                     trust_remote_code=model_config.trust_remote_code,
                 )
 
@@ -242,6 +256,9 @@ class FSDPWorker(Worker):
         dist.barrier()
         print_model_size(model)
         print_gpu_memory_usage("After huggingface model init")
+        if role == "actor":  # the rollout plans its memory by the size of the weights
+            self.num_actor_params = sum(p.numel() for p in model.parameters())
+
         mixed_precision = MixedPrecision(
             param_dtype=PrecisionType.to_dtype(fsdp_config.mp_param_dtype),
             reduce_dtype=PrecisionType.to_dtype(fsdp_config.mp_reduce_dtype),
@@ -268,7 +285,7 @@ class FSDPWorker(Worker):
 
         if fsdp_config.enable_rank0_init:
             sync_module_states = True
-            param_init_fn = get_init_fn(model, device="cuda") if self.rank != 0 else None
+            param_init_fn = get_init_fn(model, device=get_device_name()) if self.rank != 0 else None
         else:
             sync_module_states = False
             param_init_fn = None
@@ -280,7 +297,7 @@ class FSDPWorker(Worker):
             auto_wrap_policy=auto_wrap_policy,
             mixed_precision=mixed_precision,
             param_init_fn=param_init_fn,
-            device_id=torch.cuda.current_device(),
+            device_id=get_device_id(),
             sync_module_states=sync_module_states,
             forward_prefetch=False,
             use_orig_params=fsdp_config.use_orig_params,
@@ -331,25 +348,8 @@ class FSDPWorker(Worker):
                 print_gpu_memory_usage(f"After offload {role} model during init")
 
     def _build_rollout(self) -> None:
-        tp_size = self.config.rollout.tensor_parallel_size
-        dp_size = self.world_size // tp_size
-        if self.world_size % tp_size != 0:
-            raise ValueError(f"rollout world size {self.world_size} is not divisible by tp size {tp_size}.")
-
-        rollout_device_mesh = init_device_mesh("cuda", mesh_shape=(dp_size, tp_size), mesh_dim_names=("dp", "tp"))
-        self.rollout = vLLMRollout(
-            model_path=self.config.actor.model.model_path,
-            config=self.config.rollout,
-            tokenizer=self.tokenizer,
-            processor=self.processor,
-        )
-        self.rollout_sharding_manager = FSDPVLLMShardingManager(
-            module=self.fsdp_module,
-            inference_engine=self.rollout.inference_engine,
-            device_mesh=rollout_device_mesh,
-            use_param_offload=self._use_param_offload,
-        )
-        print_gpu_memory_usage("After vllm init")
+        build_rollout = get_rollout_builder(self.config.rollout.name)
+        self.rollout, self.rollout_sharding_manager = build_rollout(self)
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
     def init_model(self):
@@ -436,6 +436,9 @@ class FSDPWorker(Worker):
             load_fsdp_model(self.fsdp_module)
 
         self.checkpoint_manager.load_checkpoint(path)
+        if self._has_rollout:
+            self.rollout_sharding_manager.require_full_sync()
+
         dist.barrier()
         if self._use_param_offload:
             offload_fsdp_model(self.fsdp_module)
@@ -454,12 +457,15 @@ class FSDPWorker(Worker):
             min_pixels = data.meta_info["min_pixels"]
             max_pixels = data.meta_info["max_pixels"]
             video_fps = data.meta_info["video_fps"]
-            batch_multi_modal_inputs = []
-            for multi_modal_data in data.non_tensor_batch["multi_modal_data"]:  # process multi modal data per sample
+            # the samples of a prompt share its multi modal data, the inputs are processed and stored once per prompt
+            batch_multi_modal_data = data.non_tensor_batch["multi_modal_data"]
+            first_indices, group_index = get_group_index(batch_multi_modal_data)
+            group_multi_modal_inputs = []
+            for multi_modal_data in batch_multi_modal_data[first_indices]:  # process multi modal data per prompt
                 images, videos = [], []
                 if "images" in multi_modal_data:
                     for image in multi_modal_data["images"]:
-                        images.append(process_image(image, min_pixels, max_pixels))
+                        images.append(process_image(image, min_pixels, max_pixels, return_numpy=True))
 
                 if "videos" in multi_modal_data:
                     for video in multi_modal_data["videos"]:
@@ -469,7 +475,11 @@ class FSDPWorker(Worker):
                     # it's necessary to add `dict` to properly convert batch features to dict
                     # otherwise the batch features will be converted to dict keys
                     # see https://github.com/hiyouga/EasyR1/pull/339
-                    multi_modal_inputs = dict(self.processor.image_processor(images=images, return_tensors="pt"))
+                    multi_modal_inputs = dict(
+                        self.processor.image_processor(
+                            images=images, return_tensors="pt", input_data_format="channels_last"
+                        )
+                    )
                 elif len(videos) != 0:
                     multi_modal_inputs = dict(
                         self.processor.image_processor(images=None, videos=videos, return_tensors="pt")
@@ -478,12 +488,14 @@ class FSDPWorker(Worker):
                     multi_modal_inputs = {}
 
                 multi_modal_inputs = {
-                    k: v.to(torch.cuda.current_device(), non_blocking=True) for k, v in multi_modal_inputs.items()
+                    k: v.to(get_device_id(), non_blocking=True) for k, v in multi_modal_inputs.items()
                 }
-                batch_multi_modal_inputs.append(multi_modal_inputs)
+                group_multi_modal_inputs.append(multi_modal_inputs)
 
+            batch_multi_modal_inputs = np.empty(len(data), dtype=object)
+            batch_multi_modal_inputs[:] = [group_multi_modal_inputs[idx] for idx in group_index]
             self._cache["uid"] = data.non_tensor_batch["uid"]
-            self._cache["multi_modal_inputs"] = np.array(batch_multi_modal_inputs, dtype=object)
+            self._cache["multi_modal_inputs"] = batch_multi_modal_inputs
 
         data.non_tensor_batch["multi_modal_inputs"] = self._cache["multi_modal_inputs"]
 
@@ -519,9 +531,7 @@ class FSDPWorker(Worker):
             else:
                 multi_modal_inputs = {}
 
-            multi_modal_inputs = {
-                k: v.to(torch.cuda.current_device(), non_blocking=True) for k, v in multi_modal_inputs.items()
-            }
+            multi_modal_inputs = {k: v.to(get_device_id(), non_blocking=True) for k, v in multi_modal_inputs.items()}
             batch_multi_modal_inputs.append(multi_modal_inputs)
 
         data.non_tensor_batch["multi_modal_inputs"] = np.array(batch_multi_modal_inputs, dtype=object)
@@ -531,7 +541,7 @@ class FSDPWorker(Worker):
         assert self._has_actor
 
         self._process_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_param_offload:
             load_fsdp_model(self.fsdp_module)
@@ -550,12 +560,14 @@ class FSDPWorker(Worker):
             metrics["perf/mfu_actor"] = (
                 estimated_flops * self.config.actor.ppo_epochs / (promised_flops * self.world_size)
             )
-            metrics["perf/max_memory_allocated_gb"] = (
-                torch.cuda.max_memory_allocated() - self.rollout_sharding_manager.freed_bytes
-            ) / (1024**3)
-            metrics["perf/max_memory_reserved_gb"] = (
-                torch.cuda.max_memory_reserved() - self.rollout_sharding_manager.freed_bytes
-            ) / (1024**3)
+            if is_cuda_available():
+                metrics["perf/max_memory_allocated_gb"] = (
+                    torch.cuda.max_memory_allocated() - self.rollout_sharding_manager.freed_bytes
+                ) / (1024**3)
+                metrics["perf/max_memory_reserved_gb"] = (
+                    torch.cuda.max_memory_reserved() - self.rollout_sharding_manager.freed_bytes
+                ) / (1024**3)
+
             metrics["perf/cpu_memory_used_gb"] = psutil.virtual_memory().used / (1024**3)
 
             lr = self.lr_scheduler.get_last_lr()[0]
@@ -580,12 +592,38 @@ class FSDPWorker(Worker):
         return output
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def prepare_rollout_engine(self):
+    def prepare_rollout_engine(self) -> Dict[str, Any]:
         self.rollout_sharding_manager.load_vllm_and_sync_weights()
+        metrics = dict(self.rollout_sharding_manager.sync_metrics)
+        if self.config.rollout.auto_gpu_memory_utilization and self.rollout_sharding_manager.memory_info:
+            metrics.update(self.rollout.get_suggested_memory_metrics(**self.rollout_sharding_manager.memory_info))
+
+        return metrics
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def release_rollout_engine(self):
+    def release_rollout_engine(self) -> Dict[str, int]:
         self.rollout_sharding_manager.offload_vllm()
+        prefix_cache_stats = self.rollout.get_prefix_cache_stats()
+        if self.rollout_sharding_manager.tp_rank != 0:  # all tp ranks generate identical responses
+            prefix_cache_stats = dict.fromkeys(prefix_cache_stats, 0)
+
+        return prefix_cache_stats
+
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def set_stream_reward_fn(self, reward_fn: "ray.actor.ActorHandle"):
+        """Set the reward actor that scores finished responses during generation."""
+        self._stream_reward_fn = reward_fn
+
+    def _submit_stream_reward(
+        self, prompts: DataProto, indices: List[int], outputs: List["RequestOutput"], reward_refs: List[ray.ObjectRef]
+    ) -> None:
+        if self.rollout_sharding_manager.tp_rank != 0:  # all tp ranks generate identical responses
+            return
+
+        chunk = make_stream_reward_chunk(
+            prompts, indices, outputs, self.tokenizer.pad_token_id, self.config.rollout.response_length
+        )
+        reward_refs.append(self._stream_reward_fn.compute_stream_reward.remote(chunk))
 
     @register(dispatch_mode=Dispatch.DP_COMPUTE_PROTO)
     def generate_sequences(self, prompts: DataProto):
@@ -602,7 +640,17 @@ class FSDPWorker(Worker):
         prompts.meta_info.update(meta_info)
 
         prompts = self.rollout_sharding_manager.preprocess_data(prompts)
-        output = self.rollout.generate_sequences(prompts=prompts)
+        if prompts.meta_info.get("stream_reward", False) and self._stream_reward_fn is not None:
+            reward_refs = []
+            output = self.rollout.generate_sequences(
+                prompts=prompts,
+                completion_callback=partial(self._submit_stream_reward, prompts, reward_refs=reward_refs),
+                chunk_size=self.config.reward.stream_chunk_size,
+            )
+            ray.get(reward_refs)  # make sure all the scores are ready before the driver collects them
+        else:
+            output = self.rollout.generate_sequences(prompts=prompts)
+
         output = self.rollout_sharding_manager.postprocess_data(output)
 
         output = output.to("cpu")
@@ -613,7 +661,7 @@ class FSDPWorker(Worker):
         assert self._has_actor
 
         self._process_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_param_offload:
             load_fsdp_model(self.fsdp_module)
@@ -645,7 +693,7 @@ class FSDPWorker(Worker):
         assert self._has_ref
 
         self._process_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_ref_param_offload:
             load_fsdp_model(self.ref_fsdp_module)
@@ -673,7 +721,7 @@ class FSDPWorker(Worker):
         assert self._has_actor
 
         self._process_aug_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_param_offload:
             load_fsdp_model(self.fsdp_module)
@@ -701,7 +749,7 @@ class FSDPWorker(Worker):
         assert self._has_critic
 
         self._process_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_param_offload:
             load_fsdp_model(self.fsdp_module)
@@ -723,7 +771,7 @@ class FSDPWorker(Worker):
         assert self._has_critic
 
         self._process_multi_modal_inputs(data)
-        data = data.to(torch.cuda.current_device())
+        data = data.to(get_device_id())
 
         if self._use_param_offload:
             load_fsdp_model(self.fsdp_module)
@@ -763,3 +811,38 @@ class FSDPWorker(Worker):
 
         output = output.to("cpu")
         return output
+
+
+@register_rollout("vllm")
+def _build_vllm_rollout(worker: FSDPWorker) -> Tuple[BaseRollout, BaseShardingManager]:
+    from .rollout.vllm_rollout_spmd import vLLMRollout  # lazy import
+    from .sharding_manager.fsdp_vllm import FSDPVLLMShardingManager  # lazy import
+
+    tp_size = worker.config.rollout.tensor_parallel_size
+    dp_size = worker.world_size // tp_size
+    if worker.world_size % tp_size != 0:
+        raise ValueError(f"rollout world size {worker.world_size} is not divisible by tp size {tp_size}.")
+
+    rollout_device_mesh = init_device_mesh("cuda", mesh_shape=(dp_size, tp_size), mesh_dim_names=("dp", "tp"))
+    rollout = vLLMRollout(
+        model_path=worker.config.actor.model.model_path,
+        config=worker.config.rollout,
+        tokenizer=worker.tokenizer,
+        processor=worker.processor,
+        num_params=worker.num_actor_params,
+    )
+    rollout_sharding_manager = FSDPVLLMShardingManager(
+        module=worker.fsdp_module,
+        inference_engine=rollout.inference_engine,
+        device_mesh=rollout_device_mesh,
+        use_param_offload=worker._use_param_offload,
+        sync_bucket_size_mb=worker.config.rollout.sync_bucket_size_mb,
+        optimizer=worker.optimizer,
+    )
+    print_gpu_memory_usage("After vllm init")
+    return rollout, rollout_sharding_manager
+
+
+@register_rollout("stub")
+def _build_stub_rollout(worker: FSDPWorker) -> Tuple[BaseRollout, BaseShardingManager]:
+    return StubRollout(config=worker.config.rollout, tokenizer=worker.tokenizer), StubShardingManager()
@@ -13,7 +13,18 @@
 # limitations under the License.
 
 from .config import RewardConfig
-from .function import BatchFunctionRewardManager, FunctionRewardManager, SequentialFunctionRewardManager
+from .function import (
+    BatchFunctionRewardManager,
+    FunctionRewardManager,
+    SequentialFunctionRewardManager,
+    make_stream_reward_chunk,
+)
 
 
-__all__ = ["BatchFunctionRewardManager", "FunctionRewardManager", "RewardConfig", "SequentialFunctionRewardManager"]
+__all__ = [
+    "BatchFunctionRewardManager",
+    "FunctionRewardManager",
+    "RewardConfig",
+    "SequentialFunctionRewardManager",
+    "make_stream_reward_chunk",
+]
@@ -27,6 +27,10 @@ class RewardConfig:
     reward_function_kwargs: dict = field(default_factory=dict)
     skip_special_tokens: bool = True
     num_cpus: int = 1
+    stream_reward: bool = False
+    """score responses while the rest of the rollout batch is still generating"""
+    stream_chunk_size: int = 32
+    """number of finished prompts sent to the reward function at a time when streaming"""
     # below are auto keys
     reward_function_name: Optional[str] = field(default=None, init=False)
 
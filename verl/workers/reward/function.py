@@ -18,12 +18,13 @@ import sys
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from functools import partial
-from typing import Callable, Dict, List, Optional, Tuple, TypedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
 
 import torch
 from transformers import PreTrainedTokenizer
 
 from ...protocol import DataProto
+from ...utils import torch_functional as VF
 from .config import RewardConfig
 
 
@@ -44,6 +45,40 @@ SequentialRewardFunction = Callable[[RewardInput], RewardScore]
 BatchRewardFunction = Callable[[List[RewardInput]], List[RewardScore]]
 
 
+def _make_reward_tensor(data: DataProto, scores: List[RewardScore]) -> Tuple[torch.Tensor, Dict[str, List[float]]]:
+    """Put the overall scores at the last tokens of the responses and gather the scores as metrics."""
+    reward_tensor = torch.zeros_like(data.batch["responses"], dtype=torch.float32)
+    reward_metrics = defaultdict(list)
+    response_length = torch.sum(data.batch["response_mask"], dim=-1)
+    for i, score in enumerate(scores):
+        cur_response_length = int(response_length[i].item())  # avoid tensor indexing error
+        reward_tensor[i, cur_response_length - 1] = score["overall"]
+        for key, value in score.items():
+            reward_metrics[key].append(value)
+
+    return reward_tensor, reward_metrics
+
+
+def make_stream_reward_chunk(
+    prompts: DataProto, indices: List[int], outputs: List[Any], pad_token_id: int, response_length: int
+) -> DataProto:
+    """Build the responses of the finished prompts to score from their request outputs."""
+    response_ids, uids, sample_indices, ground_truths = [], [], [], []
+    for idx, output in zip(indices, outputs):
+        for sample_index, completion in enumerate(output.outputs):
+            response_ids.append(completion.token_ids)
+            uids.append(prompts.non_tensor_batch["uid"][idx])
+            sample_indices.append(sample_index)
+            ground_truths.append(prompts.non_tensor_batch["ground_truth"][idx])
+
+    responses = VF.pad_2d_list_to_length(response_ids, pad_token_id, max_length=response_length)
+    response_mask = VF.get_response_mask(responses, eos_token_id=prompts.meta_info["eos_token_id"])
+    return DataProto.from_dict(
+        tensors={"responses": responses, "response_mask": response_mask},
+        non_tensors={"uid": uids, "sample_index": sample_indices, "ground_truth": ground_truths},
+    )
+
+
 class FunctionRewardManager(ABC):
     """Reward manager for rule-based reward."""
 
@@ -70,19 +105,49 @@ class FunctionRewardManager(ABC):
         self.reward_fn = partial(reward_fn, **config.reward_function_kwargs)
         self.config = config
         self.tokenizer = tokenizer
+        self.stream_scores: Dict[Tuple[str, int], Dict[str, float]] = {}
 
     @abstractmethod
     def compute_reward(self, data: DataProto) -> Tuple[torch.Tensor, Dict[str, List[float]]]:
         """Compute reward for a batch of data."""
         ...
 
+    def compute_stream_reward(self, data: DataProto) -> None:
+        """Score a chunk of finished responses and keep the scores until they are collected.
+
+        Each sample is keyed by its `uid` and `sample_index` (the index among the n responses of a prompt).
+        """
+        _, reward_metrics = self.compute_reward(data)
+        uids = data.non_tensor_batch["uid"]
+        sample_indices = data.non_tensor_batch["sample_index"]
+        for i in range(len(data)):
+            self.stream_scores[(uids[i], int(sample_indices[i]))] = {
+                key: value[i] for key, value in reward_metrics.items()
+            }
+
+    def collect_stream_reward(self, data: DataProto) -> Tuple[torch.Tensor, Dict[str, List[float]]]:
+        """Gather the scores computed by `compute_stream_reward` in the order of the given batch.
+
+        The batch must keep the interleaved layout of the rollout, i.e. the responses of a prompt are contiguous.
+        """
+        scores = []
+        sample_counter = defaultdict(int)
+        for uid in data.non_tensor_batch["uid"]:
+            scores.append(self.stream_scores.pop((uid, sample_counter[uid])))
+            sample_counter[uid] += 1
+
+        return _make_reward_tensor(data, scores)
+
+    def clear_stream_reward(self) -> None:
+        """Drop the scores left by a generation that was not collected, e.g., the step failed."""
+        self.stream_scores.clear()
+
 
 class SequentialFunctionRewardManager(FunctionRewardManager):
     reward_fn: SequentialRewardFunction
 
     def compute_reward(self, data: DataProto) -> Tuple[torch.Tensor, Dict[str, List[float]]]:
-        reward_tensor = torch.zeros_like(data.batch["responses"], dtype=torch.float32)
-        reward_metrics = defaultdict(list)
+        scores = []
         response_ids = data.batch["responses"]
         response_length = torch.sum(data.batch["response_mask"], dim=-1)
         for i in range(len(data)):
@@ -98,11 +163,9 @@ class SequentialFunctionRewardManager(FunctionRewardManager):
                     "ground_truth": data.non_tensor_batch["ground_truth"][i],
                 }
             )
-            reward_tensor[i, cur_response_length - 1] = score["overall"]
-            for key, value in score.items():
-                reward_metrics[key].append(value)
+            scores.append(score)
 
-        return reward_tensor, reward_metrics
+        return _make_reward_tensor(data, scores)
 
 
 class BatchFunctionRewardManager(FunctionRewardManager):
@@ -127,12 +190,4 @@ class BatchFunctionRewardManager(FunctionRewardManager):
             )
 
         scores = self.reward_fn(reward_inputs)
-        reward_tensor = torch.zeros_like(data.batch["responses"], dtype=torch.float32)
-        reward_metrics = defaultdict(list)
-        for i, score in enumerate(scores):
-            cur_response_length = int(response_length[i].item())  # avoid tensor indexing error
-            reward_tensor[i, cur_response_length - 1] = score["overall"]
-            for key, value in score.items():
-                reward_metrics[key].append(value)
-
-        return reward_tensor, reward_metrics
+        return _make_reward_tensor(data, scores)
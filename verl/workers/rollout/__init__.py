@@ -12,9 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-
+from ...utils.py_functional import is_package_available
+from .base import BaseRollout
 from .config import RolloutConfig
-from .vllm_rollout_spmd import vLLMRollout
+from .registry import get_registered_rollouts, get_rollout_builder, register_rollout
+from .stub_rollout import StubRollout
+
+
+__all__ = [
+    "BaseRollout",
+    "RolloutConfig",
+    "StubRollout",
+    "get_registered_rollouts",
+    "get_rollout_builder",
+    "register_rollout",
+]
+
 
+if is_package_available("vllm"):
+    from .vllm_rollout_spmd import vLLMRollout
 
-__all__ = ["RolloutConfig", "vLLMRollout"]
+    __all__ += ["vLLMRollout"]
@@ -13,6 +13,11 @@
 # limitations under the License.
 
 from abc import ABC, abstractmethod
+from typing import Dict, List, Union
+
+import numpy as np
+import torch
+from tensordict import TensorDict
 
 from ...protocol import DataProto
 
@@ -20,8 +25,75 @@ from ...protocol import DataProto
 __all__ = ["BaseRollout"]
 
 
+def _repeat_interleave_into(value: torch.Tensor, repeats: int, out: torch.Tensor) -> None:
+    # write each row `repeats` times into `out` through a broadcast view, `out` may be a slice of a larger buffer
+    out.view(value.size(0), repeats, *out.shape[1:]).copy_(value.unsqueeze(1).expand(-1, repeats, *value.shape[1:]))
+
+
+def _get_response_length(response_ids: np.ndarray, eos_token_id: Union[int, List[int]]) -> np.ndarray:
+    # the responses are valid up to the first eos token (inclusive), same as `VF.get_response_mask`
+    is_eos = np.isin(response_ids, eos_token_id)
+    return np.where(is_eos.any(axis=-1), is_eos.argmax(axis=-1) + 1, response_ids.shape[-1])
+
+
 class BaseRollout(ABC):
     @abstractmethod
     def generate_sequences(self, prompts: DataProto) -> DataProto:
         """Generate sequences"""
         pass
+
+    def get_prefix_cache_stats(self) -> Dict[str, int]:
+        """Get the number of prompt tokens and the prompt tokens hit in the prefix cache since the last call."""
+        return {"num_prompt_tokens": 0, "num_cached_tokens": 0}
+
+    def get_suggested_memory_metrics(self, free_bytes: int, total_bytes: int, weight_bytes: int) -> Dict[str, float]:
+        """Suggest a memory plan by the measured memory as metrics only, rollouts without kv cache skip it."""
+        return {}
+
+    def _make_batch(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        position_ids: torch.Tensor,
+        response_ids: np.ndarray,
+        eos_token_id: Union[int, List[int]],
+        repeat_times: int,
+    ) -> TensorDict:
+        """Concatenate the left-padded prompts and the right-padded responses of `repeat_times` samples per prompt."""
+        response_length = torch.from_numpy(_get_response_length(response_ids, eos_token_id))
+
+        # write the prompts and responses into the full sequences directly, the repeated prompts are never materialized
+        batch_size = input_ids.size(0) * repeat_times
+        prompt_length, max_response_length = input_ids.size(-1), response_ids.shape[-1]
+        sequence_ids = input_ids.new_empty((batch_size, prompt_length + max_response_length))
+        _repeat_interleave_into(input_ids, repeat_times, sequence_ids[:, :prompt_length])
+        sequence_ids[:, prompt_length:] = torch.from_numpy(response_ids)
+
+        # prompt: left pad + response: right pad
+        # attention_mask: [0,0,0,0,1,1,1,1 | 1,1,1,0,0,0,0,0]
+        # position_ids:   [0,0,0,0,0,1,2,3 | 4,5,6,7,8,9,10,11]
+        # the response mask and the response position ids are both built from the same offsets
+        delta_position_id = torch.arange(1, max_response_length + 1, dtype=position_ids.dtype)
+        full_attention_mask = attention_mask.new_empty((batch_size, prompt_length + max_response_length))
+        _repeat_interleave_into(attention_mask, repeat_times, full_attention_mask[:, :prompt_length])
+        full_attention_mask[:, prompt_length:] = delta_position_id <= response_length.unsqueeze(-1)
+
+        # (bs, seqlen) or (bs, 3, seqlen) for qwen2vl mrope
+        position_shape = (batch_size, *position_ids.shape[1:-1], prompt_length + max_response_length)
+        full_position_ids = position_ids.new_empty(position_shape)
+        _repeat_interleave_into(position_ids, repeat_times, full_position_ids[..., :prompt_length])
+        last_prompt_position_ids = full_position_ids[..., prompt_length - 1 : prompt_length]
+        full_position_ids[..., prompt_length:] = last_prompt_position_ids + delta_position_id.to(position_ids.device)
+
+        # all the tp ranks should contain the same data here. data in all ranks are valid
+        return TensorDict(
+            {
+                "prompts": sequence_ids[:, :prompt_length],
+                "responses": sequence_ids[:, prompt_length:],
+                "input_ids": sequence_ids,  # here input_ids become the whole sentences
+                "attention_mask": full_attention_mask,
+                "response_mask": full_attention_mask[:, prompt_length:],
+                "position_ids": full_position_ids,
+            },
+            batch_size=batch_size,
+        )
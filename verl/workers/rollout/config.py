@@ -21,7 +21,7 @@ from typing import Any, Dict, Optional
 
 @dataclass
 class RolloutConfig:
-    name: str = "vllm"
+    name: str = "vllm"  # a registered rollout, `vllm` or `stub` (random responses on cpu, for the training loop)
     n: int = 1
     temperature: float = 1.0
     top_p: float = 1.0
@@ -30,14 +30,24 @@ class RolloutConfig:
     limit_images: int = 0
     dtype: str = "bf16"
     gpu_memory_utilization: float = 0.6
+    auto_gpu_memory_utilization: bool = False  # plan the kv cache at init, later plans are suggested in metrics
+    memory_reserved_gb: float = 2.0  # memory of the activations and cuda graphs when planning the kv cache
     ignore_eos: bool = False
     enforce_eager: bool = False
     enable_chunked_prefill: bool = False  # only for v0 engine
+    enable_prefix_caching: bool = False  # also caches the multimodal inputs, the kv cache is reset after weight sync
     tensor_parallel_size: int = 2
     max_model_len: Optional[int] = None
     max_num_batched_tokens: int = 8192
     disable_log_stats: bool = True
     disable_tqdm: bool = False
+    sync_bucket_size_mb: int = 512  # size of the weight buckets synced from fsdp to vllm
+    partial_rollout_ratio: float = 1.0  # stop once this fraction of the samples finished, the rest resume next step
+    partial_rollout_token_budget: int = -1  # stop once a rank generated this many tokens, -1 means no limit
+    sort_by_predicted_length: bool = False  # submit the longest predicted responses first, balanced across ranks
+    stub_response_length_mean: float = 0.5  # response length of the stub rollout, relative to response_length
+    stub_response_length_std: float = 0.25
+    stub_tokens_per_second: float = 0.0  # simulated decoding speed of the stub rollout, 0 means no delay
     val_override_config: Dict[str, Any] = field(default_factory=dict)
     # below are auto keys
     prompt_length: int = field(default=-1, init=False)
@@ -0,0 +1,110 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Memory planning of the rollout engine, it only depends on the measured numbers so it runs without gpus.
+"""
+
+import math
+from dataclasses import asdict, dataclass
+from typing import Dict
+
+from transformers import PretrainedConfig
+
+
+@dataclass
+class RolloutMemoryPlan:
+    gpu_memory_utilization: float
+    num_kv_cache_blocks: int
+    max_num_seqs: int
+    max_num_batched_tokens: int
+
+    def to_metrics(self, prefix: str = "rollout_memory") -> Dict[str, float]:
+        return {f"{prefix}/{key}": value for key, value in asdict(self).items()}
+
+
+def plan_rollout_memory(
+    free_bytes: int,
+    total_bytes: int,
+    weight_bytes: int,
+    kv_cache_bytes_per_token: int,
+    block_size: int,
+    max_prompt_length: int,
+    max_sequence_length: int,
+    max_concurrency: int = 0,
+    max_num_batched_tokens: int = 8192,
+    reserved_bytes: int = 2 * 1024**3,
+    max_gpu_memory_utilization: float = 0.9,
+) -> RolloutMemoryPlan:
+    """Plan the kv cache and the scheduler limits of the rollout engine by the free memory.
+
+    Args:
+        free_bytes: the free gpu memory after the actor is offloaded, before the engine weights are loaded
+        total_bytes: the total gpu memory
+        weight_bytes: the memory of the engine weights
+        kv_cache_bytes_per_token: the kv cache size of a token on this rank
+        block_size: the number of tokens in a kv cache block
+        max_prompt_length: the max number of prompt tokens of a sequence
+        max_sequence_length: the max number of prompt and response tokens of a sequence
+        max_concurrency: the max number of sequences generated at the same time, 0 means unknown
+        max_num_batched_tokens: the upper bound of the tokens scheduled in an engine step
+        reserved_bytes: the memory of the activations and the cuda graphs of the engine
+        max_gpu_memory_utilization: the upper bound of the planned gpu memory utilization
+
+    Returns:
+        the smallest kv cache that serves `max_concurrency` sequences without preemption, bounded by the free memory
+    """
+    available_bytes = min(free_bytes, int(max_gpu_memory_utilization * total_bytes))
+    block_bytes = kv_cache_bytes_per_token * block_size
+    blocks_per_sequence = math.ceil(max_sequence_length / block_size)
+    max_num_blocks = (available_bytes - weight_bytes - reserved_bytes) // block_bytes
+    if max_num_blocks < blocks_per_sequence:
+        raise ValueError(
+            f"Free memory {free_bytes / (1024**3):.2f} GB cannot hold a sequence of {max_sequence_length} tokens."
+        )
+
+    if max_concurrency > 0:
+        num_blocks = min(max_num_blocks, max_concurrency * blocks_per_sequence)
+    else:
+        num_blocks = max_num_blocks
+
+    max_num_seqs = num_blocks // blocks_per_sequence
+    # prefill all the running sequences in as few steps as possible, a step must fit the longest sequence
+    num_batched_tokens = min(max_num_seqs * max_prompt_length, max_num_batched_tokens, num_blocks * block_size)
+    num_batched_tokens = max(num_batched_tokens, max_sequence_length)
+    gpu_memory_utilization = (weight_bytes + reserved_bytes + num_blocks * block_bytes) / total_bytes
+    return RolloutMemoryPlan(
+        gpu_memory_utilization=gpu_memory_utilization,
+        num_kv_cache_blocks=num_blocks,
+        max_num_seqs=max_num_seqs,
+        max_num_batched_tokens=num_batched_tokens,
+    )
+
+
+def estimate_weight_bytes(
+    num_params: int, dtype_size: int, tensor_parallel_size: int, margin_ratio: float = 0.1
+) -> int:
+    """Estimate the memory of the engine weights on a tensor parallel rank before they are loaded.
+
+    The margin covers the replicated parameters (e.g., the norms) and the allocator rounding.
+    """
+    return math.ceil(num_params * dtype_size / tensor_parallel_size * (1.0 + margin_ratio))
+
+
+def get_kv_cache_bytes_per_token(model_config: PretrainedConfig, dtype_size: int, tensor_parallel_size: int) -> int:
+    """Get the kv cache size of a token on a tensor parallel rank."""
+    text_config = model_config.get_text_config()
+    num_kv_heads = getattr(text_config, "num_key_value_heads", None) or text_config.num_attention_heads
+    head_dim = getattr(text_config, "head_dim", None) or text_config.hidden_size // text_config.num_attention_heads
+    num_kv_heads = max(num_kv_heads // tensor_parallel_size, 1)  # the kv heads are replicated if tp > num_kv_heads
+    return 2 * text_config.num_hidden_layers * num_kv_heads * head_dim * dtype_size
@@ -0,0 +1,53 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The registry of the rollouts selected by `config.worker.rollout.name`. A builder creates the rollout and its sharding
+manager from the worker, it is registered when its module is imported in the worker process.
+"""
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+from .base import BaseRollout
+
+
+if TYPE_CHECKING:
+    from ..sharding_manager import BaseShardingManager
+
+
+RolloutBuilder = Callable[..., Tuple[BaseRollout, "BaseShardingManager"]]
+_ROLLOUT_BUILDERS: Dict[str, RolloutBuilder] = {}
+
+
+def register_rollout(name: str) -> Callable[[RolloutBuilder], RolloutBuilder]:
+    """Registers a builder, which takes the worker and returns the rollout and its sharding manager."""
+
+    def decorator(builder: RolloutBuilder) -> RolloutBuilder:
+        if name in _ROLLOUT_BUILDERS:
+            raise ValueError(f"Rollout {name} is already registered.")
+
+        _ROLLOUT_BUILDERS[name] = builder
+        return builder
+
+    return decorator
+
+
+def get_rollout_builder(name: str) -> RolloutBuilder:
+    if name not in _ROLLOUT_BUILDERS:
+        raise ValueError(f"Unknown rollout {name}, the registered rollouts are {get_registered_rollouts()}.")
+
+    return _ROLLOUT_BUILDERS[name]
+
+
+def get_registered_rollouts() -> List[str]:
+    return sorted(_ROLLOUT_BUILDERS.keys())
@@ -0,0 +1,209 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import PreTrainedTokenizer
+
+from ...protocol import DataProto
+from .base import BaseRollout
+from .config import RolloutConfig
+
+
+STUB_BLOCK_SIZE = 16  # the kv cache block size of vllm
+
+
+@dataclass
+class StubCompletionOutput:
+    token_ids: List[int]
+
+
+@dataclass
+class StubRequestOutput:
+    """The fields of vllm's RequestOutput read by the completion callback."""
+
+    outputs: List[StubCompletionOutput]
+
+
+class StubRollout(BaseRollout):
+    def __init__(self, config: RolloutConfig, tokenizer: PreTrainedTokenizer):
+        """A stub rollout that samples random responses on cpu without any model.
+
+        The response lengths follow a clipped normal distribution, and the generation sleeps as if the tokens were
+        decoded at `stub_tokens_per_second`. It is deterministic given the seed, so the training loop can be
+        exercised and benchmarked without vllm. With a `completion_callback`, the finished prompts are called back
+        in chunks as the vllm rollout streams them. With `enable_prefix_caching`, the n samples of a prompt share
+        the full kv cache blocks of the prompt, as the prefix cache of vllm. With `partial_response_ids`, the samples
+        continue from their partial responses and stop early as the partial rollout of vllm.
+
+        Args:
+            config: rollout config
+            tokenizer: the task/model tokenizer
+        """
+        super().__init__()
+        self.config = config
+        self.pad_token_id = tokenizer.pad_token_id
+        # the added tokens and the special tokens are never sampled, like a model generating plain text
+        self.token_ids = np.setdiff1d(np.arange(tokenizer.vocab_size), tokenizer.all_special_ids)
+        self.num_generations = 0
+        self.num_prompt_tokens = 0
+        self.num_cached_tokens = 0
+
+    def get_prefix_cache_stats(self) -> Dict[str, int]:
+        stats = {"num_prompt_tokens": self.num_prompt_tokens, "num_cached_tokens": self.num_cached_tokens}
+        self.num_prompt_tokens = 0
+        self.num_cached_tokens = 0
+        return stats
+
+    def _stream_completions(
+        self,
+        response_ids: np.ndarray,
+        lengths: np.ndarray,
+        repeat_times: int,
+        completion_callback: Callable[[List[int], List[StubRequestOutput]], None],
+        chunk_size: int,
+    ) -> None:
+        """Call back every `chunk_size` prompts at the time their last samples finish.
+
+        All the samples are decoded concurrently, so a prompt finishes once the tokens of all the samples up to the
+        length of its longest sample are decoded.
+        """
+        prompt_lengths = lengths.reshape(-1, repeat_times).max(axis=-1)
+        sorted_lengths = np.sort(lengths)
+        cumsum_lengths = np.concatenate([[0], np.cumsum(sorted_lengths)])
+        num_shorter = np.searchsorted(sorted_lengths, prompt_lengths, side="right")
+        finish_tokens = cumsum_lengths[num_shorter] + prompt_lengths * (len(lengths) - num_shorter)
+        finish_order = np.argsort(finish_tokens, kind="stable").tolist()
+        start_time = time.perf_counter()
+        for start in range(0, len(finish_order), chunk_size):
+            indices = finish_order[start : start + chunk_size]
+            if self.config.stub_tokens_per_second > 0:
+                finish_time = start_time + finish_tokens[indices[-1]] / self.config.stub_tokens_per_second
+                time.sleep(max(0.0, finish_time - time.perf_counter()))
+
+            outputs = []
+            for idx in indices:
+                rows = range(idx * repeat_times, (idx + 1) * repeat_times)
+                outputs.append(
+                    StubRequestOutput(
+                        [StubCompletionOutput(response_ids[row, : lengths[row]].tolist()) for row in rows]
+                    )
+                )
+
+            completion_callback(indices, outputs)
+
+    def _stop_partial(self, remaining_lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Stop once enough samples finished or the token budget is used up, all the samples decode concurrently.
+
+        Returns the number of tokens generated for each sample, and the tokens decoded in the batch when it stopped.
+        """
+        sorted_lengths = np.sort(remaining_lengths)
+        cumsum_lengths = np.concatenate([[0], np.cumsum(sorted_lengths)])
+        steps = np.arange(1, sorted_lengths[-1] + 1)
+        num_shorter = np.searchsorted(sorted_lengths, steps, side="right")
+        decoded_tokens = cumsum_lengths[num_shorter] + steps * (len(sorted_lengths) - num_shorter)  # after each step
+        num_finish_target = max(math.ceil(self.config.partial_rollout_ratio * len(remaining_lengths)), 1)
+        stop_step = sorted_lengths[num_finish_target - 1]
+        token_budget = self.config.partial_rollout_token_budget
+        if token_budget > 0 and decoded_tokens[-1] >= token_budget:
+            stop_step = min(stop_step, steps[np.argmax(decoded_tokens >= token_budget)])
+
+        generated_lengths = np.minimum(remaining_lengths, stop_step)
+        return generated_lengths, decoded_tokens[generated_lengths - 1]
+
+    @torch.no_grad()
+    def generate_sequences(
+        self, prompts: DataProto, completion_callback: Optional[Callable] = None, chunk_size: int = 1
+    ) -> DataProto:
+        batch_partial_response_ids = prompts.non_tensor_batch.pop("partial_response_ids", None)
+        input_ids: torch.Tensor = prompts.batch["input_ids"]  # (bs, prompt_length)
+        eos_token_id = prompts.meta_info["eos_token_id"]
+        repeat_times = prompts.meta_info.get("n", self.config.n)
+        num_responses = input_ids.size(0) * repeat_times
+        response_length = self.config.response_length
+
+        # the random states only depend on the seed and the number of generations, same on all the tp ranks
+        rng = np.random.default_rng((self.config.seed, self.num_generations))
+        self.num_generations += 1
+        lengths = rng.normal(
+            self.config.stub_response_length_mean * response_length,
+            self.config.stub_response_length_std * response_length,
+            size=num_responses,
+        )
+        lengths = np.clip(np.round(lengths), 1, response_length).astype(np.int64)
+        finished = np.ones(num_responses, dtype=bool)
+        if batch_partial_response_ids is not None:  # each prompt is a single sample, which is longer than its part
+            partial_lengths = np.array([len(ids) for ids in batch_partial_response_ids], dtype=np.int64)
+            lengths = np.clip(lengths, partial_lengths + 1, response_length)
+            generated_lengths, finish_tokens = self._stop_partial(lengths - partial_lengths)
+            finished = partial_lengths + generated_lengths == lengths
+            lengths = partial_lengths + generated_lengths
+
+        eos_token_ids = np.atleast_1d(eos_token_id)
+        token_ids = self.token_ids[~np.isin(self.token_ids, eos_token_ids)].astype(np.int32)
+        response_ids = token_ids[rng.integers(0, len(token_ids), size=(num_responses, response_length))]
+        response_ids[np.arange(response_length) >= lengths[:, None]] = self.pad_token_id
+        is_stopped = finished & (lengths < response_length)  # the responses not truncated end with an eos token
+        response_ids[is_stopped, lengths[is_stopped] - 1] = eos_token_ids[0]
+        if batch_partial_response_ids is not None:
+            for idx, partial_response_ids in enumerate(batch_partial_response_ids):
+                response_ids[idx, : len(partial_response_ids)] = partial_response_ids
+
+        prompt_lengths = prompts.batch["attention_mask"].sum(-1)
+        self.num_prompt_tokens += int(prompt_lengths.sum()) * repeat_times
+        if batch_partial_response_ids is not None:  # the partial responses are prefilled as the prompts
+            self.num_prompt_tokens += int(partial_lengths.sum())
+        if self.config.enable_prefix_caching:  # the first sample prefills the prompt, only full blocks are cached
+            cached_lengths = prompt_lengths // STUB_BLOCK_SIZE * STUB_BLOCK_SIZE
+            self.num_cached_tokens += int(cached_lengths.sum()) * (repeat_times - 1)
+
+        if batch_partial_response_ids is not None:
+            tokens_per_second = self.config.stub_tokens_per_second
+            finish_time = finish_tokens / tokens_per_second if tokens_per_second > 0 else np.zeros(len(lengths))
+            time.sleep(finish_time.max())
+        elif completion_callback is not None:
+            self._stream_completions(response_ids, lengths, repeat_times, completion_callback, chunk_size)
+        elif self.config.stub_tokens_per_second > 0:
+            time.sleep(lengths.sum() / self.config.stub_tokens_per_second)
+
+        non_tensor_batch = prompts.non_tensor_batch
+        non_tensor_batch.pop("raw_prompt_ids")
+        batch_multi_modal_data = non_tensor_batch.pop("multi_modal_data", None)
+        batch = self._make_batch(
+            input_ids,
+            prompts.batch["attention_mask"],
+            prompts.batch["position_ids"],
+            response_ids,
+            eos_token_id,
+            repeat_times,
+        )
+        if batch_multi_modal_data is not None:
+            non_tensor_batch = {"multi_modal_data": np.repeat(batch_multi_modal_data, repeat_times, axis=0)}
+        else:
+            non_tensor_batch = {}
+
+        if batch_partial_response_ids is not None:
+            non_tensor_batch["partial_response_ids"] = np.empty(num_responses, dtype=object)
+            for idx in range(num_responses):  # avoid stacking equal-length arrays
+                non_tensor_batch["partial_response_ids"][idx] = response_ids[idx, : lengths[idx]].astype(np.int64)
+
+            non_tensor_batch["finished"] = finished
+            non_tensor_batch["finish_time"] = finish_time
+
+        return DataProto(batch=batch, non_tensor_batch=non_tensor_batch, meta_info=prompts.meta_info)
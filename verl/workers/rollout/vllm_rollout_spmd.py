@@ -12,15 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
 import os
+import time
 from contextlib import contextmanager
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
 import torch.distributed
-from tensordict import TensorDict
-from transformers import PreTrainedTokenizer, ProcessorMixin
+from transformers import AutoConfig, PreTrainedTokenizer, ProcessorMixin
 from vllm import LLM, RequestOutput, SamplingParams
 
 from ...protocol import DataProto
@@ -29,6 +30,7 @@ from ...utils.dataset import process_image, process_video
 from ...utils.torch_dtypes import PrecisionType
 from .base import BaseRollout
 from .config import RolloutConfig
+from .memory import RolloutMemoryPlan, estimate_weight_bytes, get_kv_cache_bytes_per_token, plan_rollout_memory
 
 
 def _repeat_interleave(value: Union[torch.Tensor, np.ndarray], repeats: int) -> Union[torch.Tensor, np.ndarray]:
@@ -71,6 +73,22 @@ def _process_multi_modal_data(
     return None
 
 
+def _get_num_running_seqs(llm_engine: Any) -> int:
+    """Count the sequences in the running queue of the engine scheduler, 0 if the scheduler is not in this process."""
+    if hasattr(llm_engine, "scheduler"):  # v0 engine, a sequence group holds the n samples of a prompt
+        return sum(
+            seq_group.get_max_num_running_seqs()
+            for scheduler in llm_engine.scheduler
+            for seq_group in scheduler.running
+        )
+
+    engine_core = getattr(llm_engine.engine_core, "engine_core", None)  # v1 engine, each sample is a request
+    if engine_core is not None:
+        return len(engine_core.scheduler.running)
+
+    return 0
+
+
 class vLLMRollout(BaseRollout):
     def __init__(
         self,
@@ -78,6 +96,7 @@ class vLLMRollout(BaseRollout):
         config: RolloutConfig,
         tokenizer: PreTrainedTokenizer,
         processor: Optional[ProcessorMixin],
+        num_params: int = 0,
     ):
         """A vLLM rollout. It requires the module is supported by the vllm.
 
@@ -85,6 +104,7 @@ class vLLMRollout(BaseRollout):
             module: module here follows huggingface APIs
             config: DictConfig
             tokenizer: the task/model tokenizer
+            num_params: the number of model parameters, required to plan the memory before the engine is built
         """
         super().__init__()
         self.rank = int(os.getenv("RANK", "0"))
@@ -97,9 +117,29 @@ class vLLMRollout(BaseRollout):
         if config.max_num_batched_tokens < config.prompt_length + config.response_length:
             raise ValueError("max_num_batched_tokens should be greater than prompt_length + response_length.")
 
+        dtype_size = PrecisionType.to_dtype(config.dtype).itemsize
+        self.kv_cache_bytes_per_token = get_kv_cache_bytes_per_token(
+            AutoConfig.from_pretrained(model_path, trust_remote_code=config.trust_remote_code),
+            dtype_size,
+            config.tensor_parallel_size,
+        )
+        self.max_concurrency = 0
+        gpu_memory_utilization = config.gpu_memory_utilization
+        max_num_batched_tokens = config.max_num_batched_tokens
+        if config.auto_gpu_memory_utilization:  # the engine weights are not loaded yet, estimate them
+            if num_params <= 0:
+                raise ValueError("num_params is required to plan the rollout memory.")
+
+            weight_bytes = estimate_weight_bytes(num_params, dtype_size, config.tensor_parallel_size)
+            free_bytes, total_bytes = torch.cuda.mem_get_info()
+            plan = self._plan_memory(free_bytes, total_bytes, weight_bytes=weight_bytes, block_size=16)
+            gpu_memory_utilization = plan.gpu_memory_utilization
+            max_num_batched_tokens = plan.max_num_batched_tokens
+            print(f"Rollout memory plan: {plan}.")
+
         engine_kwargs = {}
         if processor is not None:  # only VLMs have processor
-            engine_kwargs["disable_mm_preprocessor_cache"] = True
+            engine_kwargs["disable_mm_preprocessor_cache"] = not config.enable_prefix_caching
             if config.limit_images:
                 engine_kwargs["limit_mm_per_prompt"] = {"image": config.limit_images}
 
@@ -113,12 +153,13 @@ class vLLMRollout(BaseRollout):
             max_model_len=config.max_model_len or config.prompt_length + config.response_length,
             distributed_executor_backend="external_launcher",
             tensor_parallel_size=config.tensor_parallel_size,
-            gpu_memory_utilization=config.gpu_memory_utilization,
-            max_num_batched_tokens=config.max_num_batched_tokens,
+            gpu_memory_utilization=gpu_memory_utilization,
+            max_num_batched_tokens=max_num_batched_tokens,
             disable_log_stats=config.disable_log_stats,
             enforce_eager=config.enforce_eager,
             disable_custom_all_reduce=True,
             enable_chunked_prefill=config.enable_chunked_prefill,
+            enable_prefix_caching=config.enable_prefix_caching,
             enable_sleep_mode=True,
             **engine_kwargs,
         )
@@ -138,6 +179,8 @@ class vLLMRollout(BaseRollout):
 
         print(f"Sampling params: {sampling_kwargs}.")
         self.sampling_params = SamplingParams(**sampling_kwargs)
+        self.num_prompt_tokens = 0
+        self.num_cached_tokens = 0
 
     @contextmanager
     def update_sampling_params(self, **kwargs):
@@ -155,8 +198,153 @@ class vLLMRollout(BaseRollout):
         for key, value in old_sampling_params_args.items():
             setattr(self.sampling_params, key, value)
 
+    def _plan_memory(
+        self, free_bytes: int, total_bytes: int, weight_bytes: int, block_size: int, max_concurrency: int = 0
+    ) -> RolloutMemoryPlan:
+        return plan_rollout_memory(
+            free_bytes=free_bytes,
+            total_bytes=total_bytes,
+            weight_bytes=weight_bytes,
+            kv_cache_bytes_per_token=self.kv_cache_bytes_per_token,
+            block_size=block_size,
+            max_prompt_length=self.config.prompt_length,
+            max_sequence_length=self.config.prompt_length + self.config.response_length,
+            max_concurrency=max_concurrency,
+            max_num_batched_tokens=self.config.max_num_batched_tokens,
+            reserved_bytes=int(self.config.memory_reserved_gb * 1024**3),
+            max_gpu_memory_utilization=self.config.gpu_memory_utilization,
+        )
+
+    def get_suggested_memory_metrics(self, free_bytes: int, total_bytes: int, weight_bytes: int) -> Dict[str, float]:
+        cache_config = self.inference_engine.llm_engine.vllm_config.cache_config
+        max_concurrency, self.max_concurrency = self.max_concurrency, 0
+        try:  # only suggest a plan by the peak concurrency of the last generation, the kv cache is fixed at init
+            plan = self._plan_memory(free_bytes, total_bytes, weight_bytes, cache_config.block_size, max_concurrency)
+        except ValueError as e:
+            print(f"Cannot plan the rollout memory: {e}")
+            return {}
+
+        metrics = plan.to_metrics(prefix="rollout_memory_suggested")
+        metrics["rollout_memory/max_concurrency"] = max_concurrency
+        metrics["rollout_memory/num_kv_cache_blocks_allocated"] = cache_config.num_gpu_blocks or 0
+        metrics["rollout_memory/free_gb"] = free_bytes / (1024**3)
+        return metrics
+
+    def get_prefix_cache_stats(self) -> Dict[str, int]:
+        stats = {"num_prompt_tokens": self.num_prompt_tokens, "num_cached_tokens": self.num_cached_tokens}
+        self.num_prompt_tokens = 0
+        self.num_cached_tokens = 0
+        return stats
+
+    def _step(self, llm_engine: Any) -> List[RequestOutput]:
+        """Step the engine and record the peak number of running sequences for the memory plan."""
+        outputs = llm_engine.step()
+        self.max_concurrency = max(self.max_concurrency, _get_num_running_seqs(llm_engine))
+        return outputs
+
+    def _generate_streaming(
+        self,
+        vllm_inputs: List[Dict[str, Any]],
+        request_order: List[int],
+        completion_callback: Optional[Callable[[List[int], List[RequestOutput]], None]],
+        chunk_size: int,
+    ) -> List[RequestOutput]:
+        """Step the engine manually and report finished requests in chunks as soon as they complete.
+
+        The requests are added in `request_order`, the returned outputs keep the order of `vllm_inputs`.
+        Without `completion_callback`, the engine is only stepped to measure the concurrency.
+        """
+        llm_engine = self.inference_engine.llm_engine
+        request_prefix = f"stream-{next(self.inference_engine.request_counter)}-"
+        for idx in request_order:
+            llm_engine.add_request(f"{request_prefix}{idx}", vllm_inputs[idx], self.sampling_params)
+
+        completions: List[Optional[RequestOutput]] = [None] * len(vllm_inputs)
+        finished_indices, finished_outputs = [], []
+        while llm_engine.has_unfinished_requests():
+            for output in self._step(llm_engine):
+                if not output.finished:
+                    continue
+
+                idx = int(output.request_id[len(request_prefix) :])
+                completions[idx] = output
+                finished_indices.append(idx)
+                finished_outputs.append(output)
+
+            if completion_callback is not None and len(finished_indices) >= chunk_size:
+                completion_callback(finished_indices, finished_outputs)
+                finished_indices, finished_outputs = [], []
+
+        if completion_callback is not None and len(finished_indices) != 0:
+            completion_callback(finished_indices, finished_outputs)
+
+        return completions
+
+    def _generate_partial(
+        self, vllm_inputs: List[Dict[str, Any]], request_order: List[int], max_tokens: List[int]
+    ) -> Tuple[List[Optional[RequestOutput]], np.ndarray, np.ndarray]:
+        """Step the engine manually and stop once enough requests finished or the token budget is used up.
+
+        Each input is a single sample. The unfinished requests are aborted, their outputs hold the tokens generated
+        so far, or None if no token was generated. Returns the outputs, the finished flags and the finish times.
+        """
+        llm_engine = self.inference_engine.llm_engine
+        request_prefix = f"partial-{next(self.inference_engine.request_counter)}-"
+        for idx in request_order:
+            sampling_params = self.sampling_params.clone()
+            sampling_params.max_tokens = max_tokens[idx]
+            if sampling_params.seed is not None:  # the samples of a prompt are separate requests
+                sampling_params.seed += idx
+
+            llm_engine.add_request(f"{request_prefix}{idx}", vllm_inputs[idx], sampling_params)
+
+        num_finish_target = math.ceil(self.config.partial_rollout_ratio * len(vllm_inputs))
+        token_budget = self.config.partial_rollout_token_budget
+        completions: List[Optional[RequestOutput]] = [None] * len(vllm_inputs)
+        finished = np.zeros(len(vllm_inputs), dtype=bool)
+        finish_time = np.zeros(len(vllm_inputs), dtype=np.float64)
+        num_generated_tokens, start_time = 0, time.perf_counter()
+        while llm_engine.has_unfinished_requests():
+            for output in self._step(llm_engine):
+                idx = int(output.request_id[len(request_prefix) :])
+                if completions[idx] is not None:  # the outputs are cumulative
+                    num_generated_tokens -= len(completions[idx].outputs[0].token_ids)
+
+                num_generated_tokens += len(output.outputs[0].token_ids)
+                completions[idx] = output
+                if output.finished:
+                    finished[idx] = True
+                    finish_time[idx] = time.perf_counter() - start_time
+
+            if finished.sum() >= num_finish_target or (token_budget > 0 and num_generated_tokens >= token_budget):
+                break
+
+        unfinished_indices = np.flatnonzero(~finished)
+        if len(unfinished_indices) != 0:
+            llm_engine.abort_request([f"{request_prefix}{idx}" for idx in unfinished_indices])
+            finish_time[unfinished_indices] = time.perf_counter() - start_time
+
+        return completions, finished, finish_time
+
     @torch.no_grad()
-    def generate_sequences(self, prompts: DataProto) -> DataProto:
+    def generate_sequences(
+        self,
+        prompts: DataProto,
+        completion_callback: Optional[Callable[[List[int], List[RequestOutput]], None]] = None,
+        chunk_size: int = 1,
+    ) -> DataProto:
+        """Generate responses for the prompts.
+
+        If `completion_callback` is given, it is called with the indices and outputs of every `chunk_size`
+        finished prompts while the rest of the batch is still decoding.
+
+        If the prompts contain `predicted_response_length`, the prompts with the longest predicted responses are
+        submitted first, so that they do not stretch the tail of the generation.
+
+        If the prompts contain `partial_response_ids`, each prompt is a single sample that continues from its partial
+        response, and the generation stops early in the partial rollout mode. The returned partial responses and
+        `finished` flags tell which samples should be resumed in the next generation.
+        """
         # left-padded attention_mask
         input_ids: torch.Tensor = prompts.batch["input_ids"]  # (bs, prompt_length)
         attention_mask: torch.Tensor = prompts.batch["attention_mask"]
@@ -167,6 +355,8 @@ class vLLMRollout(BaseRollout):
         non_tensor_batch = prompts.non_tensor_batch
         batch_raw_prompt_ids = non_tensor_batch.pop("raw_prompt_ids")
         batch_multi_modal_data = non_tensor_batch.pop("multi_modal_data", None)
+        batch_partial_response_ids = non_tensor_batch.pop("partial_response_ids", None)
+        batch_predicted_length = non_tensor_batch.pop("predicted_response_length", None)
         if batch_size != len(batch_raw_prompt_ids):
             raise RuntimeError("vllm sharding manager is not work properly.")
 
@@ -187,56 +377,70 @@ class vLLMRollout(BaseRollout):
         else:
             vllm_inputs = [{"prompt_token_ids": list(raw_prompt_ids)} for raw_prompt_ids in batch_raw_prompt_ids]
 
+        if batch_partial_response_ids is not None:
+            for vllm_input, partial_response_ids in zip(vllm_inputs, batch_partial_response_ids):
+                vllm_input["prompt_token_ids"].extend(partial_response_ids)
+
+        if batch_predicted_length is not None:  # longest first
+            request_order = np.argsort(-batch_predicted_length, kind="stable").tolist()
+        else:
+            request_order = list(range(batch_size))
+
         # users can customize different sampling_params at different run
         with self.update_sampling_params(**prompts.meta_info):
-            completions: List[RequestOutput] = self.inference_engine.generate(
-                prompts=vllm_inputs, sampling_params=self.sampling_params, use_tqdm=self.use_tqdm
+            if batch_partial_response_ids is not None:
+                max_tokens = [self.config.response_length - len(ids) for ids in batch_partial_response_ids]
+                completions, finished, finish_time = self._generate_partial(vllm_inputs, request_order, max_tokens)
+                batch_response_ids = [
+                    np.concatenate((partial_response_ids, completion.outputs[0].token_ids), dtype=np.int64)
+                    if completion is not None
+                    else partial_response_ids
+                    for partial_response_ids, completion in zip(batch_partial_response_ids, completions)
+                ]
+            elif completion_callback is not None or self.config.auto_gpu_memory_utilization:  # measure concurrency
+                completions = self._generate_streaming(vllm_inputs, request_order, completion_callback, chunk_size)
+                batch_response_ids = [output.token_ids for completion in completions for output in completion.outputs]
+            else:
+                outputs: List[RequestOutput] = self.inference_engine.generate(
+                    prompts=[vllm_inputs[idx] for idx in request_order],
+                    sampling_params=self.sampling_params,
+                    use_tqdm=self.use_tqdm,
+                )
+                completions = [None] * batch_size
+                for idx, output in zip(request_order, outputs):
+                    completions[idx] = output
+
+                batch_response_ids = [output.token_ids for completion in completions for output in completion.outputs]
+
+            for completion in filter(None, completions):  # each of the n samples prefills the prompt
+                self.num_prompt_tokens += len(completion.prompt_token_ids) * len(completion.outputs)
+                self.num_cached_tokens += (completion.num_cached_tokens or 0) * len(completion.outputs)
+
+            # token ids fit in int32, the buffer is half the size of int64 before it is copied to the sequences
+            response_ids = VF.pad_2d_list_to_numpy(
+                batch_response_ids,
+                self.pad_token_id,
+                max_length=self.config.response_length,
+                dtype=np.int32,
             )
-            response_ids = [output.token_ids for completion in completions for output in completion.outputs]
-            response_ids = VF.pad_2d_list_to_length(
-                response_ids, self.pad_token_id, max_length=self.config.response_length
-            ).to(input_ids.device)
-
-            if self.sampling_params.n > 1:
-                batch_size = batch_size * self.sampling_params.n
-                input_ids = _repeat_interleave(input_ids, self.sampling_params.n)
-                attention_mask = _repeat_interleave(attention_mask, self.sampling_params.n)
-                position_ids = _repeat_interleave(position_ids, self.sampling_params.n)
-                if batch_multi_modal_data is not None:
-                    batch_multi_modal_data = _repeat_interleave(batch_multi_modal_data, self.sampling_params.n)
-
-        sequence_ids = torch.cat([input_ids, response_ids], dim=-1)
-        response_length = response_ids.size(1)
-        delta_position_id = torch.arange(1, response_length + 1, device=position_ids.device)
-        delta_position_id = delta_position_id.view(1, -1).expand(batch_size, -1)
-        if position_ids.dim() == 3:  # qwen2vl mrope
-            delta_position_id = delta_position_id.view(batch_size, 1, -1).expand(batch_size, 3, -1)
-
-        # prompt: left pad + response: right pad
-        # attention_mask: [0,0,0,0,1,1,1,1 | 1,1,1,0,0,0,0,0]
-        # position_ids:   [0,0,0,0,0,1,2,3 | 4,5,6,7,8,9,10,11]
-        response_position_ids = position_ids[..., -1:] + delta_position_id
-        position_ids = torch.cat([position_ids, response_position_ids], dim=-1)
-        response_mask = VF.get_response_mask(
-            response_ids=response_ids, eos_token_id=eos_token_id, dtype=attention_mask.dtype
-        )
-        attention_mask = torch.cat((attention_mask, response_mask), dim=-1)
-
-        # all the tp ranks should contain the same data here. data in all ranks are valid
-        batch = TensorDict(
-            {
-                "prompts": input_ids,
-                "responses": response_ids,
-                "input_ids": sequence_ids,  # here input_ids become the whole sentences
-                "attention_mask": attention_mask,
-                "response_mask": response_mask,
-                "position_ids": position_ids,
-            },
-            batch_size=batch_size,
-        )
+            repeat_times = self.sampling_params.n
+
+        if repeat_times > 1 and batch_multi_modal_data is not None:
+            # only the references are repeated, the images are shared by the responses of a prompt
+            batch_multi_modal_data = _repeat_interleave(batch_multi_modal_data, repeat_times)
+
+        batch = self._make_batch(input_ids, attention_mask, position_ids, response_ids, eos_token_id, repeat_times)
         if batch_multi_modal_data is not None:
             non_tensor_batch = {"multi_modal_data": batch_multi_modal_data}
         else:
             non_tensor_batch = {}
 
+        if batch_partial_response_ids is not None:
+            non_tensor_batch["partial_response_ids"] = np.empty(len(batch_response_ids), dtype=object)
+            for idx, partial_response_ids in enumerate(batch_response_ids):  # avoid stacking equal-length arrays
+                non_tensor_batch["partial_response_ids"][idx] = partial_response_ids
+
+            non_tensor_batch["finished"] = finished
+            non_tensor_batch["finish_time"] = finish_time
+
         return DataProto(batch=batch, non_tensor_batch=non_tensor_batch, meta_info=prompts.meta_info)
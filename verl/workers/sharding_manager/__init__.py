@@ -13,9 +13,16 @@
 # limitations under the License.
 
 
+from ...utils.py_functional import is_package_available
 from .base import BaseShardingManager
 from .fsdp_ulysses import FSDPUlyssesShardingManager
-from .fsdp_vllm import FSDPVLLMShardingManager
+from .stub import StubShardingManager
 
 
-__all__ = ["BaseShardingManager", "FSDPUlyssesShardingManager", "FSDPVLLMShardingManager"]
+__all__ = ["BaseShardingManager", "FSDPUlyssesShardingManager", "StubShardingManager"]
+
+
+if is_package_available("vllm"):
+    from .fsdp_vllm import FSDPVLLMShardingManager
+
+    __all__ += ["FSDPVLLMShardingManager"]
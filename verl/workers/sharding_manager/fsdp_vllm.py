@@ -13,8 +13,9 @@
 # limitations under the License.
 
 import inspect
-import re
-from typing import Dict, Iterable, Tuple, Union
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import torch
 import torch.distributed as dist
@@ -22,16 +23,32 @@ from torch.distributed._tensor import DTensor
 from torch.distributed.checkpoint.state_dict import get_model_state_dict
 from torch.distributed.device_mesh import DeviceMesh
 from torch.distributed.fsdp.fully_sharded_data_parallel import FullyShardedDataParallel as FSDP
-from transformers import PreTrainedModel
+from torch.optim import Optimizer
 from vllm import LLM
 from vllm.distributed import parallel_state as vllm_ps
 
 from ...protocol import DataProto, all_gather_data_proto
-from ...utils.fsdp_utils import load_fsdp_model, offload_fsdp_model
-from ...utils.model_utils import print_gpu_memory_usage
+from ...utils.fsdp_utils import (
+    FrozenParamTracker,
+    WeightBucketLayout,
+    gather_weight_bucket,
+    get_weight_bucket_layout,
+    load_fsdp_model,
+    offload_fsdp_model,
+)
+from ...utils.model_utils import get_checkpoint_key_mapping, print_gpu_memory_usage
 from .base import BaseShardingManager
 
 
+@dataclass
+class WeightSyncPlan:
+    """The buckets of (state dict key, vllm key) to sync and their gather layouts, resolved once per model."""
+
+    buckets: List[List[Tuple[str, str]]]
+    layouts: List[WeightBucketLayout]
+    num_bytes: int
+
+
 class FSDPVLLMShardingManager(BaseShardingManager):
     def __init__(
         self,
@@ -39,12 +56,22 @@ class FSDPVLLMShardingManager(BaseShardingManager):
         inference_engine: LLM,
         device_mesh: DeviceMesh,
         use_param_offload: bool,
+        sync_bucket_size_mb: int = 512,
+        optimizer: Optional[Optimizer] = None,
     ):
         self.module = module
         self.inference_engine = inference_engine
         self.device_mesh = device_mesh
         self.use_param_offload = use_param_offload
+        self.sync_bucket_size = sync_bucket_size_mb * 1024**2
         self.loaded = False
+        self.sync_metrics: Dict[str, Any] = {}
+        self.sync_peak_memory = 0
+        # vllm keeps its weights across sleep level 1, so the frozen parameters only need to be synced once
+        self.frozen_params = FrozenParamTracker(module, optimizer)
+        self.full_sync_required = True
+        self.sync_plans: Dict[bool, WeightSyncPlan] = {}
+        self.memory_info: Dict[str, int] = {}  # measured before the weights are woken up
 
         self.world_size = dist.get_world_size()
         self.tp_size = vllm_ps.get_tensor_model_parallel_world_size()
@@ -63,50 +90,94 @@ class FSDPVLLMShardingManager(BaseShardingManager):
         self.gen_random_states = torch.cuda.get_rng_state()
         torch.cuda.set_rng_state(self.torch_random_states)
 
-    def _rename_weight_keys(self, actor_weights: Dict[str, Union[torch.Tensor, DTensor]], model: PreTrainedModel):
-        # convert state dict keys: https://github.com/huggingface/transformers/pull/38385
-        if not hasattr(model, "_checkpoint_conversion_mapping"):
-            return actor_weights
-
-        reverse_key_mapping = {v: k for k, v in model._checkpoint_conversion_mapping.items()}
-        original_weights = {}
-        for key, value in actor_weights.items():
-            for pattern, replacement in reverse_key_mapping.items():
-                replacement = replacement.lstrip("^")  # strip off un-needed chars and patterns
-                replacement = re.sub(r"\(.*\)", "", replacement)
-                key, n_replace = re.subn(pattern, replacement, key)
-                # Early exit of the loop
-                if n_replace > 0:
-                    break
-
-            original_weights[key] = value
+    def _make_sync_plan(self, actor_weights: Dict[str, Union[torch.Tensor, DTensor]]) -> WeightSyncPlan:
+        key_mapping = get_checkpoint_key_mapping(list(actor_weights.keys()), self.module._fsdp_wrapped_module)
+        buckets, bucket, bucket_size, num_bytes = [], [], 0, 0
+        for key, tensor in actor_weights.items():
+            bucket.append((key, key_mapping[key]))
+            tensor_size = tensor.numel() * tensor.element_size()  # size of the full tensor
+            bucket_size += tensor_size
+            num_bytes += tensor_size
+            if bucket_size >= self.sync_bucket_size:
+                buckets.append(bucket)
+                bucket, bucket_size = [], 0
+
+        if len(bucket) != 0:
+            buckets.append(bucket)
+
+        layouts = [get_weight_bucket_layout([(key, actor_weights[key]) for key, _ in bucket]) for bucket in buckets]
+        return WeightSyncPlan(buckets=buckets, layouts=layouts, num_bytes=num_bytes)
+
+    def _gather_bucket(
+        self,
+        actor_weights: Dict[str, Union[torch.Tensor, DTensor]],
+        bucket: List[Tuple[str, str]],
+        layout: Optional[WeightBucketLayout],
+    ) -> Tuple[List[Tuple[str, torch.Tensor]], List[dist.Work]]:
+        if self.world_size == 1:
+            return [(new_key, actor_weights[key]) for key, new_key in bucket], []
 
-        return original_weights
+        return gather_weight_bucket([(new_key, actor_weights[key]) for key, new_key in bucket], layout)
 
     def _make_weight_iterator(
-        self, actor_weights: Dict[str, Union[torch.Tensor, DTensor]]
+        self, actor_weights: Dict[str, Union[torch.Tensor, DTensor]], plan: WeightSyncPlan
     ) -> Iterable[Tuple[str, torch.Tensor]]:
-        for name, tensor in actor_weights.items():
-            yield name, tensor.full_tensor() if self.world_size != 1 else tensor
+        # at most two buckets are gathered at a time, the next one is gathered while vllm loads the current one
+        buckets = iter(zip(plan.buckets, plan.layouts))
+        next_bucket, next_works = self._gather_bucket(actor_weights, *next(buckets, ([], None)))
+        while len(next_bucket) != 0:
+            bucket, works = next_bucket, next_works
+            next_bucket, next_works = self._gather_bucket(actor_weights, *next(buckets, ([], None)))
+            for work in works:
+                work.wait()
+
+            self.sync_peak_memory = max(self.sync_peak_memory, torch.cuda.memory_allocated())
+            yield from bucket
+            del bucket, works
 
     def _sync_weight_to_vllm(self):
+        start_time = time.perf_counter()
+        self.sync_peak_memory = torch.cuda.memory_allocated()
         if self.use_param_offload:
             load_fsdp_model(self.module)
 
         actor_weights = get_model_state_dict(self.module)
-        actor_weights = self._rename_weight_keys(actor_weights, self.module._fsdp_wrapped_module)
+        if self.frozen_params.update():  # the parameters frozen before may have been changed
+            self.sync_plans.pop(False, None)
+            self.full_sync_required = True
+
+        # the plans of the full sync and the trainable parameters are built once and reused afterwards
+        full_sync, self.full_sync_required = self.full_sync_required, False
+        if full_sync not in self.sync_plans:
+            if not full_sync:
+                frozen_param_names = self.frozen_params.frozen_param_names
+                actor_weights = {k: v for k, v in actor_weights.items() if k not in frozen_param_names}
+
+            self.sync_plans[full_sync] = self._make_sync_plan(actor_weights)
+
+        plan = self.sync_plans[full_sync]
         print_gpu_memory_usage("After gather model weights in sharding manager")
 
         model = self.inference_engine.llm_engine.model_executor.driver_worker.worker.model_runner.model
-        model.load_weights(self._make_weight_iterator(actor_weights))
+        model.load_weights(self._make_weight_iterator(actor_weights, plan))
 
         del actor_weights
         if self.use_param_offload:
             offload_fsdp_model(self.module)
 
+        torch.cuda.synchronize()
+        self.sync_metrics = {
+            "perf/weight_sync_time": time.perf_counter() - start_time,
+            "perf/weight_sync_peak_memory_gb": self.sync_peak_memory / (1024**3),
+            "perf/weight_sync_size_gb": plan.num_bytes / (1024**3),
+        }
         torch.cuda.empty_cache()
         print_gpu_memory_usage("After sync model weights in sharding manager")
 
+    def require_full_sync(self):
+        """Sync all the parameters next time, e.g., the frozen parameters are changed by loading a checkpoint."""
+        self.full_sync_required = True
+
     def load_vllm_and_sync_weights(self):
         """Load vllm engine and sync model weights to vllm model."""
         # NOTE: Basically, we only need `torch.cuda.empty_cache()` before vllm wake_up and
@@ -122,7 +193,10 @@ class FSDPVLLMShardingManager(BaseShardingManager):
 
         print_gpu_memory_usage("Before vllm wake up in sharding manager")
         if "tags" in inspect.signature(self.inference_engine.wake_up).parameters:
+            free_bytes, total_bytes = torch.cuda.mem_get_info()
             self.inference_engine.wake_up(tags=["weights"])
+            weight_bytes = free_bytes - torch.cuda.mem_get_info()[0]
+            self.memory_info = {"free_bytes": free_bytes, "total_bytes": total_bytes, "weight_bytes": weight_bytes}
         else:
             self.inference_engine.wake_up()
 
@@ -131,6 +205,9 @@ class FSDPVLLMShardingManager(BaseShardingManager):
         if "tags" in inspect.signature(self.inference_engine.wake_up).parameters:
             self.inference_engine.wake_up(tags=["kv_cache"])
 
+        # the cached kv blocks are computed by the old weights and discarded during sleep
+        self.inference_engine.reset_prefix_cache()
+
         print_gpu_memory_usage("After vllm wake up in sharding manager")
         # important: need to manually set the random states of each tp to be identical.
         if self.device_mesh is not None:
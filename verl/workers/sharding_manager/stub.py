@@ -0,0 +1,36 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict
+
+from .base import BaseShardingManager
+
+
+class StubShardingManager(BaseShardingManager):
+    """Sharding manager of the stub rollout, there are no engine weights to load or sync."""
+
+    def __init__(self):
+        self.sync_metrics: Dict[str, Any] = {}
+        self.memory_info: Dict[str, int] = {}
+        self.freed_bytes = 0
+        self.tp_rank = 0  # every rank generates its own data
+
+    def load_vllm_and_sync_weights(self):
+        pass
+
+    def offload_vllm(self):
+        pass
+
+    def require_full_sync(self):
+        pass